@@ -0,0 +1,33 @@
+"""
+Benchmarks. Run from the project folder, e.g.:
+
+    $ python -m benchmarks.serializers
+
+They run against a throwaway test database, never the configured one.
+"""
+import os
+
+import django
+
+
+def setup(test_db_name=None):
+    """
+    Configures Django and creates the test database (in memory unless a file
+    name is given); returns its teardown.
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mireis.settings')
+    django.setup()
+    from django.db import connection
+    if test_db_name:
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = test_db_name
+    from django.test.utils import (
+        setup_test_environment,
+        teardown_test_environment
+    )
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+
+    def teardown():
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+    return teardown
@@ -0,0 +1,162 @@
+"""
+Requests per second of the JSON transaction list under WSGI and ASGI, with
+slow clients.
+
+    $ python -m benchmarks.asgi_load [--requests 400] [--concurrency 64] [--wsgi-threads 4] [--client-delay 0.05]
+
+Both handlers are driven in process, no HTTP server involved. A slow client
+is modelled by a delay while the response is sent: a WSGI worker thread is
+blocked for that time, an ASGI worker just awaits it. WSGI gets a pool of
+--wsgi-threads workers, like a threaded WSGI server; ASGI gets one event loop
+with --concurrency requests in flight.
+"""
+import argparse
+import asyncio
+import datetime
+import io
+import os
+import tempfile
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from . import setup
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)] * 1000 if values else 0
+
+
+def report(label, elapsed, latencies, statuses):
+    errors = sum(1 for s in statuses if s != 200)
+    print(
+        f'{label:<5} {len(latencies) / elapsed:8.1f} req/s '
+        f'p50={percentile(latencies, 0.5):7.1f} ms p95={percentile(latencies, 0.95):7.1f} ms errors={errors}'
+    )
+
+
+def run_wsgi(path, cookie, args):
+    from django.core.handlers.wsgi import WSGIHandler
+    handler = WSGIHandler()
+
+    def request(_):
+        start = time.perf_counter()
+        status = []
+        environ = {
+            'REQUEST_METHOD': 'GET',
+            'PATH_INFO': path,
+            'QUERY_STRING': '',
+            'SERVER_NAME': 'testserver',
+            'SERVER_PORT': '80',
+            'HTTP_HOST': 'testserver',
+            'HTTP_COOKIE': cookie,
+            'wsgi.input': io.BytesIO(b''),
+            'wsgi.url_scheme': 'http',
+            'wsgi.errors': io.StringIO(),
+        }
+        body = b''.join(handler(environ, lambda s, headers: status.append(int(s.split()[0]))))
+        # Slow client reading the response: the worker waits with it
+        time.sleep(args.client_delay)
+        assert body
+        return time.perf_counter() - start, status[0]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.wsgi_threads) as pool:
+        results = list(pool.map(request, range(args.requests)))
+    report('WSGI', time.perf_counter() - start, [r[0] for r in results], [r[1] for r in results])
+
+
+def run_asgi(path, cookie, args):
+    from django.core.handlers.asgi import ASGIHandler
+    handler = ASGIHandler()
+
+    async def request(semaphore):
+        async with semaphore:
+            start = time.perf_counter()
+            status = []
+            scope = {
+                'type': 'http',
+                'asgi': {'version': '3.0'},
+                'http_version': '1.1',
+                'method': 'GET',
+                'scheme': 'http',
+                'path': path,
+                'raw_path': path.encode(),
+                'query_string': b'',
+                'root_path': '',
+                'headers': [(b'host', b'testserver'), (b'cookie', cookie.encode())],
+                'client': ('127.0.0.1', 50000),
+                'server': ('testserver', 80),
+            }
+
+            async def receive():
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+                elif not message.get('more_body'):
+                    # Slow client reading the response: only this task waits
+                    await asyncio.sleep(args.client_delay)
+
+            await handler(scope, receive, send)
+            return time.perf_counter() - start, status[0]
+
+    async def main():
+        semaphore = asyncio.Semaphore(args.concurrency)
+        return await asyncio.gather(*(request(semaphore) for _ in range(args.requests)))
+
+    start = time.perf_counter()
+    results = asyncio.run(main())
+    report('ASGI', time.perf_counter() - start, [r[0] for r in results], [r[1] for r in results])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=64, help='ASGI requests in flight')
+    parser.add_argument('--wsgi-threads', type=int, default=4)
+    parser.add_argument('--client-delay', type=float, default=0.05, help='Seconds a client takes to read a response')
+    parser.add_argument('--rows', type=int, default=5000)
+    args = parser.parse_args()
+    # Worker threads need their own connections to a file database
+    teardown = setup(os.path.join(tempfile.mkdtemp(), 'asgi_load.sqlite3'))
+    from django.db import connections
+    try:
+        from django.conf import settings
+        from django.contrib.sessions.backends.db import SessionStore
+        from django.urls import reverse
+        from core.models import (
+            User,
+            Transaction
+        )
+        settings.ALLOWED_HOSTS = ['testserver']
+        user = User.objects.create(username='bench@mireis.app', password='')
+        Transaction.objects.bulk_create(
+            Transaction(
+                username=user,
+                date=datetime.date(2010, 1, 1) + datetime.timedelta(days=i % 3650),
+                description=f'Transaction {i}',
+                amount=Decimal('1.00'),
+                check_code='',
+                checked=0
+            ) for i in range(args.rows)
+        )
+        session = SessionStore()
+        session['user'] = {'user_id': user.id, 'username': user.username}
+        session.create()
+        cookie = f'{settings.SESSION_COOKIE_NAME}={session.session_key}'
+        path = reverse('core:transactions')
+        connections.close_all()
+        print(f'{args.requests} requests to {path}, client delay {args.client_delay * 1000:.0f} ms')
+        run_wsgi(path, cookie, args)
+        run_asgi(path, cookie, args)
+    finally:
+        connections.close_all()
+        teardown()
+
+
+if __name__ == '__main__':
+    main()
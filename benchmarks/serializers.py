@@ -0,0 +1,81 @@
+"""
+Compares the precompiled RowSerializer with the model_row_as_dict it replaced.
+
+    $ python -m benchmarks.serializers [--rows 100000]
+"""
+import argparse
+import datetime
+import time
+
+from decimal import Decimal
+
+from . import setup
+
+
+def legacy_model_row_as_dict(model):
+    # core.lib.utils.model_row_as_dict before the serializers module
+    from django.db import models
+    result = None
+    if isinstance(model, models.Model):
+        result = {}
+        for f in model._meta.fields:
+            value = getattr(model, f.name)
+            if value is not None:
+                result[f.name] = str(value)
+            else:
+                result[f.name] = value
+    return result
+
+
+def timed(label, f, rows):
+    start = time.perf_counter()
+    result = f()
+    elapsed = time.perf_counter() - start
+    print(f'{label:<45} {elapsed * 1000:10.1f} ms {rows / elapsed:12.0f} rows/s')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=100000)
+    args = parser.parse_args()
+    teardown = setup()
+    try:
+        from core.lib import serializers
+        from core.models import (
+            User,
+            Account,
+            Transaction
+        )
+        user = User.objects.create(username='bench@mireis.app', password='')
+        account = Account.objects.create(username=user, name='Bench')
+        start = datetime.date(2010, 1, 1)
+        Transaction.objects.bulk_create(
+            (
+                Transaction(
+                    username=user,
+                    account=account,
+                    date=start + datetime.timedelta(days=i % 3650),
+                    description=f'Transaction {i}',
+                    amount=Decimal(i % 10000) / 100,
+                    check_code='',
+                    checked=i % 2
+                )
+                for i in range(args.rows)
+            ),
+            batch_size=1000
+        )
+        qs = Transaction.objects.order_by('id')
+        serializer = serializers.serializer_for(Transaction)
+        print(f'{args.rows} transactions')
+        instances = list(qs.select_related('username', 'account'))
+        timed('legacy model_row_as_dict (related loaded)', lambda: [legacy_model_row_as_dict(r) for r in instances], args.rows)
+        timed('RowSerializer.from_model (instances)', lambda: [serializer.from_model(r) for r in instances], args.rows)
+        timed('legacy, queryset incl. fetch (select_related)', lambda: [legacy_model_row_as_dict(r) for r in qs.select_related('username', 'account')], args.rows)
+        timed('RowSerializer.serialize, incl. fetch', lambda: serializer.serialize(qs), args.rows)
+    finally:
+        teardown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""
+Read/write throughput of concurrent workers on a SQLite file, with the
+default connection profile against the tuned one (core.lib.sqlite).
+
+    $ python -m benchmarks.sqlite_concurrency [--workers 8] [--seconds 5] [--writes 0.2]
+
+"default" is SQLite's rollback journal with a connection opened per request,
+"tuned" is settings.SQLITE_PRAGMAS (WAL, ...) with persistent connections.
+Each worker loops over requests, reading a journal page or saving a
+transaction, and closes its connection after each one when CONN_MAX_AGE is 0,
+as Django does at the end of a request.
+"""
+import argparse
+import datetime
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from decimal import Decimal
+
+import django
+
+from . import setup
+
+PROFILES = ('default', 'tuned')
+# settings.SQLITE_PRAGMAS as configured, read in main()
+TUNED_PRAGMAS = {}
+
+
+def configure(profile):
+    from django.conf import settings
+    from django.db import connection
+    if profile == 'default':
+        settings.SQLITE_PRAGMAS = {'journal_mode': 'delete'}
+        connection.settings_dict['CONN_MAX_AGE'] = 0
+    else:
+        settings.SQLITE_PRAGMAS = dict(TUNED_PRAGMAS)
+        connection.settings_dict['CONN_MAX_AGE'] = 600
+
+
+def worker(seconds, write_ratio, seed, results):
+    from django.db import (
+        connection,
+        OperationalError,
+        transaction as db_transaction
+    )
+    from core.models import Transaction
+    rnd = random.Random(seed)
+    reads = writes = errors = 0
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            if rnd.random() < write_ratio:
+                with db_transaction.atomic():
+                    Transaction.objects.create(
+                        username_id=1,
+                        date=datetime.date(2020, 1, 1),
+                        description='Concurrent write',
+                        amount=Decimal('1.00'),
+                        check_code='',
+                        checked=0
+                    )
+                writes += 1
+            else:
+                list(Transaction.objects.filter(username_id=1).order_by('-date', '-id')[:50])
+                reads += 1
+            latencies.append(time.perf_counter() - start)
+        except OperationalError:
+            # database is locked
+            errors += 1
+        if not connection.settings_dict['CONN_MAX_AGE']:
+            connection.close()
+    connection.close()
+    results.put((reads, writes, errors, latencies))
+
+
+def run(profile, args):
+    path = os.path.join(tempfile.mkdtemp(), f'{profile}.sqlite3')
+    teardown = setup(path)
+    try:
+        configure(profile)
+        from django.db import (
+            connection,
+            connections
+        )
+        from core.models import (
+            User,
+            Transaction
+        )
+        # The pragmas only apply to new connections
+        connection.close()
+        user = User.objects.create(username='bench@mireis.app', password='')
+        Transaction.objects.bulk_create(
+            Transaction(
+                username=user,
+                date=datetime.date(2010, 1, 1) + datetime.timedelta(days=i % 3650),
+                description=f'Transaction {i}',
+                amount=Decimal('1.00'),
+                check_code='',
+                checked=0
+            ) for i in range(args.rows)
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            journal_mode = cursor.fetchone()[0]
+        connections.close_all()
+        results = multiprocessing.Queue()
+        workers = [
+            multiprocessing.Process(target=worker, args=(args.seconds, args.writes, i, results))
+            for i in range(args.workers)
+        ]
+        for p in workers:
+            p.start()
+        collected = [results.get() for _ in workers]
+        for p in workers:
+            p.join()
+    finally:
+        teardown()
+    reads = sum(r[0] for r in collected)
+    writes = sum(r[1] for r in collected)
+    errors = sum(r[2] for r in collected)
+    latencies = sorted(t for r in collected for t in r[3])
+    p95 = latencies[int(len(latencies) * 0.95)] * 1000 if latencies else 0
+    print(
+        f'{profile:<8} journal={journal_mode:<7} '
+        f'reads/s={reads / args.seconds:9.0f} writes/s={writes / args.seconds:8.0f} '
+        f'locked={errors:5d} p95={p95:7.1f} ms'
+    )
+
+
+def main():
+    global TUNED_PRAGMAS
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--writes', type=float, default=0.2, help='Share of write requests')
+    parser.add_argument('--rows', type=int, default=20000, help='Transactions created before the run')
+    args = parser.parse_args()
+    multiprocessing.set_start_method('fork')
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mireis.settings')
+    django.setup()
+    from django.conf import settings
+    TUNED_PRAGMAS = dict(settings.SQLITE_PRAGMAS)
+    print(f'{args.workers} workers, {args.seconds}s, {args.writes:.0%} writes')
+    for profile in PROFILES:
+        run(profile, args)
+
+
+if __name__ == '__main__':
+    main()
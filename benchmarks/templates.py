@@ -0,0 +1,83 @@
+"""
+Render time of journal.html and account-list.html with Django templates and
+with Jinja2, plus the cost of loading a template in a new process with and
+without the Jinja2 bytecode cache.
+
+    $ python -m benchmarks.templates [--renders 2000] [--accounts 50]
+"""
+import argparse
+import tempfile
+import time
+
+from decimal import Decimal
+
+from . import setup
+
+PAGES = ('journal.html', 'account-list.html')
+
+
+def timed(label, f, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        f()
+    elapsed = time.perf_counter() - start
+    print(f'{label:<45} {elapsed / n * 1e6:10.1f} us')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--renders', type=int, default=2000)
+    parser.add_argument('--accounts', type=int, default=50)
+    args = parser.parse_args()
+    teardown = setup()
+    try:
+        from django.conf import settings
+        from django.contrib.messages.storage.fallback import FallbackStorage
+        from django.contrib.sessions.backends.db import SessionStore
+        from django.template import engines
+        from django.test import RequestFactory
+        from core.lib import usercache
+        from core.models import (
+            User,
+            Account
+        )
+        from mireis.jinja2 import environment
+
+        user = User.objects.create(username='bench@mireis.app', password='')
+        Account.objects.bulk_create(
+            Account(username=user, name=f'Account {i}', agency='0001', number=str(i), balance=Decimal(i))
+            for i in range(args.accounts)
+        )
+        request = RequestFactory().get('/')
+        request.session = SessionStore()
+        request.session['user'] = {'user_id': user.id, 'username': user.username}
+        request._messages = FallbackStorage(request)
+        context = {'account_list': usercache.accounts(user.id)}
+        print(f'{args.accounts} accounts, {args.renders} renders')
+        for page in PAGES:
+            django_template = engines['django'].get_template(f'core/{page}')
+            jinja2_template = engines['jinja2'].get_template(f'core/{page}.j2')
+            timed(f'{page} Django templates', lambda: django_template.render(context, request), args.renders)
+            timed(f'{page} Jinja2', lambda: jinja2_template.render(context, request), args.renders)
+
+        # A new environment per load stands for a new worker process
+        loads = max(args.renders // 20, 1)
+        options = {'loader': engines['jinja2'].env.loader}
+        timed(
+            'load journal.html.j2, compiling',
+            lambda: environment(**options, bytecode_cache=None).get_template('core/journal.html.j2'),
+            loads
+        )
+        settings.JINJA2_BYTECODE_CACHE_DIR = tempfile.mkdtemp()
+        environment(**options).get_template('core/journal.html.j2')
+        timed(
+            'load journal.html.j2, bytecode cache',
+            lambda: environment(**options).get_template('core/journal.html.j2'),
+            loads
+        )
+    finally:
+        teardown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+"""
+Response time, queries and memory of every view, on seeded data.
+
+    $ python -m benchmarks.views [--transactions 20000] [--iterations 30] [--only transactions,journal] [--output results.json]
+
+The database is filled by the seed_benchmark command (one user). Each view is
+requested --iterations times through the test client and reported with its
+p50/p95/p99 latency, the queries of one request and the peak memory traced
+while serving it. Views added to core.urls without a request spec here are
+reported as missing, so the list stays complete.
+"""
+import argparse
+import datetime
+import io
+import json
+import subprocess
+import time
+import tracemalloc
+
+from . import setup
+
+ACCOUNTS = 3
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)] * 1000 if values else 0
+
+
+def statement_csv(rows):
+    lines = ['date,description,amount,tags']
+    lines.extend(f'2020-01-{i % 28 + 1:02d},Imported {i},-{i % 100 + 1}.50,bench' for i in range(rows))
+    return '\n'.join(lines).encode()
+
+
+def reconcile_csv(transactions):
+    # Each line a day later than its transaction, with a partly different description
+    lines = ['date,description,amount']
+    lines.extend(
+        f'{(t.date + datetime.timedelta(days=1)).isoformat()},BANK {t.description},{t.amount}' for t in transactions
+    )
+    return '\n'.join(lines).encode()
+
+
+class Context:
+    """Objects the request specs refer to."""
+
+    def __init__(self, client, user):
+        from core.models import (
+            Account,
+            Transaction
+        )
+        self.client = client
+        self.user = user
+        self.account = Account.objects.filter(username=user).order_by('id').first()
+        qs = Transaction.objects.filter(username=user, account=self.account).order_by('date', 'id')
+        # Edits in the middle of the history, so half the balances shift
+        self.transaction = qs[qs.count() // 2]
+        self.statement = statement_csv(100)
+        self.reconcile_statement = reconcile_csv(
+            Transaction.objects.filter(username=user, account=self.account, checked=0).order_by('-date')[:1000]
+        )
+
+    def login(self):
+        from core.management.commands.seed_benchmark import PASSWORD
+        from django.urls import reverse
+        self.client.post(reverse('core:login'), {'username': self.user.username, 'password': PASSWORD})
+
+    def new_account(self):
+        from core.models import Account
+        return Account.objects.create(username=self.user, name='Throwaway', agency='0000', number='0')
+
+
+def specs():
+    """
+    URL name: function of (context) returning (method, args, data, extra
+    client arguments) for one request. A spec may also set up state first.
+    """
+    from django.core.files.uploadedfile import SimpleUploadedFile
+
+    def get(args=None, data=None):
+        return lambda ctx: ('get', args or [], data or {}, {})
+
+    def transaction_form(ctx):
+        return {
+            'date': ctx.transaction.date.isoformat(),
+            'description': 'Edited',
+            'amount': '-10.00',
+            'checked': '0',
+            'account_id': ctx.account.id,
+            'tags': 'food, bench',
+        }
+
+    def batch_body(ctx):
+        body = json.dumps([
+            {'action': 'update', 'id': ctx.transaction.id, 'data': transaction_form(ctx)},
+            {'action': 'create', 'data': dict(transaction_form(ctx), description='Batch new')},
+        ])
+        return 'post', [], body, {'content_type': 'application/json'}
+
+    def import_statement(ctx):
+        upload = SimpleUploadedFile('statement.csv', ctx.statement, content_type='text/csv')
+        return 'post', [], {'statement': upload, 'account_id': ctx.account.id}, {}
+
+    def reconcile_statement(ctx):
+        # A dry run, so every iteration matches the same lines
+        upload = SimpleUploadedFile('statement.csv', ctx.reconcile_statement, content_type='text/csv')
+        return 'post', [], {'statement': upload, 'account_id': ctx.account.id, 'dry_run': '1'}, {}
+
+    def del_account(ctx):
+        return 'get', [ctx.new_account().id], {}, {}
+
+    def del_account_status(ctx):
+        from core.lib import purge
+        account = ctx.new_account()
+        purge.delete_account(account)
+        return 'get', [account.id], {}, {}
+
+    def transaction_events(ctx):
+        # The catch-up served without ASGI, from where a journal page starts
+        from core.lib import events
+        return 'get', [], {'since': events.position(ctx.user.id).cursor}, {}
+
+    def job(ctx):
+        from core.lib import jobs
+        return 'get', [jobs.enqueue('rebuild-rollups', owner_id=ctx.user.id, user_id=ctx.user.id).id], {}, {}
+
+    return {
+        'index': get(),
+        'register': get(),
+        'login': lambda ctx: ('post', [], {'username': ctx.user.username, 'password': 'wrong'}, {}),
+        'logout': get(),
+        'journal': get(),
+        'account-list': get(),
+        'add-account': get(),
+        'edit-account': lambda ctx: ('get', [ctx.account.id], {}, {}),
+        'save-account-add': lambda ctx: ('post', [], {
+            'account_name': 'Bench', 'account_agency': '0001', 'account_number': '1'
+        }, {}),
+        'save-account-edit': lambda ctx: ('post', [ctx.account.id], {
+            'account_name': ctx.account.name, 'account_agency': ctx.account.agency,
+            'account_number': ctx.account.number
+        }, {}),
+        'del-account': del_account,
+        'del-account-status': del_account_status,
+        'transactions': get(data={'limit': 50}),
+        'search-transactions': get(data={'q': 'super'}),
+        'transaction-summary': get(),
+        'export-transactions': get(data={'format': 'csv'}),
+        'transaction-events': transaction_events,
+        'tag-summary': get(),
+        'report-totals': get(data={'by': 'tag'}),
+        'report-trend': get(data={'period': 'month', 'window': 6}),
+        'report-top-expenses': get(),
+        'transaction': lambda ctx: ('get', [ctx.transaction.id], {}, {}),
+        'save-transaction-add': lambda ctx: ('post', [], transaction_form(ctx), {}),
+        'save-transaction-edit': lambda ctx: ('post', [ctx.transaction.id], transaction_form(ctx), {}),
+        'save-transactions': batch_body,
+        'import-statement': import_statement,
+        'reconcile-statement': reconcile_statement,
+        'jobs': get(data={'active': '1'}),
+        'job': job,
+        'metrics': get(),
+    }
+
+
+def request(ctx, name, spec):
+    from django.urls import reverse
+    method, args, data, extra = spec(ctx)
+    start = time.perf_counter()
+    response = getattr(ctx.client, method)(reverse(f'core:{name}', args=args), data, **extra)
+    if getattr(response, 'streaming', False):
+        # Streamed bodies are produced while read
+        for _ in response.streaming_content:
+            pass
+    elapsed = time.perf_counter() - start
+    if name == 'logout':
+        ctx.login()
+    if response.status_code >= 400:
+        raise RuntimeError(f'{name}: HTTP {response.status_code}')
+    if response.get('Content-Type') == 'application/json' and response.json().get('error_message'):
+        raise RuntimeError(f'{name}: {response.json()["error_message"]}')
+    return elapsed
+
+
+def measure(ctx, name, spec, iterations):
+    from django.db import (
+        connection,
+        reset_queries
+    )
+    from django.test.utils import CaptureQueriesContext
+    # Warm up, counting the queries of a request (request_started empties
+    # the query log, so it must start empty too)
+    reset_queries()
+    with CaptureQueriesContext(connection) as queries:
+        request(ctx, name, spec)
+    # Taken now: the captured list is a slice of a log the next requests empty
+    query_count = len(queries)
+    tracemalloc.start()
+    request(ctx, name, spec)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    latencies = [request(ctx, name, spec) for _ in range(iterations)]
+    return {
+        'p50_ms': round(percentile(latencies, 0.5), 2),
+        'p95_ms': round(percentile(latencies, 0.95), 2),
+        'p99_ms': round(percentile(latencies, 0.99), 2),
+        'queries': query_count,
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--transactions', type=int, default=20000, help='Seeded transactions')
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--only', help='Comma separated URL names')
+    parser.add_argument('--output', help='JSON file for the results')
+    parser.add_argument('--profiling', action='store_true', help='With the profiling middleware on')
+    args = parser.parse_args()
+    teardown = setup()
+    try:
+        from django.conf import settings
+        from django.core.management import call_command
+        from django.test import Client
+        from core import urls
+        from core.models import User
+        call_command(
+            'seed_benchmark', users=1, accounts=ACCOUNTS, transactions=args.transactions, stdout=io.StringIO()
+        )
+        # Offloaded views on the main thread's connection, so their queries are counted
+        settings.ASYNC_VIEWS_THREAD_SENSITIVE = True
+        # Deleted accounts stay unpurged, with no worker running
+        settings.PURGE_IN_BACKGROUND = False
+        settings.PROFILING = args.profiling
+        ctx = Context(Client(), User.objects.get(username='bench0@mireis.app'))
+        ctx.login()
+        all_specs = specs()
+        names = [pattern.name for pattern in urls.urlpatterns]
+        missing = [name for name in names if name not in all_specs]
+        if args.only:
+            names = [name for name in args.only.split(',') if name in all_specs]
+        if not args.profiling:
+            names = [name for name in names if name != 'metrics']
+        print(f'{args.transactions} transactions, {args.iterations} iterations per view')
+        print(f'{"view":<24} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"queries":>8} {"peak KB":>9}')
+        results = {}
+        for name in names:
+            if name not in all_specs:
+                continue
+            result = results[name] = measure(ctx, name, all_specs[name], args.iterations)
+            print(
+                f'{name:<24} {result["p50_ms"]:9.2f} {result["p95_ms"]:9.2f} {result["p99_ms"]:9.2f} '
+                f'{result["queries"]:8d} {result["peak_kb"]:9.1f}'
+            )
+        for name in missing:
+            print(f'{name:<24} no request spec in benchmarks/views.py')
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump({
+                    'commit': git_commit(),
+                    'transactions': args.transactions,
+                    'iterations': args.iterations,
+                    'views': results,
+                    'missing': missing,
+                }, f, indent=2)
+    finally:
+        teardown()
+
+
+if __name__ == '__main__':
+    main()
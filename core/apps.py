@@ -1,5 +1,28 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
+
+
+def install_search(sender, using, **kwargs):
+    from .lib import search
+    search.install(using)
 
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        from . import (  # noqa: F401
+            checks,
+            signals,
+            tasks
+        )
+        from .lib import (
+            profiling,
+            sqlite
+        )
+        connection_created.connect(sqlite.apply_pragmas)
+        # Before any connection is made, so all of them are covered. The hooks
+        # do nothing until ProfilingMiddleware binds a profile to a request.
+        profiling.install()
+        post_migrate.connect(install_search, sender=self)
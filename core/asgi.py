@@ -0,0 +1,169 @@
+"""
+The live journal stream, in front of Django under ASGI.
+
+route() serves GETs of the transaction-events URL itself and hands every
+other request to Django. Django 3.2 sends a streamed response from a sync
+iterator, so each open tab would hold a thread for as long as it stays;
+here a tab is a coroutine waiting on its events.Subscription. It is first
+sent what it missed after its since cursor (Last-Event-ID when it connects
+again), then the user's events as they are published, with a keep-alive
+comment every EVENTS_HEARTBEAT seconds, when the user's cache version is
+also compared with the last one sent, for the changes made elsewhere.
+Without ASGI the same URL answers with the catch-up alone (core.views).
+
+Django itself is served by ASGIHandler, which reads streamed responses (the
+transaction export) in the views' thread rather than in the event loop.
+"""
+import asyncio
+
+from importlib import import_module
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers import asgi as asgi_handler
+from django.http.cookie import parse_cookie
+from django.urls import reverse
+
+from .lib import (
+    events,
+    usercache
+)
+from .views import in_thread
+
+KEEP_ALIVE = b': keep-alive\n\n'
+# Bytes of a streamed response read per trip to its thread
+STREAM_READ_SIZE = 64 * 1024
+
+
+def session_user_id(cookies):
+    """The logged user's id of the session cookie, None when there is none."""
+    key = cookies.get(settings.SESSION_COOKIE_NAME)
+    if not key:
+        return None
+    session = import_module(settings.SESSION_ENGINE).SessionStore(key)
+    return session.get('user', {}).get('user_id')
+
+
+async def wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def stream(scope, receive, send):
+    headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+    user_id = await in_thread(session_user_id)(parse_cookie(headers.get('cookie', '')))
+    if user_id is None:
+        await send({'type': 'http.response.start', 'status': 403, 'headers': [(b'content-type', b'text/plain')]})
+        await send({'type': 'http.response.body', 'body': b'You must be logged in to access this resource'})
+        return
+
+    async def write(data, more_body=True):
+        await send({'type': 'http.response.body', 'body': data, 'more_body': more_body})
+
+    query = parse_qs(scope['query_string'].decode('latin-1'))
+    cursor = headers.get('last-event-id') or query.get('since', [None])[0]
+    # Before the catch-up, so nothing published meanwhile is missed
+    subscription = events.subscribe(user_id)
+    disconnect = asyncio.ensure_future(wait_disconnect(receive))
+    get = None
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                # Proxies must not hold the events back
+                (b'x-accel-buffering', b'no'),
+            ]
+        })
+        if cursor:
+            sent = await in_thread(events.catch_up)(user_id, cursor)
+        else:
+            sent = [await in_thread(events.position)(user_id)]
+        # Nothing to catch up with: the client is where its cursor says
+        last = sent[-1] if sent else events.at(cursor)
+        await write(f'retry: {settings.EVENTS_RETRY}\n\n'.encode() + ''.join(e.encode() for e in sent).encode())
+        while True:
+            get = get or asyncio.ensure_future(subscription.queue.get())
+            done, _ = await asyncio.wait(
+                {get, disconnect}, timeout=settings.EVENTS_HEARTBEAT, return_when=asyncio.FIRST_COMPLETED
+            )
+            if disconnect in done:
+                return
+            if get in done:
+                event, get = get.result(), None
+                if subscription.overflowed:
+                    while not subscription.queue.empty():
+                        subscription.queue.get_nowait()
+                    subscription.overflowed = False
+                    event = await in_thread(events.reset)(user_id)
+                elif event.sequence <= last.sequence:
+                    # Sent with the catch-up already
+                    continue
+            elif await in_thread(usercache.version)(user_id) != last.version:
+                event = await in_thread(events.reset)(user_id)
+            else:
+                await write(KEEP_ALIVE)
+                continue
+            last = event
+            await write(event.encode().encode())
+    finally:
+        events.unsubscribe(subscription)
+        for task in (get, disconnect):
+            if task is not None:
+                task.cancel()
+
+
+def read_parts(parts, size=STREAM_READ_SIZE):
+    """The next parts of a streamed response, about size bytes of them; [] at its end."""
+    batch = []
+    length = 0
+    for part in parts:
+        batch.append(part)
+        length += len(part)
+        if length >= size:
+            break
+    return batch
+
+
+class ASGIHandler(asgi_handler.ASGIHandler):
+    """
+    Django's handler, with streamed responses read in the thread of the
+    sync views. Django 3.2 iterates them in the event loop, where the
+    export's database reads raise SynchronousOnlyOperation.
+    """
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+        parts = iter(response)
+        # Django sends the headers and the closing message, the body goes in between
+        response.streaming_content = ()
+        # thread_sensitive, as the view ran: the export's server side cursor
+        # belongs to the connection of that thread
+        read = sync_to_async(read_parts, thread_sensitive=True)
+
+        async def send_body(message):
+            if message['type'] == 'http.response.body' and not message.get('more_body'):
+                while True:
+                    batch = await read(parts)
+                    if not batch:
+                        break
+                    for chunk, _ in self.chunk_bytes(b''.join(batch)):
+                        await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send(message)
+
+        await super().send_response(response, send_body)
+
+
+def route(django_application):
+    """The ASGI application: the live stream at its URL, Django for the rest."""
+    path = reverse('core:transaction-events')
+
+    async def application(scope, receive, send):
+        if scope['type'] == 'http' and scope['method'] == 'GET' and scope['path'] == path:
+            return await stream(scope, receive, send)
+        return await django_application(scope, receive, send)
+    return application
@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.core.checks import (
+    Tags,
+    Warning,
+    register
+)
+
+
+@register(Tags.security)
+def check_metrics_token(app_configs, **kwargs):
+    """/metrics (core.views.metrics) is not served without a token."""
+    if not settings.PROFILING or settings.PROFILING_METRICS_TOKEN:
+        return []
+    return [Warning(
+        'PROFILING is on without PROFILING_METRICS_TOKEN, /metrics is not served.',
+        hint='Set PROFILING_METRICS_TOKEN and read /metrics with "Authorization: Bearer <token>".',
+        id='core.W002',
+    )]
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    The user cache versions (core.lib.usercache) invalidate cached reads and
+    stamp live event cursors; bumped in a process-local cache, the other
+    processes (web workers, run_worker) never see them.
+    """
+    if settings.CACHES['default']['BACKEND'] != 'django.core.cache.backends.locmem.LocMemCache':
+        return []
+    return [Warning(
+        'The default cache is local to each process.',
+        hint=(
+            'With more than one process (several web workers, or run_worker next to the web server) '
+            'set CACHE_URL to a shared cache, e.g. rediscache://host:6379/1 or filecache:///var/tmp/mireis, '
+            'otherwise they serve stale cached data.'
+        ),
+        id='core.W001',
+    )]
@@ -0,0 +1,15 @@
+from django.utils.functional import SimpleLazyObject
+
+from .lib import usercache
+
+
+def accounts(request):
+    """
+    The logged user's accounts as user_accounts, for the account selectors.
+    Lazy and cached, so it costs nothing on pages that do not use it and no
+    query on those that do, until the accounts change.
+    """
+    user = request.session.get('user') if hasattr(request, 'session') else None
+    if not user:
+        return {'user_accounts': []}
+    return {'user_accounts': SimpleLazyObject(lambda: usercache.accounts(user.get('user_id')))}
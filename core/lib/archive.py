@@ -0,0 +1,112 @@
+"""
+Yearly archival of old transactions.
+
+archive() moves a user's transactions dated before the first day of a year
+into ArchivedTransaction (same columns, same ids) and writes, per account, an
+opening row dated the day before with the account's total up to then. The
+running balances of the rows left go on from it unchanged, and so does
+balances.rebalance(). The monthly rollups keep counting the archived
+transactions, so the summaries are the same; opening rows are never counted
+nor listed.
+
+Reads over a date range combine both tables with values_list(): the archive
+half is an index range seek on (username|account, date, id), which finds
+nothing when the range starts after the archived years, so archived rows
+only cost something when the range reaches them. Writes dated in the
+archived years are refused. Search and the tag index cover the live table;
+tag filters and totals on archived rows go by their tags text.
+"""
+import datetime
+
+from django.conf import settings
+from django.db import (
+    connection,
+    transaction as db_transaction
+)
+from django.db.models import Sum
+from django.utils import timezone
+
+from core.models import (
+    ArchivedTransaction,
+    Transaction,
+    User
+)
+
+from . import usercache
+
+OPENING_DESCRIPTION = 'Opening balance'
+# The columns both tables have
+COLUMNS = tuple(f.attname for f in ArchivedTransaction._meta.concrete_fields)
+FIELDS = tuple(f.name for f in ArchivedTransaction._meta.concrete_fields)
+
+
+class ArchivedDateError(ValueError):
+    pass
+
+
+def cutoff(user_id):
+    """First day not archived for the user, None when nothing is."""
+    return User.objects.filter(pk=user_id).values_list('archived_before', flat=True).first()
+
+
+def default_cutoff(today=None):
+    """Keeps the last ARCHIVE_KEEP_YEARS years, the current one included."""
+    today = today or timezone.localdate()
+    return datetime.date(today.year - settings.ARCHIVE_KEEP_YEARS + 1, 1, 1)
+
+
+def check_date(date, before):
+    """Refuses a write dated in the archived years (before is the user's cutoff)."""
+    if before is not None and date < before:
+        raise ArchivedDateError(f'Transactions before {before.isoformat()} are archived')
+
+
+def values_list(qs, archived, *fields):
+    """values_list() of the live rows (opening ones left out) followed by the archived ones."""
+    return qs.filter(opening=False).values_list(*fields).union(archived.values_list(*fields), all=True)
+
+
+def archive(user_id, before):
+    """
+    Archives the user's transactions dated before the date before, the first
+    day of a year after the current cutoff. Returns how many were archived.
+    """
+    if (before.month, before.day) != (1, 1):
+        raise ValueError('Only whole years are archived')
+    current = cutoff(user_id)
+    if current is not None and before <= current:
+        return 0
+    old = Transaction.all_objects.filter(username_id=user_id, date__lt=before)
+    table = Transaction._meta.db_table
+    link_table = Transaction.tag_index.through._meta.db_table
+    with db_transaction.atomic(), connection.cursor() as cursor:
+        # Includes the previous opening rows; deleted accounts get none
+        openings = list(
+            Transaction.objects.filter(username_id=user_id, date__lt=before).exclude(account=None)
+            .values('account_id').annotate(total=Sum('amount')).order_by('account_id')
+        )
+        sql, params = old.filter(opening=False).values_list(*COLUMNS).query.sql_with_params()
+        columns = ', '.join(f.column for f in ArchivedTransaction._meta.concrete_fields)
+        cursor.execute(f'INSERT INTO {ArchivedTransaction._meta.db_table} ({columns}) {sql}', params)
+        archived = cursor.rowcount
+        sql, params = old.values('id').query.sql_with_params()
+        cursor.execute(f'DELETE FROM {link_table} WHERE transaction_id IN ({sql})', params)
+        cursor.execute(f'DELETE FROM {table} WHERE id IN ({sql})', params)
+        Transaction.objects.bulk_create([
+            Transaction(
+                username_id=user_id,
+                account_id=row['account_id'],
+                date=before - datetime.timedelta(days=1),
+                description=OPENING_DESCRIPTION,
+                amount=row['total'],
+                balance=row['total'],
+                check_code='',
+                checked=1,
+                opening=True
+            )
+            for row in openings
+        ])
+        User.objects.filter(pk=user_id).update(archived_before=before)
+        # bulk_create sends no signals
+        usercache.bump(user_id)
+    return archived
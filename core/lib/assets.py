@@ -0,0 +1,139 @@
+"""
+Static files: fingerprinted names, precompressed variants and their serving.
+
+collectstatic with CompressedManifestStaticFilesStorage writes every file
+under its content hashed name (core/css/base.5f1d....css) next to the
+original, and a .gz (and .br, when the brotli package is installed) copy of
+the text files. StaticFilesMiddleware serves STATIC_ROOT from an index built
+when it starts: hashed names as immutable for a year, the others for
+STATIC_MAX_AGE seconds with Last-Modified, each picking the smallest
+variant the client accepts.
+"""
+import gzip
+import json
+import mimetypes
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import (
+    ManifestStaticFilesStorage,
+    StaticFilesStorage
+)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSED_EXTENSIONS = ('.css', '.js', '.svg', '.txt', '.json', '.map', '.html', '.xml')
+# Variants not saving at least this much are not worth a second file
+MIN_SAVING = 0.05
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+ENCODINGS = (
+    # (Content-Encoding, file suffix), best first
+    ('br', '.br'),
+    ('gzip', '.gz'),
+)
+
+
+def compressors():
+    result = [('.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        result.insert(0, ('.br', lambda data: brotli.compress(data, quality=11)))
+    return result
+
+
+def compress_file(path):
+    """Writes the compressed variants of a file; returns their paths."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    written = []
+    for suffix, compress in compressors():
+        compressed = compress(data)
+        if len(compressed) <= len(data) * (1 - MIN_SAVING):
+            with open(path + suffix, 'wb') as f:
+                f.write(compressed)
+            written.append(path + suffix)
+    return written
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in set(paths) | set(self.hashed_files.values()):
+            if name.endswith(COMPRESSED_EXTENSIONS) and self.exists(name):
+                compress_file(self.path(name))
+
+    def url(self, name, force=False):
+        if not self.hashed_files and not force:
+            # Not collected (development, tests): the files under their own names
+            return StaticFilesStorage.url(self, name)
+        return super().url(name, force)
+
+
+def accepted_encodings(header):
+    """Content codings of an Accept-Encoding header, without the refused ones (q=0)."""
+    accepted = set()
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        q = params.strip()
+        if q.startswith('q='):
+            try:
+                if float(q[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        if coding:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+class StaticFile:
+    def __init__(self, path, name, immutable):
+        stat = os.stat(path)
+        self.path = path
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        self.immutable = immutable
+        self.variants = [
+            (encoding, path + suffix, os.path.getsize(path + suffix))
+            for encoding, suffix in ENCODINGS
+            if os.path.isfile(path + suffix)
+        ]
+
+    def variant(self, accept_encoding):
+        """(path, size, Content-Encoding or None) to send for an Accept-Encoding."""
+        accepted = accepted_encodings(accept_encoding)
+        for encoding, path, size in self.variants:
+            if encoding in accepted:
+                return path, size, encoding
+        return self.path, self.size, None
+
+
+def index(root):
+    """{url path under STATIC_URL: StaticFile} of the collected files."""
+    manifest = os.path.join(root, ManifestStaticFilesStorage.manifest_name)
+    hashed = set()
+    if os.path.isfile(manifest):
+        with open(manifest) as f:
+            hashed = set(json.load(f).get('paths', {}).values())
+    files = {}
+    suffixes = tuple(suffix for _, suffix in ENCODINGS)
+    for directory, _, names in os.walk(root):
+        for filename in names:
+            if filename.endswith(suffixes) or filename == ManifestStaticFilesStorage.manifest_name:
+                continue
+            path = os.path.join(directory, filename)
+            name = os.path.relpath(path, root).replace(os.sep, '/')
+            files[name] = StaticFile(path, name, name in hashed)
+    return files
+
+
+def cache_control(static_file):
+    if static_file.immutable:
+        return f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    return f'public, max-age={settings.STATIC_MAX_AGE}'
@@ -0,0 +1,97 @@
+"""
+Running balances kept up to date on every write.
+
+Account.balance holds the current total of the account and Transaction.balance
+the account total right after that transaction, following the (date, id) order
+used by the journal. Writes only touch the rows placed after the changed
+position, so appending today's transaction costs a couple of index seeks.
+"""
+from decimal import Decimal
+
+from django.db import connection
+from django.db.models import F, Q
+from django.utils import timezone
+
+from core.models import (
+    Account,
+    Transaction
+)
+
+
+# The date bounds are what SQLite seeks trs_account_date_id_idx on; the OR
+# alone would have it scan the account's whole history
+def _before(date, pk):
+    return Q(date__lte=date) & (Q(date__lt=date) | Q(date=date, id__lt=pk))
+
+
+def _after(date, pk):
+    return Q(date__gte=date) & (Q(date__gt=date) | Q(date=date, id__gt=pk))
+
+
+def balance_before(account_id, date, pk):
+    balance = Transaction.objects.filter(
+        _before(date, pk),
+        account_id=account_id
+    ).order_by('-date', '-id').values_list('balance', flat=True).first()
+    return balance or Decimal('0')
+
+
+def insert(trs):
+    """Adds a saved transaction to its account's running balance."""
+    if trs.account_id is None:
+        trs.balance = None
+        return
+    amount = Decimal(trs.amount)
+    # update() skips auto_now, so updated_at is set along with the balances
+    now = timezone.now()
+    Transaction.objects.filter(
+        _after(trs.date, trs.id),
+        account_id=trs.account_id
+    ).update(balance=F('balance') + amount, updated_at=now)
+    trs.balance = balance_before(trs.account_id, trs.date, trs.id) + amount
+    Transaction.objects.filter(pk=trs.id).update(balance=trs.balance)
+    Account.objects.filter(pk=trs.account_id).update(balance=F('balance') + amount, updated_at=now)
+
+
+def remove(trs):
+    """Takes a transaction (its stored state) out of its account's running balance."""
+    if trs.account_id is None:
+        return
+    amount = Decimal(trs.amount)
+    now = timezone.now()
+    Transaction.objects.filter(
+        _after(trs.date, trs.id),
+        account_id=trs.account_id
+    ).update(balance=F('balance') - amount, updated_at=now)
+    Account.objects.filter(pk=trs.account_id).update(balance=F('balance') - amount, updated_at=now)
+
+
+def rebalance(account_id, date=None, batch_size=1000):
+    """
+    Recomputes the running balance of an account from the given date on (the
+    whole history when date is None). Used after bulk writes.
+    """
+    qs = Transaction.objects.filter(account_id=account_id)
+    balance = Decimal('0')
+    if date is not None:
+        qs = qs.filter(date__gte=date)
+        # No transaction has id 0, so this is the last one before that date
+        balance = balance_before(account_id, date, 0)
+    field = Transaction._meta.get_field('balance')
+    updated_at = Transaction._meta.get_field('updated_at')
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    sql = f'UPDATE {Transaction._meta.db_table} SET {field.column} = %s, {updated_at.column} = %s WHERE id = %s'
+    batch = []
+    rows = qs.order_by('date', 'id').values_list('id', 'amount', 'balance')
+    with connection.cursor() as cursor:
+        # Plain executemany: bulk_update CASE statements grow with the batch
+        for pk, amount, stored in rows.iterator(chunk_size=batch_size):
+            balance += amount
+            if stored != balance:
+                batch.append((connection.ops.adapt_decimalfield_value(balance, field.max_digits, field.decimal_places), now, pk))
+            if len(batch) >= batch_size:
+                cursor.executemany(sql, batch)
+                batch = []
+        if batch:
+            cursor.executemany(sql, batch)
+    Account.objects.filter(pk=account_id).update(balance=balance, updated_at=timezone.now())
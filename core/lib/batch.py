@@ -0,0 +1,203 @@
+"""
+Batch transaction writes.
+
+A batch is a list of items like:
+
+    {"action": "create", "data": {"date": "2020-01-31", "description": ..., "amount": ..., ...}}
+    {"action": "update", "id": 10, "data": {...}}
+    {"action": "delete", "id": 11}
+
+Every item is validated first, with one query for the transactions and one
+for the accounts referenced by the whole batch. If any item is invalid
+nothing is written; otherwise the batch is applied in one atomic block with
+bulk operations, then balances and rollups are fixed once per account/month.
+"""
+import copy
+import datetime
+
+from django.db import (
+    connection,
+    transaction as db_transaction
+)
+from django.utils import timezone
+
+from core.models import (
+    Account,
+    Transaction
+)
+
+from . import (
+    archive,
+    balances,
+    events,
+    rollups,
+    serializers,
+    statements,
+    tags,
+    usercache
+)
+
+ACTIONS = ('create', 'update', 'delete')
+# bulk_update skips auto_now, so updated_at is set on the rows explicitly
+WRITE_FIELDS = ('date', 'description', 'amount', 'checked', 'account', 'tags', 'updated_at')
+
+
+class BatchItemError(Exception):
+    pass
+
+
+def parse_fields(data):
+    """Validated transaction fields of a create/update item."""
+    if not isinstance(data, dict):
+        raise BatchItemError('Missing transaction data')
+    try:
+        fields = {
+            'date': datetime.datetime.strptime(str(data.get('date')), '%Y-%m-%d').date(),
+            'description': data.get('description'),
+            # Cents within what the column holds, like statement amounts
+            'amount': statements.parse_amount(str(data.get('amount'))),
+            'checked': int(data.get('checked') or 0),
+            'account_id': int(data.get('account_id')) if data.get('account_id') else None,
+        }
+    except (ValueError, TypeError):
+        raise BatchItemError('Invalid transaction data')
+    if 'tags' in data:
+        fields['tags'] = tags.format_tags(tags.parse_tags(data.get('tags')))
+    if not fields['description']:
+        raise BatchItemError('Missing description')
+    return fields
+
+
+def _item_id(item):
+    try:
+        return int(item.get('id'))
+    except (TypeError, ValueError):
+        raise BatchItemError('Invalid transaction id')
+
+
+def apply_batch(user_id, items):
+    """
+    Validates and applies a batch for the user.
+
+    Returns (applied, results), results holding one dict per item in the
+    same order, with the saved row (or the error) of that item.
+    """
+    results = [{'action': None, 'id': None, 'error_message': '', 'data': None} for _ in items]
+    parsed = []
+    # First pass: syntax and the ids to look up
+    for item, result in zip(items, results):
+        try:
+            if not isinstance(item, dict) or item.get('action') not in ACTIONS:
+                raise BatchItemError('Invalid action')
+            result['action'] = item['action']
+            pk = _item_id(item) if item['action'] != 'create' else None
+            result['id'] = pk
+            fields = parse_fields(item.get('data')) if item['action'] != 'delete' else None
+            parsed.append((item['action'], pk, fields))
+        except BatchItemError as e:
+            result['error_message'] = str(e)
+            parsed.append(None)
+
+    ids = [p[1] for p in parsed if p and p[1] is not None]
+    account_ids = {p[2]['account_id'] for p in parsed if p and p[2] and p[2]['account_id']}
+    owned = Transaction.objects.filter(username_id=user_id, opening=False).in_bulk(ids) if ids else {}
+    owned_accounts = set(
+        Account.objects.filter(username_id=user_id, pk__in=account_ids).values_list('id', flat=True)
+    ) if account_ids else set()
+
+    # Second pass: ownership and archived dates
+    before = archive.cutoff(user_id)
+    seen = set()
+    for entry, result in zip(parsed, results):
+        if entry is None:
+            continue
+        action, pk, fields = entry
+        if pk is not None:
+            if pk not in owned:
+                result['error_message'] = 'Transaction not found'
+            elif pk in seen:
+                result['error_message'] = 'Transaction repeated in the batch'
+            seen.add(pk)
+        if fields and fields['account_id'] and fields['account_id'] not in owned_accounts:
+            result['error_message'] = 'Account not found'
+        if fields:
+            try:
+                archive.check_date(fields['date'], before)
+            except archive.ArchivedDateError as e:
+                result['error_message'] = str(e)
+    if any(r['error_message'] for r in results):
+        return False, results
+
+    now = timezone.now()
+    previous = []
+    created = []
+    updated = []
+    deleted = []
+    for (action, pk, fields), result in zip(parsed, results):
+        if action == 'create':
+            trs = Transaction(username_id=user_id, check_code='', **fields)
+            created.append((trs, result))
+            continue
+        trs = owned[pk]
+        previous.append(copy.copy(trs))
+        if action == 'delete':
+            deleted.append(pk)
+        else:
+            for name, value in fields.items():
+                setattr(trs, name, value)
+            trs.updated_at = now
+            updated.append((trs, result))
+
+    with db_transaction.atomic():
+        if deleted:
+            # Plain DELETEs, like the purge: delete() would send a signal,
+            # and bump the user, per row
+            placeholders = ', '.join(['%s'] * len(deleted))
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'DELETE FROM {Transaction.tag_index.through._meta.db_table} WHERE transaction_id IN ({placeholders})',
+                    deleted
+                )
+                cursor.execute(f'DELETE FROM {Transaction._meta.db_table} WHERE id IN ({placeholders})', deleted)
+        if updated:
+            Transaction.objects.bulk_update([trs for trs, _ in updated], WRITE_FIELDS)
+        if created:
+            new = [trs for trs, _ in created]
+            if connection.features.can_return_rows_from_bulk_insert:
+                Transaction.objects.bulk_create(new)
+            else:
+                # No ids back from bulk_create (SQLite): as in the statement
+                # import, the rows after the last id are the new ones, in
+                # the order they were inserted
+                last_id = Transaction.all_objects.order_by('-id').values_list('id', flat=True).first() or 0
+                Transaction.objects.bulk_create(new)
+                ids = Transaction.all_objects.filter(username_id=user_id, id__gt=last_id).order_by('id')
+                for trs, pk in zip(new, ids.values_list('id', flat=True)):
+                    trs.id = pk
+        tags.sync(trs for trs, _ in updated + created)
+        rollups.replace(previous, [trs for trs, _ in updated + created])
+        # Rebalance each account touched from its earliest changed date
+        starts = {}
+        for trs in previous + [trs for trs, _ in updated + created]:
+            if trs.account_id and (trs.account_id not in starts or trs.date < starts[trs.account_id]):
+                starts[trs.account_id] = trs.date
+        for account_id, date in starts.items():
+            balances.rebalance(account_id, date)
+        # bulk_update and bulk_create send no signals
+        usercache.bump(user_id)
+
+    serializer = serializers.serializer_for(Transaction)
+    changed = [trs for trs, _ in updated + created]
+    rows = {
+        row['id']: row
+        for row in serializer.serialize(Transaction.objects.filter(pk__in=[trs.pk for trs in changed]))
+    } if changed else {}
+    for trs, result in updated + created:
+        result['id'] = trs.pk
+        result['data'] = rows.get(trs.pk)
+    for pk in deleted:
+        events.publish(user_id, 'deleted', {'id': pk})
+    for kind, items in (('updated', updated), ('created', created)):
+        for trs, result in items:
+            events.publish(user_id, kind, result['data'])
+    return True, results
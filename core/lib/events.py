@@ -0,0 +1,215 @@
+"""
+Live journal events.
+
+Writes to a user's transactions publish() an event once their database
+transaction commits: save_transaction and batch writes send created, updated
+and deleted with the transaction, deleting an account sends account-deleted.
+Each open journal tab holds a Subscription to its user's events through the
+stream served by mireis/asgi.py (core.asgi), and publish() hands every event
+to the subscriptions of the user in this process.
+
+The last EVENTS_BUFFER_SIZE events of each user are kept for replay, for
+the users with a journal open: subscribed, or seen (a page's position(), a
+polling client's catch_up()) in the last EVENTS_IDLE_TIMEOUT seconds, and
+no more than EVENTS_MAX_USERS of them, the least recently seen without a
+subscription going first. Publishing for anyone else keeps nothing. An
+event's id, its cursor, is "<process>.<sequence>.<user cache version>": a
+client reconnecting with the id of the last event it got is sent what came
+after it (catch_up()). Writes made in other processes, and bulk writes that
+publish nothing (statement imports, archival, rollup rebuilds), still bump
+the user's cache version (core.lib.usercache); when the version has moved
+past the cursor's, or the cursor is too old for the buffer, the client gets
+a reset event and loads the journal again.
+"""
+import asyncio
+import collections
+import json
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction as db_transaction
+
+from . import usercache
+
+# Tells the cursors of this process from those of others and of earlier runs
+PROCESS = uuid.uuid4().hex[:8]
+RESET = 'reset'
+
+_lock = threading.Lock()
+_state = {'sequence': 0}
+# User id: deque of the user's latest events, least recently seen first
+_buffers = collections.OrderedDict()
+# User id: sequence of the last event dropped from the buffer, or of the
+# last one before the buffer was started
+_dropped = {}
+# User id: time.monotonic() the user was last seen
+_seen = {}
+# User id: set of Subscription
+_subscriptions = {}
+
+
+class Event:
+    """kind None only moves the client's cursor, nothing is dispatched."""
+    __slots__ = ('sequence', 'version', 'kind', 'data')
+
+    def __init__(self, sequence, version, kind, data=None):
+        self.sequence = sequence
+        self.version = version
+        self.kind = kind
+        self.data = data
+
+    @property
+    def cursor(self):
+        return f'{PROCESS}.{self.sequence}.{self.version}'
+
+    def encode(self):
+        """The event in the text/event-stream format."""
+        if self.kind is None:
+            return f'id: {self.cursor}\n\n'
+        data = json.dumps(self.data if self.data is not None else {}, cls=DjangoJSONEncoder)
+        return f'id: {self.cursor}\nevent: {self.kind}\ndata: {data}\n\n'
+
+
+class Subscription:
+    """The queue of a stream, in its event loop, fed by publish() from any thread."""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(settings.EVENTS_BUFFER_SIZE)
+        # Events were lost, the client has to start over
+        self.overflowed = False
+
+    def put(self, event):
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # The loop is closed, the stream with it
+            pass
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+def parse_cursor(cursor):
+    """(process, sequence, version) of a cursor, None when it isn't one."""
+    try:
+        process, sequence, version = str(cursor).split('.')
+        return process, int(sequence), int(version)
+    except ValueError:
+        return None
+
+
+def at(cursor):
+    """The cursor-only event of a cursor of this process."""
+    process, sequence, version = parse_cursor(cursor)
+    return Event(sequence, version, None)
+
+
+def position(user_id):
+    """Where the user's events are now: a cursor-only event."""
+    version = usercache.version(user_id)
+    with _lock:
+        _listen(user_id)
+        return Event(_state['sequence'], version, None)
+
+
+def reset(user_id):
+    return Event(_state['sequence'], usercache.version(user_id), RESET)
+
+
+def publish(user_id, kind, data=None):
+    """Sends an event to the user's subscriptions once the current database transaction commits."""
+    db_transaction.on_commit(lambda: _publish(user_id, kind, data))
+
+
+def _listen(user_id):
+    """Keeps the user's events from now on (for a while); under _lock."""
+    if user_id not in _buffers:
+        _buffers[user_id] = collections.deque()
+        # Whatever came before is unknown
+        _dropped[user_id] = _state['sequence']
+    _buffers.move_to_end(user_id)
+    _seen[user_id] = time.monotonic()
+    _evict()
+
+
+def _evict():
+    """Drops the buffers of the users gone idle, and of the least recently seen over the limit; under _lock."""
+    now = time.monotonic()
+    for user_id in list(_buffers):
+        if len(_buffers) <= settings.EVENTS_MAX_USERS and now - _seen[user_id] < settings.EVENTS_IDLE_TIMEOUT:
+            # The rest were seen later
+            break
+        if user_id in _subscriptions:
+            continue
+        del _buffers[user_id]
+        del _dropped[user_id]
+        del _seen[user_id]
+
+
+def _publish(user_id, kind, data):
+    # Read after the write bumped it; a write committed by another process
+    # right in between is taken for this one
+    version = usercache.version(user_id)
+    with _lock:
+        _state['sequence'] += 1
+        event = Event(_state['sequence'], version, kind, data)
+        buffer = _buffers.get(user_id)
+        if buffer is not None:
+            buffer.append(event)
+            while len(buffer) > settings.EVENTS_BUFFER_SIZE:
+                _dropped[user_id] = buffer.popleft().sequence
+        _evict()
+        subscriptions = list(_subscriptions.get(user_id, ()))
+    for subscription in subscriptions:
+        subscription.put(event)
+    return event
+
+
+def subscribe(user_id):
+    """A Subscription to the user's events, in the running event loop."""
+    subscription = Subscription(user_id)
+    with _lock:
+        _subscriptions.setdefault(user_id, set()).add(subscription)
+        _listen(user_id)
+    return subscription
+
+
+def unsubscribe(subscription):
+    with _lock:
+        subscriptions = _subscriptions.get(subscription.user_id, set())
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            _subscriptions.pop(subscription.user_id, None)
+            # Idle from now on, kept for the client to reconnect
+            _listen(subscription.user_id)
+
+
+def catch_up(user_id, cursor):
+    """
+    Events for a client whose last one was cursor: the user's events after
+    it, or a reset when they can't be told. A cursor of another process with
+    nothing changed since gets a cursor-only event, so the next one is ours.
+    """
+    parsed = parse_cursor(cursor)
+    version = usercache.version(user_id)
+    if parsed is None:
+        return [reset(user_id)]
+    process, sequence, seen = parsed
+    if process != PROCESS:
+        return [position(user_id) if seen == version else reset(user_id)]
+    with _lock:
+        _listen(user_id)
+        if sequence < _dropped[user_id]:
+            return [reset(user_id)]
+        events = [event for event in _buffers[user_id] if event.sequence > sequence]
+    if (events[-1].version if events else seen) != version:
+        return [reset(user_id)]
+    return events
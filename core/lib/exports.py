@@ -0,0 +1,66 @@
+"""
+Transaction export as CSV or newline delimited JSON.
+
+Rows are read with values_list() through a chunked server side iterator and
+turned into text one at a time, so a StreamingHttpResponse built on these
+generators keeps a flat memory use whatever the size of the history.
+"""
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from . import archive
+
+EXPORT_COLUMNS = (
+    'id',
+    'date',
+    'account_id',
+    'description',
+    'notes',
+    'amount',
+    'balance',
+    'check_code',
+    'checked',
+    'tags',
+)
+EXPORT_CHUNK_SIZE = 2000
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'json': 'application/x-ndjson',
+}
+
+
+class Echo:
+    """File-like object whose write() returns the value, for csv.writer."""
+    def write(self, value):
+        return value
+
+
+def export_rows(qs, archived=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Rows of qs, oldest first, after those of archived (archived transactions) if given."""
+    if archived is None:
+        rows = qs.values_list(*EXPORT_COLUMNS)
+    else:
+        rows = archive.values_list(qs, archived, *EXPORT_COLUMNS)
+    return rows.order_by('date', 'id').iterator(chunk_size=chunk_size)
+
+
+def csv_lines(qs, archived=None):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_COLUMNS)
+    for row in export_rows(qs, archived):
+        yield writer.writerow(row)
+
+
+def json_lines(qs, archived=None):
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    for row in export_rows(qs, archived):
+        yield encoder.encode(dict(zip(EXPORT_COLUMNS, row))) + '\n'
+
+
+WRITERS = {
+    'csv': csv_lines,
+    'json': json_lines,
+}
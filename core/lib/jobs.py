@@ -0,0 +1,224 @@
+"""
+Background jobs, queued in the database.
+
+Views enqueue() a registered task and answer at once; the run_worker command
+claims the due jobs and runs them in a thread or process pool, so nothing but
+the SQLite database is needed. A job is claimed by an UPDATE ... WHERE status
+= 'queued' that a single worker can win. A failed job goes back to the queue
+JOBS_RETRY_DELAY * 2 ** (attempts - 1) seconds later until it has used its
+max_attempts, then stays failed with the traceback. A running job's
+heartbeat_at is refreshed by its progress and, every JOBS_STALE_AFTER / 10
+seconds, by the worker running it; jobs whose heartbeat is older than
+JOBS_STALE_AFTER seconds were left by a worker that died and are queued
+again. What a job left behind reports is only recorded for its own attempt.
+
+Tasks are plain functions taking progress(value) and the job's JSON args,
+registered with @task (see core.tasks); what they return is the job result.
+Uploads are not args: save_upload() copies them to JOBS_UPLOAD_DIR and the
+job gets the file name, the task deletes the file when done.
+"""
+import concurrent.futures
+import datetime
+import logging
+import os
+import socket
+import tempfile
+import time
+import traceback
+
+import django
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import F
+from django.utils import timezone
+
+from core.models import Job
+
+logger = logging.getLogger('core.jobs')
+
+# Task name: (function, max attempts or None for JOBS_MAX_ATTEMPTS)
+TASKS = {}
+POOLS = ('thread', 'process')
+
+
+def task(name, max_attempts=None):
+    """Registers a task under name."""
+    def decorator(f):
+        TASKS[name] = (f, max_attempts)
+        return f
+    return decorator
+
+
+def enqueue(name, owner_id=None, delay=0, **args):
+    """
+    Queues the task name with args (JSON values) and returns the Job, listed
+    among the jobs of the user owner_id. Within a database transaction the
+    job is only seen once it commits.
+    """
+    if name not in TASKS:
+        raise ValueError(f'Unknown task: {name}')
+    return Job.objects.create(
+        username_id=owner_id,
+        name=name,
+        args=args,
+        max_attempts=TASKS[name][1] or settings.JOBS_MAX_ATTEMPTS,
+        run_after=timezone.now() + datetime.timedelta(seconds=delay)
+    )
+
+
+def save_upload(upload):
+    """Copies an uploaded file for a job, chunk by chunk; returns the name to put in the job's args."""
+    os.makedirs(settings.JOBS_UPLOAD_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=settings.JOBS_UPLOAD_DIR, suffix='.upload')
+    with os.fdopen(fd, 'wb') as f:
+        for chunk in upload.chunks():
+            f.write(chunk)
+    return os.path.basename(path)
+
+
+def upload_path(name):
+    """Path of a file of save_upload(); the args only ever name one in JOBS_UPLOAD_DIR."""
+    return os.path.join(settings.JOBS_UPLOAD_DIR, os.path.basename(name))
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def claim(worker):
+    """Marks the next due job running for worker; its id, None when there is none."""
+    while True:
+        now = timezone.now()
+        pk = Job.objects.filter(
+            status=Job.QUEUED,
+            run_after__lte=now
+        ).order_by('run_after', 'id').values_list('id', flat=True).first()
+        if pk is None:
+            return None
+        claimed = Job.objects.filter(pk=pk, status=Job.QUEUED).update(
+            status=Job.RUNNING,
+            worker=worker,
+            attempts=F('attempts') + 1,
+            started_at=now,
+            heartbeat_at=now
+        )
+        if claimed:
+            return pk
+        # Another worker got it first
+
+
+def retry_delay(attempts):
+    return settings.JOBS_RETRY_DELAY * 2 ** (attempts - 1)
+
+
+def execute(pk):
+    """Runs a claimed job and records how it ended."""
+    job = Job.objects.get(pk=pk)
+    # This attempt's row, unless the job was taken for stale meanwhile
+    attempt = Job.objects.filter(pk=pk, status=Job.RUNNING, attempts=job.attempts)
+
+    def progress(value):
+        attempt.update(progress=value, heartbeat_at=timezone.now())
+
+    try:
+        if job.name not in TASKS:
+            raise LookupError(f'Unknown task: {job.name}')
+        result = TASKS[job.name][0](progress, **job.args)
+    except Exception:
+        logger.exception('Job %s (%s) failed, attempt %d of %d', pk, job.name, job.attempts, job.max_attempts)
+        now = timezone.now()
+        if job.attempts < job.max_attempts:
+            attempt.update(
+                status=Job.QUEUED,
+                run_after=now + datetime.timedelta(seconds=retry_delay(job.attempts)),
+                error=traceback.format_exc()
+            )
+        else:
+            attempt.update(status=Job.FAILED, finished_at=now, error=traceback.format_exc())
+        return False
+    attempt.update(status=Job.DONE, finished_at=timezone.now(), result=result, error='')
+    return True
+
+
+def run_job(pk):
+    """execute() in a pool worker, which owns its database connections."""
+    try:
+        return execute(pk)
+    finally:
+        connections.close_all()
+
+
+def heartbeat(pks):
+    """Marks the running jobs pks alive."""
+    return Job.objects.filter(pk__in=pks, status=Job.RUNNING).update(heartbeat_at=timezone.now())
+
+
+def requeue_stale():
+    """Queues again (or fails, out of attempts) the running jobs not heard of for too long; returns how many."""
+    silent_since = timezone.now() - datetime.timedelta(seconds=settings.JOBS_STALE_AFTER)
+    stale = Job.objects.filter(status=Job.RUNNING, heartbeat_at__lt=silent_since)
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED, finished_at=timezone.now(), error='The worker running it stopped'
+    )
+    return failed + stale.update(status=Job.QUEUED, worker='')
+
+
+def run_pending(worker=None):
+    """Runs the due jobs one after the other, here; returns how many ran."""
+    worker = worker or worker_name()
+    count = 0
+    while True:
+        pk = claim(worker)
+        if pk is None:
+            return count
+        execute(pk)
+        count += 1
+
+
+def work(workers=2, pool='thread', poll=None, burst=False):
+    """
+    Claims and runs jobs, up to workers at a time, until interrupted (or,
+    with burst, until the queue is empty). Processes are spawned, not forked,
+    so none of them inherits an open SQLite connection.
+    """
+    if pool not in POOLS:
+        raise ValueError(f'Unknown pool: {pool}')
+    poll = settings.JOBS_POLL_INTERVAL if poll is None else poll
+    worker = worker_name()
+    if pool == 'thread':
+        executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix='mireis-job')
+    else:
+        # Only here: every process registers the tasks, few run a process pool
+        import multiprocessing
+        executor = concurrent.futures.ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context('spawn'), initializer=django.setup
+        )
+    # Future: job id
+    running = {}
+    stale_check = 0
+    with executor:
+        while True:
+            if time.monotonic() - stale_check > settings.JOBS_STALE_AFTER / 10:
+                # Ours are alive, however long they take
+                heartbeat(list(running.values()))
+                if requeue_stale():
+                    logger.warning('Stale jobs queued again')
+                stale_check = time.monotonic()
+            pk = claim(worker) if len(running) < workers else None
+            if pk is not None:
+                running[executor.submit(run_job, pk)] = pk
+                continue
+            if not running:
+                if burst:
+                    return
+                time.sleep(poll)
+                continue
+            done, _ = concurrent.futures.wait(
+                running, timeout=poll, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                del running[future]
+                if future.exception() is not None:
+                    # Failing jobs are recorded by execute(), this is the bookkeeping itself
+                    logger.error('Job runner failed', exc_info=future.exception())
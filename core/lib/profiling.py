@@ -0,0 +1,284 @@
+"""
+Per request profiling: wall time, database queries and time, template render
+time and response size of each view, kept as in-process histograms and
+rendered in the Prometheus text format.
+
+Measurements of a request are collected in a Profile bound to a context
+variable, so queries run by views offloaded to other threads (which copy the
+context) are counted too. Every process keeps its own numbers: with several
+workers each one must be scraped.
+
+The slowest requests over PROFILING_SLOW_REQUEST_MS are kept with their SQL
+(the PROFILING_SLOW_SAMPLES worst ones) and logged to the core.profiling
+logger when they enter that list.
+
+The same query counting backs the per view query budgets (see
+core.views.query_budget and the QUERY_BUDGET setting).
+"""
+import bisect
+import contextlib
+import contextvars
+import functools
+import heapq
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger('core.profiling')
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+# Statements kept per request for the slow request samples
+SQL_SAMPLE_SIZE = 200
+
+_current = contextvars.ContextVar('profile', default=None)
+
+
+class Profile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.sql = []
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def start(profile=None):
+    """Binds a (new) profile to the current context; returns it and the token for stop()."""
+    profile = profile or Profile()
+    return profile, _current.set(profile)
+
+
+def stop(token):
+    try:
+        _current.reset(token)
+    except ValueError:
+        # A streamed body may be finished from another context
+        _current.set(None)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryCount:
+    """Queries run since it was made, on the profile bound to the context."""
+
+    def __init__(self, profile):
+        self.profile = profile
+        self.start = profile.queries
+        self.sql_start = len(profile.sql)
+
+    @property
+    def used(self):
+        return self.profile.queries - self.start
+
+    @property
+    def statements(self):
+        return [sql for _, sql in self.profile.sql[self.sql_start:]]
+
+
+@contextlib.contextmanager
+def counting():
+    """Counts the queries of a block, inside a profiled request or not."""
+    profile = _current.get()
+    token = None
+    if profile is None:
+        profile, token = start()
+    try:
+        yield QueryCount(profile)
+    finally:
+        if token is not None:
+            stop(token)
+
+
+def check_budget(name, limit, count):
+    """Logs or raises (per QUERY_BUDGET) when a view ran more queries than its budget."""
+    if count.used <= limit:
+        return
+    message = f'{name} ran {count.used} queries, over its budget of {limit}:\n' + '\n'.join(
+        f'  {sql}' for sql in count.statements
+    )
+    if settings.QUERY_BUDGET == 'raise':
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+def query_wrapper(execute, sql, params, many, context):
+    """Database execute wrapper (see install) timing the queries of a request."""
+    profile = _current.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        profile.queries += 1
+        profile.db_time += elapsed
+        if len(profile.sql) < SQL_SAMPLE_SIZE:
+            profile.sql.append((round(elapsed * 1000, 3), sql))
+
+
+def timed_render(render):
+    @functools.wraps(render)
+    def wrapper(*args, **kwargs):
+        profile = _current.get()
+        if profile is None:
+            return render(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return render(*args, **kwargs)
+        finally:
+            profile.template_time += time.perf_counter() - started
+    wrapper.profiled = True
+    return wrapper
+
+
+def add_query_wrapper(sender, connection, **kwargs):
+    if query_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_wrapper)
+
+
+def install():
+    """
+    Hooks the query wrapper into new connections; called when the app is
+    ready.
+    """
+    from django.db import connections
+    from django.db.backends.signals import connection_created
+    connection_created.connect(add_query_wrapper)
+    for connection in connections.all():
+        add_query_wrapper(None, connection)
+
+
+def install_template_timing():
+    """
+    Times template renders; called by ProfilingMiddleware, so processes that
+    do not profile requests (workers, commands) never import Jinja2 for it.
+    """
+    from django.template.backends import (
+        django as django_backend,
+        jinja2 as jinja2_backend
+    )
+    for Template in (django_backend.Template, jinja2_backend.Template):
+        if not getattr(Template.render, 'profiled', False):
+            Template.render = timed_render(Template.render)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_sum{{{labels}}} {self.total:.6f}'
+        yield f'{name}_count{{{labels}}} {cumulative}'
+
+
+HISTOGRAMS = (
+    # (name, help, buckets, attribute of the observation)
+    ('mireis_request_duration_seconds', 'Wall time of the request', DURATION_BUCKETS, 'duration'),
+    ('mireis_request_db_queries', 'Database queries of the request', QUERY_BUCKETS, 'queries'),
+    ('mireis_request_db_duration_seconds', 'Time spent in database queries', DURATION_BUCKETS, 'db_time'),
+    ('mireis_request_template_duration_seconds', 'Time spent rendering templates', DURATION_BUCKETS, 'template_time'),
+    ('mireis_response_size_bytes', 'Size of the response body', SIZE_BUCKETS, 'size'),
+)
+
+_lock = threading.Lock()
+_histograms = {}
+_requests = {}
+_slow = []
+_slow_counter = 0
+
+
+def reset():
+    global _slow_counter
+    with _lock:
+        _histograms.clear()
+        _requests.clear()
+        _slow.clear()
+        _slow_counter = 0
+
+
+def record(view, method, status, profile, size):
+    """Adds a finished request to the metrics."""
+    global _slow_counter
+    observation = {
+        'duration': profile.elapsed(),
+        'queries': profile.queries,
+        'db_time': profile.db_time,
+        'template_time': profile.template_time,
+        'size': size,
+    }
+    with _lock:
+        key = (view, method)
+        if key not in _histograms:
+            _histograms[key] = {name: Histogram(buckets) for name, _, buckets, _ in HISTOGRAMS}
+        for name, _, _, attribute in HISTOGRAMS:
+            _histograms[key][name].observe(observation[attribute])
+        _requests[(view, method, status)] = _requests.get((view, method, status), 0) + 1
+        sample = None
+        if observation['duration'] * 1000 >= settings.PROFILING_SLOW_REQUEST_MS:
+            _slow_counter += 1
+            # Min-heap on the duration: the fastest of the kept samples goes first
+            sample = (observation['duration'], _slow_counter, {
+                'view': view, 'method': method, 'status': status, **observation, 'sql': profile.sql,
+            })
+            if len(_slow) < settings.PROFILING_SLOW_SAMPLES:
+                heapq.heappush(_slow, sample)
+            elif sample[0] > _slow[0][0]:
+                heapq.heapreplace(_slow, sample)
+            else:
+                sample = None
+    if sample:
+        details = sample[2]
+        logger.warning(
+            'Slow request %s %s: %.1f ms, %d queries (%.1f ms)\n%s',
+            method, view, details['duration'] * 1000, details['queries'], details['db_time'] * 1000,
+            '\n'.join(f'  {ms} ms: {sql}' for ms, sql in details['sql'])
+        )
+
+
+def slow_requests():
+    """The slowest requests kept, slowest first."""
+    with _lock:
+        return [sample[2] for sample in sorted(_slow, reverse=True)]
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render():
+    """The metrics in the Prometheus text exposition format."""
+    lines = [
+        '# HELP mireis_requests_total Requests served',
+        '# TYPE mireis_requests_total counter',
+    ]
+    with _lock:
+        for (view, method, status), count in sorted(_requests.items()):
+            lines.append(
+                f'mireis_requests_total{{view="{_escape(view)}",method="{method}",status="{status}"}} {count}'
+            )
+        for name, description, _, _ in HISTOGRAMS:
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} histogram')
+            for (view, method), histograms in sorted(_histograms.items()):
+                lines.extend(histograms[name].lines(name, f'view="{_escape(view)}",method="{method}"'))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,148 @@
+"""
+Deleting accounts and users with large histories.
+
+A cascade delete would make Django load every transaction of the account and
+delete them all in one write transaction, holding SQLite's single writer lock
+for as long as it takes. Instead, delete_account() and delete_user() only set
+deleted_at, which hides the account (Account.objects) and its transactions
+(Transaction.objects) at once, and drop the monthly rollups, a row a month.
+The transactions are then purged in batches of PURGE_BATCH_SIZE, each its own
+short transaction of plain DELETE ... WHERE id IN (...) statements, by a
+purge job queued with the deletion (PURGE_IN_BACKGROUND, see core.lib.jobs)
+or by the purge_deleted command, which picks up any purge left behind.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.db import (
+    connection,
+    transaction as db_transaction
+)
+from django.utils import timezone
+
+from core.models import (
+    Account,
+    ArchivedTransaction,
+    MonthlyRollup,
+    Transaction,
+    User
+)
+
+from . import (
+    events,
+    jobs,
+    usercache
+)
+
+logger = logging.getLogger('core.purge')
+
+# Between batches, so other writers get the database
+BATCH_PAUSE = 0.01
+
+
+def delete_account(account):
+    """Hides the account right away; its transactions are purged afterwards."""
+    now = timezone.now()
+    with db_transaction.atomic():
+        Account.all_objects.filter(pk=account.id).update(deleted_at=now, updated_at=now)
+        MonthlyRollup.objects.filter(account_id=account.id).delete()
+        if settings.PURGE_IN_BACKGROUND:
+            jobs.enqueue('purge-account', owner_id=account.username_id, account_id=account.id)
+        usercache.bump(account.username_id)
+    events.publish(account.username_id, 'account-deleted', {'id': account.id})
+
+
+def delete_user(user):
+    """Hides the user (no more logins) and their accounts; the rows are purged afterwards."""
+    now = timezone.now()
+    with db_transaction.atomic():
+        User.objects.filter(pk=user.id).update(deleted_at=now)
+        Account.all_objects.filter(username_id=user.id, deleted_at=None).update(deleted_at=now, updated_at=now)
+        MonthlyRollup.objects.filter(username_id=user.id).delete()
+        if settings.PURGE_IN_BACKGROUND:
+            jobs.enqueue('purge-user', owner_id=user.id, user_id=user.id)
+        usercache.bump(user.id)
+
+
+def remaining(**filters):
+    """Transactions still to purge, archived ones included, e.g. remaining(account_id=1)."""
+    return Transaction.all_objects.filter(**filters).values('id').union(
+        ArchivedTransaction.all_objects.filter(**filters).values('id'), all=True
+    ).count()
+
+
+def purge_transactions(batch_size=None, progress=None, model=Transaction, **filters):
+    """
+    Deletes the transactions (or archived transactions, by model) matching
+    filters and their tag links, a batch per database transaction.
+    progress(deleted so far) is called after each batch. Returns the number
+    deleted.
+    """
+    batch_size = min(
+        batch_size or settings.PURGE_BATCH_SIZE,
+        # SQLite bounds the parameters of a statement
+        connection.features.max_query_params or settings.PURGE_BATCH_SIZE
+    )
+    table = model._meta.db_table
+    link_table = Transaction.tag_index.through._meta.db_table
+    deleted = 0
+    while True:
+        ids = list(model.all_objects.filter(**filters).values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        placeholders = ', '.join(['%s'] * len(ids))
+        with db_transaction.atomic(), connection.cursor() as cursor:
+            if model is Transaction:
+                # Archived transactions have no tag links
+                cursor.execute(f'DELETE FROM {link_table} WHERE transaction_id IN ({placeholders})', ids)
+            cursor.execute(f'DELETE FROM {table} WHERE id IN ({placeholders})', ids)
+        deleted += len(ids)
+        if progress:
+            progress(deleted)
+        time.sleep(BATCH_PAUSE)
+
+
+def _purge_both(batch_size, progress, **filters):
+    deleted = 0
+    for model in (ArchivedTransaction, Transaction):
+        deleted += purge_transactions(
+            batch_size, progress and (lambda n, done=deleted: progress(done + n)), model, **filters
+        )
+    return deleted
+
+
+def purge_account(account_id, batch_size=None, progress=None):
+    deleted = _purge_both(batch_size, progress, account_id=account_id)
+    # Nothing left to cascade to, so this is short
+    Account.all_objects.filter(pk=account_id).delete()
+    logger.info('Account %s purged: %d transactions', account_id, deleted)
+    return deleted
+
+
+def purge_user(user_id, batch_size=None, progress=None):
+    deleted = 0
+    for account_id in Account.all_objects.filter(username_id=user_id).values_list('id', flat=True):
+        deleted += purge_account(account_id, batch_size, progress)
+    deleted += _purge_both(batch_size, progress, username_id=user_id)
+    User.objects.filter(pk=user_id).delete()
+    logger.info('User %s purged', user_id)
+    return deleted
+
+
+def run(batch_size=None, progress=None):
+    """
+    Purges every deleted account and user; returns the number of
+    transactions deleted. progress(kind, id, deleted so far) follows each
+    batch.
+    """
+    deleted = 0
+    accounts = Account.all_objects.filter(deleted_at__isnull=False, username__deleted_at=None)
+    for account_id in accounts.order_by('deleted_at').values_list('id', flat=True):
+        deleted += purge_account(
+            account_id, batch_size, progress and (lambda n, pk=account_id: progress('account', pk, n))
+        )
+    for user_id in User.objects.exclude(deleted_at=None).order_by('deleted_at').values_list('id', flat=True):
+        deleted += purge_user(user_id, batch_size, progress and (lambda n, pk=user_id: progress('user', pk, n)))
+    return deleted
+
@@ -0,0 +1,169 @@
+"""
+Statement reconciliation.
+
+The lines of a bank statement (read like an import, see core.lib.statements)
+are matched to the user's unchecked transactions of the same amount within
+RECONCILE_DATE_WINDOW days, the closest description first. Candidates are
+indexed in a dict keyed by (amount, date), so each line looks at the few
+transactions in its 2 * window + 1 buckets instead of the whole history; a
+transaction with the line's check_code (FITID) is taken first. Matches are
+marked checked (with the line's check_code when they have none) in bulk.
+"""
+import collections
+import datetime
+import re
+
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.utils import timezone
+
+from core.models import Transaction
+
+from . import (
+    rollups,
+    statements,
+    usercache
+)
+
+WORD = re.compile(r'\w+')
+UPDATE_BATCH_SIZE = 500
+
+
+def words(text):
+    return frozenset(WORD.findall((text or '').lower()))
+
+
+def similarity(a, b):
+    """Jaccard index of two word sets."""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class Candidate:
+    __slots__ = ('id', 'account_id', 'date', 'amount', 'description', 'check_code', 'words', 'matched')
+
+    def __init__(self, pk, account_id, date, amount, description, check_code):
+        self.id = pk
+        self.account_id = account_id
+        self.date = date
+        self.amount = amount
+        self.description = description
+        self.check_code = check_code
+        self.words = None
+        self.matched = False
+
+
+class Index:
+    """Unchecked transactions by (amount, date) and by check_code."""
+
+    def __init__(self, candidates):
+        self.candidates = candidates
+        self.buckets = collections.defaultdict(list)
+        self.codes = {}
+        for candidate in candidates:
+            self.buckets[(candidate.amount, candidate.date)].append(candidate)
+            if candidate.check_code:
+                self.codes.setdefault(candidate.check_code, candidate)
+
+    def match(self, row, window, min_similarity):
+        by_code = self.codes.get(row['check_code']) if row['check_code'] else None
+        if by_code is not None and not by_code.matched and by_code.amount == row['amount']:
+            return by_code
+        row_words = words(row['description'])
+        best = None
+        best_score = None
+        for days in range(-window, window + 1):
+            for candidate in self.buckets.get((row['amount'], row['date'] + datetime.timedelta(days=days)), ()):
+                if candidate.matched:
+                    continue
+                if candidate.words is None:
+                    candidate.words = words(candidate.description)
+                score = (similarity(row_words, candidate.words), -abs(days), -candidate.id)
+                if score[0] >= min_similarity and (best_score is None or score > best_score):
+                    best, best_score = candidate, score
+        return best
+
+
+def candidates(user_id, account_id, date_from, date_to):
+    qs = Transaction.objects.filter(username_id=user_id, checked=0, date__gte=date_from, date__lte=date_to)
+    if account_id is not None:
+        qs = qs.filter(account_id=account_id)
+    return [
+        Candidate(*row)
+        for row in qs.order_by('date', 'id').values_list(
+            'id', 'account_id', 'date', 'amount', 'description', 'check_code'
+        ).iterator()
+    ]
+
+
+def mark_checked(user_id, matches):
+    """Marks the matched candidates checked and moves their amounts to the checked rollup totals."""
+    now = timezone.now()
+    rows = []
+    for candidate, row in matches:
+        trs = Transaction(
+            id=candidate.id, username_id=user_id, account_id=candidate.account_id, date=candidate.date,
+            amount=candidate.amount, check_code=candidate.check_code or row['check_code'], checked=0
+        )
+        trs.updated_at = now
+        rows.append(trs)
+    with db_transaction.atomic():
+        deltas = rollups.collect(rows, -1)
+        for trs in rows:
+            trs.checked = 1
+        Transaction.objects.bulk_update(rows, ('checked', 'check_code', 'updated_at'), batch_size=UPDATE_BATCH_SIZE)
+        rollups.apply(rollups.collect(rows, 1, deltas))
+        usercache.bump(user_id)
+
+
+def reconcile(stream, user_id, account_id=None, statement_format='csv', window=None, min_similarity=None,
+              dry_run=False):
+    """
+    Reconciles a statement text stream with the user's (account's) unchecked
+    transactions; with dry_run nothing is marked.
+
+    Returns a dict of matches [(line, transaction id)], unmatched_lines
+    [(line, row)], unmatched_transactions (the unchecked ones dated within
+    the statement that no line matched) and errors [(line, error message)].
+    Raises StatementError when the file itself can not be read.
+    """
+    if statement_format not in statements.READERS:
+        raise statements.StatementError(f'Unknown statement format: {statement_format}')
+    window = settings.RECONCILE_DATE_WINDOW if window is None else window
+    min_similarity = settings.RECONCILE_MIN_SIMILARITY if min_similarity is None else min_similarity
+    reader, to_row = statements.READERS[statement_format]
+    lines = []
+    errors = []
+    for line, raw in reader(stream):
+        try:
+            lines.append((line, to_row(raw)))
+        except ValueError as e:
+            errors.append((line, str(e)))
+    result = {'matches': [], 'unmatched_lines': [], 'unmatched_transactions': [], 'errors': errors}
+    if not lines:
+        return result
+    first_date = min(row['date'] for _, row in lines)
+    last_date = max(row['date'] for _, row in lines)
+    index = Index(candidates(
+        user_id,
+        account_id,
+        first_date - datetime.timedelta(days=window),
+        last_date + datetime.timedelta(days=window)
+    ))
+    matches = []
+    for line, row in lines:
+        candidate = index.match(row, window, min_similarity)
+        if candidate is None:
+            result['unmatched_lines'].append((line, row))
+        else:
+            candidate.matched = True
+            matches.append((candidate, row))
+            result['matches'].append((line, candidate.id))
+    result['unmatched_transactions'] = [
+        candidate for candidate in index.candidates
+        if not candidate.matched and first_date <= candidate.date <= last_date
+    ]
+    if matches and not dry_run:
+        mark_checked(user_id, matches)
+    return result
@@ -0,0 +1,222 @@
+"""
+Monthly rollups (MonthlyRollup) behind the journal summary.
+
+Every transaction write adds/removes its amount to the row of its
+user/account/month, so summaries over any range read a handful of rollup
+rows instead of aggregating the transactions. Expenses are stored as a
+positive value and net is income - expense.
+"""
+from decimal import Decimal
+
+from django.db import (
+    IntegrityError,
+    connection,
+    transaction as db_transaction
+)
+from django.db.models import (
+    Case,
+    Count,
+    DecimalField,
+    F,
+    Q,
+    Sum,
+    Value,
+    When
+)
+from django.db.models.functions import TruncMonth
+
+from core.models import (
+    ArchivedTransaction,
+    MonthlyRollup,
+    Transaction
+)
+
+ZERO = Decimal('0')
+CENTS = Decimal('0.01')
+
+
+def month_of(date):
+    return date.replace(day=1)
+
+
+FIELDS = ('income', 'expense', 'net', 'count', 'checked_total', 'unchecked_total')
+
+
+def _existing(keys):
+    """The (user, account, month) keys that have a rollup row."""
+    return set(
+        MonthlyRollup.objects.filter(
+            username_id__in={user_id for user_id, _, _ in keys},
+            month__in={month for _, _, month in keys}
+        ).values_list('username_id', 'account_id', 'month')
+    )
+
+
+def collect(transactions, sign=1, deltas=None):
+    """
+    The deltas of adding (sign=1) or removing (sign=-1) transactions, grouped
+    by user/account/month, added to deltas when given; see apply().
+    """
+    deltas = {} if deltas is None else deltas
+    for trs in transactions:
+        amount = Decimal(trs.amount) * sign
+        key = (trs.username_id, trs.account_id, month_of(trs.date))
+        delta = deltas.setdefault(key, dict(dict.fromkeys(FIELDS, ZERO), count=0))
+        if trs.amount > 0:
+            delta['income'] += amount
+        else:
+            delta['expense'] -= amount
+        delta['net'] += amount
+        delta['count'] += sign
+        if trs.checked:
+            delta['checked_total'] += amount
+        else:
+            delta['unchecked_total'] += amount
+    return deltas
+
+
+def apply_many(transactions, sign=1):
+    """Adds (sign=1) or removes (sign=-1) transactions from their rollups."""
+    apply(collect(transactions, sign))
+
+
+def apply(deltas):
+    """
+    Adds collected deltas to their rollups with one executemany, whatever
+    the number of transactions and months touched; months without a rollup
+    yet are inserted together. Months are unique: when another writer
+    inserted one of them meanwhile, the missing ones are inserted empty
+    instead and every month is updated, so both deltas add up in its row.
+    """
+    if not deltas:
+        return
+    existing = _existing(deltas)
+    # New months are inserted with their totals, the others updated in place
+    new = [
+        MonthlyRollup(username_id=user_id, account_id=account_id, month=month, **delta)
+        for (user_id, account_id, month), delta in deltas.items()
+        if (user_id, account_id, month) not in existing
+    ]
+    if new:
+        try:
+            with db_transaction.atomic():
+                MonthlyRollup.objects.bulk_create(new)
+        except IntegrityError:
+            MonthlyRollup.objects.bulk_create([
+                MonthlyRollup(username_id=user_id, account_id=account_id, month=month)
+                for user_id, account_id, month in deltas
+            ], ignore_conflicts=True)
+            existing = set(deltas)
+    _update([(key, delta) for key, delta in deltas.items() if key in existing])
+
+
+def _update(deltas):
+    """Adds the deltas to their rollup rows: one executemany per account/no account."""
+    fields = {name: MonthlyRollup._meta.get_field(name) for name in FIELDS}
+    username, account, month = (MonthlyRollup._meta.get_field(name).column for name in ('username', 'account', 'month'))
+    assignments = ', '.join(f'{f.column} = {f.column} + %s' for f in fields.values())
+    statements = {}
+    for (user_id, account_id, month_date), delta in deltas:
+        params = [
+            delta[name] if name == 'count'
+            else connection.ops.adapt_decimalfield_value(delta[name], f.max_digits, f.decimal_places)
+            for name, f in fields.items()
+        ]
+        params += [user_id, connection.ops.adapt_datefield_value(month_date)]
+        if account_id is not None:
+            params.append(account_id)
+        statements.setdefault(account_id is None, []).append(params)
+    with connection.cursor() as cursor:
+        for no_account, params in statements.items():
+            condition = f'{account} IS NULL' if no_account else f'{account} = %s'
+            cursor.executemany(
+                f'UPDATE {MonthlyRollup._meta.db_table} SET {assignments} '
+                f'WHERE {username} = %s AND {month} = %s AND {condition}',
+                params
+            )
+
+
+def add(trs):
+    apply_many([trs], 1)
+
+
+def remove(trs):
+    """Takes a transaction (its stored state) out of its month."""
+    apply_many([trs], -1)
+
+
+def replace(removed, added):
+    """Takes transactions (their stored states) out and others in, in one pass."""
+    apply(collect(added, 1, collect(removed, -1)))
+
+
+def _sum_when(condition, then):
+    return Sum(Case(
+        When(condition, then=then),
+        default=Value(ZERO),
+        output_field=DecimalField(max_digits=14, decimal_places=2)
+    ))
+
+
+def rebuild(user_id=None, batch_size=1000):
+    """Drops and recomputes the rollups of a user (all users when None)."""
+    rollups = MonthlyRollup.objects.all()
+    # Archived transactions still count (their months are not live ones);
+    # opening rows never do
+    sources = [Transaction.objects.filter(opening=False), ArchivedTransaction.objects.all()]
+    if user_id is not None:
+        rollups = rollups.filter(username_id=user_id)
+        sources = [qs.filter(username_id=user_id) for qs in sources]
+    rollups.delete()
+    created = 0
+    batch = []
+    for transactions in sources:
+        rows = transactions.annotate(month=TruncMonth('date')).values(
+            'username_id', 'account_id', 'month'
+        ).annotate(
+            income=_sum_when(Q(amount__gt=0), F('amount')),
+            expense=_sum_when(Q(amount__lt=0), -F('amount')),
+            net=Sum('amount'),
+            count=Count('id'),
+            checked_total=_sum_when(~Q(checked=0), F('amount')),
+            unchecked_total=_sum_when(Q(checked=0), F('amount'))
+        ).order_by()
+        for row in rows.iterator():
+            batch.append(MonthlyRollup(**row))
+            if len(batch) >= batch_size:
+                created += len(MonthlyRollup.objects.bulk_create(batch))
+                batch = []
+    created += len(MonthlyRollup.objects.bulk_create(batch))
+    return created
+
+
+def summary(user_id, account_id=None, date_from=None, date_to=None):
+    """Per month totals and the overall totals, read from the rollups only."""
+    # Rows left empty once their transactions are gone are not months
+    qs = MonthlyRollup.objects.filter(username_id=user_id).exclude(count=0)
+    if account_id:
+        qs = qs.filter(account_id=account_id)
+    if date_from:
+        qs = qs.filter(month__gte=month_of(date_from))
+    if date_to:
+        qs = qs.filter(month__lte=month_of(date_to))
+    totals = {
+        'income': Sum('income'),
+        'expense': Sum('expense'),
+        'net': Sum('net'),
+        'count': Sum('count'),
+        'checked_total': Sum('checked_total'),
+        'unchecked_total': Sum('unchecked_total'),
+    }
+    months = list(qs.values('month').annotate(**totals).order_by('month'))
+    overall = {key: ZERO for key in totals}
+    overall['count'] = 0
+    for row in months:
+        for key in totals:
+            if key != 'count':
+                # SQLite sums come back without the field scale
+                row[key] = Decimal(row[key]).quantize(CENTS)
+            overall[key] += row[key]
+    if not months:
+        overall.update({key: ZERO.quantize(CENTS) for key in totals if key != 'count'})
+    return months, overall
@@ -0,0 +1,129 @@
+"""
+Full text search over transaction descriptions and notes.
+
+On SQLite builds with FTS5 the core_transaction_fts virtual table indexes
+description and notes as an external content table of core_transaction,
+kept in sync by triggers (so bulk inserts, bulk updates and cascades are
+covered too). Searches are prefix queries ranked by bm25. Without FTS5 the
+search falls back to icontains.
+
+The table and triggers are installed from post_migrate rather than from a
+migration: Django's SQLite schema editor rebuilds core_transaction on most
+ALTERs, which drops its triggers, and they must come back after that.
+"""
+import re
+
+from django.db import (
+    connections,
+    DEFAULT_DB_ALIAS,
+    OperationalError
+)
+from django.db.models import Q
+
+from core.models import (
+    Account,
+    Transaction
+)
+
+FTS_TABLE = 'core_transaction_fts'
+TOKEN = re.compile(r'\w+', re.UNICODE)
+
+_enabled = {}
+
+
+def _statements(table):
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {table} BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, description, notes) VALUES (new.id, new.description, new.notes);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {table} BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, description, notes) VALUES ('delete', old.id, old.description, old.notes);
+        END""",
+        # Only these columns: balance shifts must not touch the index
+        f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF description, notes ON {table} BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, description, notes) VALUES ('delete', old.id, old.description, old.notes);
+            INSERT INTO {FTS_TABLE}(rowid, description, notes) VALUES (new.id, new.description, new.notes);
+        END""",
+    ]
+
+
+def install(using=DEFAULT_DB_ALIAS):
+    """Creates the FTS5 table (indexing the existing rows) and its triggers."""
+    connection = connections[using]
+    _enabled.pop(using, None)
+    if connection.vendor != 'sqlite':
+        return False
+    table = Transaction._meta.db_table
+    with connection.cursor() as cursor:
+        tables = connection.introspection.table_names(cursor)
+        if table not in tables:
+            return False
+        if FTS_TABLE not in tables:
+            try:
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+                    f"description, notes, content='{table}', content_rowid='id')"
+                )
+            except OperationalError:
+                # SQLite built without FTS5
+                return False
+            rebuild(using)
+        for sql in _statements(table):
+            cursor.execute(sql)
+    return True
+
+
+def uninstall_triggers(using=DEFAULT_DB_ALIAS):
+    """Drops the sync triggers, for bulk loads followed by rebuild() and install()."""
+    with connections[using].cursor() as cursor:
+        for suffix in ('ai', 'ad', 'au'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}')
+
+
+def rebuild(using=DEFAULT_DB_ALIAS):
+    """Indexes all the transactions again."""
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def fts_enabled(using=DEFAULT_DB_ALIAS):
+    if using not in _enabled:
+        connection = connections[using]
+        _enabled[using] = (
+            connection.vendor == 'sqlite' and
+            FTS_TABLE in connection.introspection.table_names()
+        )
+    return _enabled[using]
+
+
+def fts_query(text):
+    """Every word of the text as a prefix, all of them required."""
+    return ' '.join(f'"{token}"*' for token in TOKEN.findall(text or ''))
+
+
+def search_ids(user_id, text, limit):
+    """Ids of the user's transactions matching the text, best match first."""
+    query = fts_query(text)
+    if not query:
+        return []
+    if fts_enabled():
+        table = Transaction._meta.db_table
+        account_table = Account._meta.db_table
+        with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+            cursor.execute(
+                f"SELECT t.id FROM {FTS_TABLE} f JOIN {table} t ON t.id = f.rowid "
+                f"WHERE {FTS_TABLE} MATCH %s AND t.username_id = %s "
+                # Like Transaction.objects, without the deleted accounts
+                f"AND (t.account_id IS NULL OR t.account_id NOT IN "
+                f"(SELECT id FROM {account_table} WHERE deleted_at IS NOT NULL)) "
+                f"ORDER BY bm25({FTS_TABLE}), t.date DESC LIMIT %s",
+                [query, user_id, limit]
+            )
+            return [row[0] for row in cursor.fetchall()]
+    condition = Q()
+    for token in TOKEN.findall(text):
+        condition &= Q(description__icontains=token) | Q(notes__icontains=token)
+    return list(
+        Transaction.objects.filter(condition, username_id=user_id)
+        .order_by('-date', '-id').values_list('id', flat=True)[:limit]
+    )
@@ -0,0 +1,80 @@
+"""
+Row serializers for the JSON endpoints.
+
+A RowSerializer looks at the model fields once and keeps, for each one, the
+attribute to read and the converter of its value. Rows can then be turned
+into dicts straight from values_list() tuples, without building model
+instances. Foreign keys are written as their id, decimals as numbers and
+dates as ISO strings.
+"""
+import functools
+import operator
+
+from django.db import models
+
+
+def _decimal(value):
+    return float(value) if value is not None else None
+
+
+def _isoformat(value):
+    return value.isoformat() if value is not None else None
+
+
+def field_converter(field):
+    if isinstance(field, models.DecimalField):
+        return _decimal
+    if isinstance(field, (models.DateField, models.TimeField)):
+        # DateTimeField is a DateField subclass
+        return _isoformat
+    return None
+
+
+class RowSerializer:
+
+    def __init__(self, model, fields=None):
+        model_fields = [
+            f for f in model._meta.concrete_fields
+            if fields is None or f.name in fields
+        ]
+        self.model = model
+        self.names = tuple(f.name for f in model_fields)
+        # attname is the "<fk>_id" column for foreign keys, so no related lookup
+        self.attnames = tuple(f.attname for f in model_fields)
+        self.converters = tuple(
+            (i, converter) for i, converter in enumerate(map(field_converter, model_fields))
+            if converter is not None
+        )
+        self._getter = operator.attrgetter(*self.attnames)
+
+    def values_list(self, qs):
+        return qs.values_list(*self.attnames)
+
+    def from_tuple(self, row):
+        if self.converters:
+            row = list(row)
+            for i, converter in self.converters:
+                row[i] = converter(row[i])
+        return dict(zip(self.names, row))
+
+    def from_model(self, obj):
+        row = self._getter(obj)
+        return self.from_tuple(row if len(self.attnames) > 1 else (row,))
+
+    def serialize(self, qs):
+        return [self.from_tuple(row) for row in self.values_list(qs)]
+
+
+@functools.lru_cache(maxsize=None)
+def serializer_for(model, fields=None):
+    """Shared RowSerializer of a model (fields must be a tuple, if given)."""
+    return RowSerializer(model, fields)
+
+
+def serialize(obj):
+    """Serializes a model instance, a queryset or a list of instances."""
+    if isinstance(obj, models.QuerySet):
+        return serializer_for(obj.model).serialize(obj)
+    if isinstance(obj, models.Model):
+        return serializer_for(type(obj)).from_model(obj)
+    return [serializer_for(type(r)).from_model(r) for r in obj]
@@ -0,0 +1,35 @@
+"""
+SQLite connection profile.
+
+apply_pragmas() runs on connection_created and sets the PRAGMAs configured in
+settings.SQLITE_PRAGMAS on every new SQLite connection. Together with
+CONN_MAX_AGE (connections reused across requests) it makes the bundled
+database fit for a few concurrent workers.
+"""
+import re
+
+from django.conf import settings
+
+PRAGMA_NAME = re.compile(r'^[a-z_]+$')
+PRAGMA_VALUE = re.compile(r'^-?\w+$')
+
+
+def pragma_statements(pragmas):
+    statements = []
+    for name, value in pragmas.items():
+        value = str(value)
+        if not PRAGMA_NAME.match(name) or not PRAGMA_VALUE.match(value):
+            raise ValueError(f'Invalid SQLite PRAGMA: {name} = {value}')
+        statements.append(f'PRAGMA {name} = {value}')
+    return statements
+
+
+def apply_pragmas(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', {})
+    if not pragmas:
+        return
+    with connection.cursor() as cursor:
+        for sql in pragma_statements(pragmas):
+            cursor.execute(sql)
@@ -0,0 +1,115 @@
+"""
+Startup cost of a process of this project.
+
+profile() boots Django in a fresh interpreter run with -X importtime, the way
+a worker or a manage.py command does (settings, apps and their ready(),
+then the URLconf), and returns how long each step took with the import time
+of every module. This process has imported it all already, hence the child.
+"""
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+
+# Run in the child; timings go to stdout as JSON, -X importtime to stderr
+PROBE = '''
+import json
+import time
+
+start = time.perf_counter()
+steps = []
+ready = []
+
+
+def step(name, since):
+    now = time.perf_counter()
+    steps.append((name, (now - since) * 1000))
+    return now
+
+
+import django
+from django.apps.config import AppConfig
+from django.conf import settings
+
+create = AppConfig.create.__func__
+
+
+def timed_create(cls, entry):
+    config = create(cls, entry)
+    config_ready = config.ready
+
+    def timed_ready():
+        since = time.perf_counter()
+        config_ready()
+        ready.append((config.name, (time.perf_counter() - since) * 1000))
+    config.ready = timed_ready
+    return config
+
+
+AppConfig.create = classmethod(timed_create)
+since = step('django', start)
+settings.INSTALLED_APPS
+since = step('settings', since)
+django.setup()
+since = step('apps', since)
+from django.urls import get_resolver
+get_resolver().url_patterns
+since = step('urls', since)
+print(json.dumps({'steps': steps, 'ready': ready, 'total': (since - start) * 1000}))
+'''
+
+
+class Module:
+    __slots__ = ('name', 'self_ms', 'cumulative_ms', 'depth')
+
+    def __init__(self, name, self_ms, cumulative_ms, depth):
+        self.name = name
+        self.self_ms = self_ms
+        self.cumulative_ms = cumulative_ms
+        self.depth = depth
+
+
+def parse_importtime(text):
+    """Modules of -X importtime output, in import order."""
+    modules = []
+    for line in text.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append(Module(name.strip(), int(self_us) / 1000, int(cumulative_us) / 1000, depth))
+    return modules
+
+
+def packages(modules):
+    """Import time spent in each top level package, largest first."""
+    totals = {}
+    for module in modules:
+        package = module.name.split('.')[0]
+        totals[package] = totals.get(package, 0) + module.self_ms
+    return sorted(totals.items(), key=lambda item: -item[1])
+
+
+def profile():
+    """
+    Returns {'steps': [(name, ms)], 'ready': [(app, ms)], 'total': ms,
+    'modules': [Module]} of a fresh boot with this process' settings.
+    """
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'mireis.settings'))
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROBE],
+        # Where the settings read .env from, with the project importable
+        cwd=settings.BASE_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=False
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'Startup failed')
+    # The JSON line is the last one, should anything else print
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings['modules'] = parse_importtime(result.stderr)
+    return timings
@@ -0,0 +1,216 @@
+"""
+Bank statement import (CSV and OFX).
+
+Statements are parsed as a stream of rows, each row validated on its own and
+the valid ones inserted with bulk_create in batches, all inside one atomic
+block. Invalid rows are reported back with their line (CSV) or entry (OFX)
+number and do not abort the import.
+"""
+import csv
+import datetime
+import io
+import re
+
+from decimal import (
+    Decimal,
+    InvalidOperation
+)
+
+from django.conf import settings
+from django.db import transaction as db_transaction
+
+from core.models import Transaction
+
+from . import (
+    archive,
+    balances,
+    rollups,
+    tags,
+    usercache
+)
+
+CSV_REQUIRED_COLUMNS = ('date', 'description', 'amount')
+CSV_DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y')
+OFX_TAG = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<]*)')
+OFX_READ_SIZE = 64 * 1024
+_amount_field = Transaction._meta.get_field('amount')
+# Amounts the column holds: max_digits, decimal_places of them after the point
+AMOUNT_LIMIT = Decimal(10) ** (_amount_field.max_digits - _amount_field.decimal_places)
+
+
+class StatementError(Exception):
+    pass
+
+
+def parse_amount(value):
+    value = (value or '').strip()
+    if ',' in value and '.' not in value:
+        value = value.replace(',', '.')
+    try:
+        amount = Decimal(value).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise ValueError(f'Invalid amount: "{value}"')
+    # Caught here, as an input error, rather than by the insert or the balances
+    if not amount.is_finite() or abs(amount) >= AMOUNT_LIMIT:
+        raise ValueError(f'Invalid amount: "{value}"')
+    return amount
+
+
+def parse_csv_date(value):
+    for date_format in CSV_DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime((value or '').strip(), date_format).date()
+        except ValueError:
+            pass
+    raise ValueError(f'Invalid date: "{value}"')
+
+
+def parse_ofx_date(value):
+    # DTPOSTED is YYYYMMDD followed by optional time and timezone
+    try:
+        return datetime.datetime.strptime((value or '').strip()[:8], '%Y%m%d').date()
+    except ValueError:
+        raise ValueError(f'Invalid date: "{value}"')
+
+
+def read_csv(stream):
+    """Yields (line number, row dict) from a CSV statement with a header line."""
+    reader = csv.DictReader(stream)
+    columns = [c.strip().lower() for c in reader.fieldnames or []]
+    missing = [c for c in CSV_REQUIRED_COLUMNS if c not in columns]
+    if missing:
+        raise StatementError(f'Missing CSV columns: {", ".join(missing)}')
+    reader.fieldnames = columns
+    for row in reader:
+        yield reader.line_num, row
+
+
+def csv_row(row):
+    return {
+        'date': parse_csv_date(row.get('date')),
+        'description': (row.get('description') or '').strip(),
+        'amount': parse_amount(row.get('amount')),
+        'notes': row.get('notes') or None,
+        'check_code': (row.get('check_code') or '').strip(),
+        'checked': int(row.get('checked') or 0),
+        'tags': tags.format_tags(tags.parse_tags(row.get('tags'))),
+    }
+
+
+def read_ofx(stream):
+    """
+    Yields (entry number, fields) for each STMTTRN of an OFX statement. The
+    file is read in fixed size blocks, since SGML OFX files often come in a
+    single line.
+    """
+    entry = None
+    number = 0
+    buffer = ''
+    while True:
+        block = stream.read(OFX_READ_SIZE)
+        buffer += block
+        # Keep the last (maybe incomplete) tag for the next block
+        cut = buffer.rfind('<') if block else len(buffer)
+        for closing, tag, value in OFX_TAG.findall(buffer[:cut if cut > 0 else 0]):
+            tag = tag.upper()
+            if tag == 'STMTTRN':
+                if closing:
+                    if entry is not None:
+                        yield number, entry
+                    entry = None
+                else:
+                    number += 1
+                    entry = {}
+            elif entry is not None and not closing:
+                entry[tag] = value.strip()
+        buffer = buffer[cut:] if cut > 0 else buffer
+        if not block:
+            break
+
+
+def ofx_row(row):
+    description = row.get('NAME') or row.get('MEMO') or ''
+    return {
+        'date': parse_ofx_date(row.get('DTPOSTED')),
+        'description': description,
+        'amount': parse_amount(row.get('TRNAMT')),
+        'notes': row.get('MEMO') if row.get('NAME') and row.get('MEMO') else None,
+        'check_code': (row.get('FITID') or row.get('CHECKNUM') or '')[:50],
+        'checked': 0,
+        'tags': None,
+    }
+
+
+READERS = {
+    'csv': (read_csv, csv_row),
+    'ofx': (read_ofx, ofx_row),
+}
+
+
+def guess_format(filename):
+    return 'ofx' if filename and filename.lower().endswith(('.ofx', '.qfx')) else 'csv'
+
+
+def text_stream(binary, encoding='utf-8-sig'):
+    return io.TextIOWrapper(binary, encoding=encoding, errors='replace', newline='')
+
+
+def import_statement(stream, user_id, account_id=None, statement_format='csv', batch_size=None):
+    """
+    Imports a statement text stream into the user's account.
+
+    Returns (number of imported transactions, [(line, error message), ...]).
+    Raises StatementError when the file itself can not be read.
+    """
+    if statement_format not in READERS:
+        raise StatementError(f'Unknown statement format: {statement_format}')
+    batch_size = batch_size or settings.STATEMENT_IMPORT_BATCH_SIZE
+    reader, to_row = READERS[statement_format]
+    imported = 0
+    errors = []
+    first_date = None
+    batch = []
+    # Applied once at the end, whatever the number of batches
+    deltas = {}
+
+    def flush():
+        Transaction.objects.bulk_create(batch)
+        rollups.collect(batch, 1, deltas)
+
+    with db_transaction.atomic():
+        # bulk_create does not give the new ids back on every backend; rows
+        # after this id are the imported ones (re-syncing others is harmless)
+        last_id = Transaction.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        tagged = False
+        before = archive.cutoff(user_id)
+        for line, raw in reader(stream):
+            try:
+                row = to_row(raw)
+                if not row['description']:
+                    raise ValueError('Missing description')
+                archive.check_date(row['date'], before)
+            except ValueError as e:
+                errors.append((line, str(e)))
+                continue
+            batch.append(Transaction(username_id=user_id, account_id=account_id, **row))
+            tagged = tagged or row['tags'] is not None
+            if first_date is None or row['date'] < first_date:
+                first_date = row['date']
+            if len(batch) >= batch_size:
+                flush()
+                imported += len(batch)
+                batch = []
+        if batch:
+            flush()
+            imported += len(batch)
+        rollups.apply(deltas)
+        if tagged:
+            tags.sync(
+                Transaction.objects.filter(username_id=user_id, id__gt=last_id).exclude(tags=None)
+                .only('id', 'username_id', 'tags').iterator()
+            )
+        if account_id and first_date:
+            balances.rebalance(account_id, first_date)
+        # bulk_create sends no signals
+        usercache.bump(user_id)
+    return imported, errors
@@ -0,0 +1,169 @@
+"""
+Normalized tags.
+
+Transaction.tags stays the comma separated text it always was; Tag and the
+Transaction.tag_index many-to-many are derived from it, so filtering and
+aggregating by tag goes through indexes instead of LIKE scans. Tag names are
+stripped, lower case and without a leading "#".
+"""
+from django.db.models import (
+    Count,
+    DecimalField,
+    Q,
+    Sum,
+    Value
+)
+from django.db.models.functions import Coalesce
+
+from core.models import (
+    ArchivedTransaction,
+    Tag,
+    Transaction
+)
+
+NAME_LENGTH = Tag._meta.get_field('name').max_length
+SYNC_CHUNK_SIZE = 500
+# Per transaction, so that saving one runs a fixed number of queries
+MAX_TAGS = 100
+
+
+def parse_tags(text):
+    """Sorted, unique tag names of a tags text."""
+    names = set()
+    for name in (text or '').split(','):
+        name = name.strip().lstrip('#').strip().lower()[:NAME_LENGTH]
+        if name:
+            names.add(name)
+    return sorted(names)
+
+
+def format_tags(names):
+    return ', '.join(names) if names else None
+
+
+def tag_ids(user_id, names):
+    """{name: id} of the user's tags, creating the missing ones."""
+    if not names:
+        return {}
+    ids = dict(Tag.objects.filter(username_id=user_id, name__in=names).values_list('name', 'id'))
+    missing = [name for name in names if name not in ids]
+    if missing:
+        Tag.objects.bulk_create(
+            [Tag(username_id=user_id, name=name) for name in missing],
+            ignore_conflicts=True
+        )
+        ids.update(Tag.objects.filter(username_id=user_id, name__in=missing).values_list('name', 'id'))
+    return ids
+
+
+def _sync_chunk(transactions):
+    Link = Transaction.tag_index.through
+    wanted = {trs.id: (trs.username_id, parse_tags(trs.tags)) for trs in transactions}
+    names_by_user = {}
+    for user_id, names in wanted.values():
+        names_by_user.setdefault(user_id, set()).update(names)
+    ids = {
+        user_id: tag_ids(user_id, sorted(names))
+        for user_id, names in names_by_user.items()
+    }
+    Link.objects.filter(transaction_id__in=list(wanted)).delete()
+    Link.objects.bulk_create([
+        Link(transaction_id=pk, tag_id=ids[user_id][name])
+        for pk, (user_id, names) in wanted.items()
+        for name in names
+    ])
+
+
+def sync(transactions):
+    """Makes the tag links of saved transactions match their tags text."""
+    chunk = []
+    for trs in transactions:
+        chunk.append(trs)
+        if len(chunk) >= SYNC_CHUNK_SIZE:
+            _sync_chunk(chunk)
+            chunk = []
+    if chunk:
+        _sync_chunk(chunk)
+
+
+def set_tags(trs, text):
+    """Normalizes the tags text of a transaction (not saved yet)."""
+    trs.tags = format_tags(parse_tags(text))
+
+
+def filter_by_tag(qs, user_id, name):
+    names = parse_tags(name)
+    if qs.model is ArchivedTransaction:
+        # No tag links in the archive: matched in the normalized tags text
+        if not names:
+            return qs.none()
+        return qs.filter(
+            Q(tags=names[0]) | Q(tags__startswith=f'{names[0]}, ') | Q(tags__endswith=f', {names[0]}')
+            | Q(tags__contains=f', {names[0]}, ')
+        )
+    tag_id = Tag.objects.filter(
+        username_id=user_id,
+        name=names[0]
+    ).values_list('id', flat=True).first() if names else None
+    return qs.filter(tag_index=tag_id) if tag_id else qs.none()
+
+
+def _sum(condition=None):
+    return Coalesce(
+        Sum('transactions__amount', filter=condition),
+        Value(0),
+        output_field=DecimalField(max_digits=14, decimal_places=2)
+    )
+
+
+def _archived_summary(user_id, account_id, date_from, date_to):
+    """Count and totals per tags text of the user's archived transactions."""
+    qs = ArchivedTransaction.objects.filter(username_id=user_id).exclude(tags=None)
+    if account_id:
+        qs = qs.filter(account_id=account_id)
+    if date_from:
+        qs = qs.filter(date__gte=date_from)
+    if date_to:
+        qs = qs.filter(date__lte=date_to)
+    zero = Value(0, output_field=DecimalField(max_digits=14, decimal_places=2))
+    return qs.values('tags').annotate(
+        count=Count('id'),
+        income=Coalesce(Sum('amount', filter=Q(amount__gt=0)), zero),
+        expense=Coalesce(Sum('amount', filter=Q(amount__lt=0)), zero),
+        net=Coalesce(Sum('amount'), zero)
+    ).order_by()
+
+
+def summary(user_id, account_id=None, date_from=None, date_to=None):
+    """Per tag count and totals of the user's transactions, archived ones included."""
+    # Transactions of deleted accounts are hidden until purged (no account counts as kept)
+    condition = Q(transactions__account__deleted_at=None)
+    if account_id:
+        condition &= Q(transactions__account_id=account_id)
+    if date_from:
+        condition &= Q(transactions__date__gte=date_from)
+    if date_to:
+        condition &= Q(transactions__date__lte=date_to)
+    rows = list(
+        Tag.objects.filter(condition, username_id=user_id).values('name').annotate(
+            count=Count('transactions'),
+            income=_sum(Q(transactions__amount__gt=0)),
+            expense=_sum(Q(transactions__amount__lt=0)),
+            net=_sum()
+        ).order_by('name')
+    )
+    by_name = {row['name']: row for row in rows}
+    # Archived transactions have no tag links: grouped by tags text, which is
+    # then split, one text for many transactions
+    for archived in _archived_summary(user_id, account_id, date_from, date_to):
+        for name in parse_tags(archived['tags']):
+            row = by_name.get(name)
+            if row is None:
+                row = by_name[name] = {'name': name, 'count': 0, 'income': 0, 'expense': 0, 'net': 0}
+            for key in ('count', 'income', 'expense', 'net'):
+                row[key] += archived[key]
+    rows = [by_name[name] for name in sorted(by_name)]
+    for row in rows:
+        # Same convention as the monthly rollups: expenses as a positive value
+        row['expense'] = -row['expense']
+    return rows
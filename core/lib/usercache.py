@@ -0,0 +1,126 @@
+"""
+Per user read cache.
+
+Entries are stored under the user's current version (the cache "version"
+argument), and any write to the user's accounts or transactions bumps that
+version, so stale entries are simply never read again and age out of the
+cache. post_save/post_delete signals bump it for model saves and deletes
+(see core.signals); bulk writes, which send no signals, call bump() directly.
+The bump itself waits for the write's database transaction to commit.
+
+Versions only invalidate what the processes sharing the cache stored: with
+more than one process (web workers, run_worker) the cache must be a shared
+one, CACHE_URL, or the others go on serving stale data (check core.W001).
+
+bump() also moves User.data_version and data_changed_at in the write's own
+database transaction. They stamp the user's collections for conditional
+GETs (stamp()), one query that sees the writes of every process whatever
+the cache.
+"""
+import datetime
+import math
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import transaction as db_transaction
+from django.db.models import F
+from django.utils import timezone
+
+_stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+_MISSING = object()
+
+
+def _version_key(user_id):
+    return f'user:{user_id}:version'
+
+
+def _new_version():
+    # Milliseconds, so a version key evicted and created again is still
+    # greater than the versions of the entries stored before
+    return int(time.time() * 1000)
+
+
+def version(user_id):
+    current = cache.get(_version_key(user_id))
+    if current is None:
+        current = _new_version()
+        if not cache.add(_version_key(user_id), current, timeout=None):
+            current = cache.get(_version_key(user_id), current)
+    return current
+
+
+def bump(user_id):
+    """
+    Marks the user's data changed, in the current database transaction, and
+    invalidates everything cached for the user once it commits: bumped any
+    earlier, a read made meanwhile would cache the rows not yet committed
+    over under the new version. Bulk writes, which send no signals, bump once.
+    """
+    from core.models import User
+    User.objects.filter(pk=user_id).update(data_version=F('data_version') + 1, data_changed_at=timezone.now())
+    db_transaction.on_commit(lambda: _bump(user_id))
+
+
+def _bump(user_id):
+    try:
+        cache.incr(_version_key(user_id))
+    except ValueError:
+        cache.set(_version_key(user_id), _new_version(), timeout=None)
+
+
+def stamp(user_id):
+    """
+    (version, modified) of the user's data, from the database: modified is
+    rounded up to the second (HTTP dates have no fractions), None until the
+    first write.
+    """
+    from core.models import User
+    version, changed_at = User.objects.filter(pk=user_id).values_list(
+        'data_version', 'data_changed_at'
+    ).first() or (0, None)
+    if changed_at is None:
+        return version, None
+    return version, datetime.datetime.fromtimestamp(math.ceil(changed_at.timestamp()), tz=datetime.timezone.utc)
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def get_or_set(user_id, name, default):
+    """Cached value of name for the user, computed by default() on a miss."""
+    key = f'user:{user_id}:{name}'
+    current = version(user_id)
+    value = cache.get(key, _MISSING, version=current)
+    if value is _MISSING:
+        _count('misses')
+        value = default()
+        cache.set(key, value, version=current)
+    else:
+        _count('hits')
+    return value
+
+
+def stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+def accounts(user_id):
+    """The user's accounts, ordered by id."""
+    from core.models import Account
+    return get_or_set(
+        user_id,
+        'accounts',
+        lambda: list(Account.objects.filter(username_id=user_id).order_by('id'))
+    )
+
+
+def account(user_id, pk):
+    for acc in accounts(user_id):
+        if acc.id == pk:
+            return acc
+    return None
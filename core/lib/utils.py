@@ -1,17 +1,17 @@
+import hashlib
 import re
 
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes
-
 from django.db import models
 
+from . import serializers
+
 REGX_EMAIL = re.compile(r'^[a-zA-Z0-9.!#$%&’*+/=?^_`{|}~-]+@[a-zA-Z0-9-]+(?:\.[a-zA-Z0-9-]+)*$')
 
 
 def password_digest(password):
-    digest = hashes.Hash(hashes.BLAKE2b(64), backend=default_backend())
-    digest.update(password.encode('utf-8'))
-    return digest.finalize().hex()
+    # BLAKE2b-512, the digest cryptography's hashes.BLAKE2b(64) gave, so the
+    # stored passwords still match; hashlib is already loaded by Django
+    return hashlib.blake2b(password.encode('utf-8'), digest_size=64).hexdigest()
 
 
 def email_validate(email):
@@ -23,22 +23,14 @@ def email_validate(email):
 def model_row_as_dict(model):
     result = None
     if isinstance(model, models.Model):
-        result = {}
-        for f in model._meta.fields:
-            value = getattr(model, f.name)
-            if value is not None:
-                result[f.name] = str(value)
-            else:
-                result[f.name] = value
+        result = serializers.serialize(model)
     return result
 
 
 def model_as_dict(qs):
     result = None
     if isinstance(qs, (models.QuerySet, list)):
-        result = []
-        for r in qs:
-            result.append(model_row_as_dict(r))
+        result = serializers.serialize(qs)
     else:
         result = model_row_as_dict(qs)
-    return result
\ No newline at end of file
+    return result
@@ -0,0 +1,38 @@
+import datetime
+
+from django.core.management.base import (
+    BaseCommand,
+    CommandError
+)
+
+from core.lib import archive
+from core.models import User
+
+
+class Command(BaseCommand):
+    help = 'Moves the transactions of past years to the archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keep-from', type=int, metavar='YEAR',
+            help='First year kept live (defaults to the last ARCHIVE_KEEP_YEARS years)'
+        )
+        parser.add_argument('--user', metavar='USERNAME', help='Only archive this user transactions')
+
+    def handle(self, *args, **options):
+        if options['keep_from']:
+            before = datetime.date(options['keep_from'], 1, 1)
+        else:
+            before = archive.default_cutoff()
+        users = User.objects.filter(deleted_at=None)
+        if options['user']:
+            users = users.filter(username=options['user'])
+            if not users.exists():
+                raise CommandError(f'No user {options["user"]}')
+        total = 0
+        for user_id, username in users.order_by('id').values_list('id', 'username'):
+            archived = archive.archive(user_id, before)
+            if options['verbosity'] > 1:
+                self.stdout.write(f'{username}: {archived} transactions archived')
+            total += archived
+        self.stdout.write(self.style.SUCCESS(f'{total} transactions before {before.isoformat()} archived'))
@@ -0,0 +1,45 @@
+from django.core.management.base import (
+    BaseCommand,
+    CommandError
+)
+
+from core.lib import statements
+from core.models import (
+    User,
+    Account
+)
+
+
+class Command(BaseCommand):
+    help = 'Imports a CSV or OFX bank statement into an user account'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Statement file')
+        parser.add_argument('username', help='Owner of the transactions')
+        parser.add_argument('--account-id', type=int, help='Account of the transactions')
+        parser.add_argument('--format', choices=sorted(statements.READERS), help='Defaults to the file extension')
+        parser.add_argument('--encoding', default='utf-8-sig')
+        parser.add_argument('--batch-size', type=int, help='Transactions per bulk insert')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+            if options['account_id']:
+                Account.objects.get(username=user, pk=options['account_id'])
+        except (User.DoesNotExist, Account.DoesNotExist) as e:
+            raise CommandError(e)
+        statement_format = options['format'] or statements.guess_format(options['path'])
+        with open(options['path'], 'rb') as f:
+            try:
+                imported, errors = statements.import_statement(
+                    statements.text_stream(f, options['encoding']),
+                    user.id,
+                    account_id=options['account_id'],
+                    statement_format=statement_format,
+                    batch_size=options['batch_size']
+                )
+            except statements.StatementError as e:
+                raise CommandError(e)
+        for line, message in errors:
+            self.stderr.write(f'{options["path"]}:{line}: {message}')
+        self.stdout.write(self.style.SUCCESS(f'{imported} transactions imported, {len(errors)} errors'))
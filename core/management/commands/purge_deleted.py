@@ -0,0 +1,28 @@
+from django.core.management.base import (
+    BaseCommand,
+    CommandError
+)
+
+from core.lib import purge
+from core.models import User
+
+
+class Command(BaseCommand):
+    help = 'Purges the transactions of deleted accounts and users, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete-user', metavar='USERNAME', help='Delete this user first')
+        parser.add_argument('--batch-size', type=int, help='Transactions per batch (PURGE_BATCH_SIZE)')
+
+    def handle(self, *args, **options):
+        if options['delete_user']:
+            user = User.objects.filter(username=options['delete_user'], deleted_at=None).first()
+            if user is None:
+                raise CommandError(f'No user {options["delete_user"]}')
+            purge.delete_user(user)
+
+        def progress(kind, pk, deleted):
+            self.stdout.write(f'{kind} {pk}: {deleted} transactions deleted')
+
+        deleted = purge.run(options['batch_size'], progress if options['verbosity'] > 1 else None)
+        self.stdout.write(self.style.SUCCESS(f'{deleted} transactions purged'))
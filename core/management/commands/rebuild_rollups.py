@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.lib import rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the monthly rollups from the transactions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', type=int, help='Only rebuild this user rollups')
+
+    def handle(self, *args, **options):
+        created = rollups.rebuild(user_id=options.get('user_id'))
+        self.stdout.write(self.style.SUCCESS(f'{created} rollup rows rebuilt'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from core.lib import jobs
+
+
+class Command(BaseCommand):
+    help = 'Runs the queued background jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help='Jobs run at the same time')
+        parser.add_argument('--pool', choices=jobs.POOLS, default='thread', help='Run them in threads or processes')
+        parser.add_argument('--poll', type=float, help='Seconds between queue checks when idle (JOBS_POLL_INTERVAL)')
+        parser.add_argument('--burst', action='store_true', help='Stop once the queue is empty')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Worker {jobs.worker_name()}: {options["workers"]} {options["pool"]} workers')
+        try:
+            jobs.work(options['workers'], options['pool'], options['poll'], options['burst'])
+        except KeyboardInterrupt:
+            # The pool waits for the running jobs before this
+            self.stdout.write('Stopped')
@@ -0,0 +1,130 @@
+import datetime
+import random
+import time
+
+from decimal import Decimal
+
+from django.core.management.base import (
+    BaseCommand,
+    CommandError
+)
+from django.db import (
+    connection,
+    transaction as db_transaction
+)
+from django.utils import timezone
+
+from core.lib import (
+    rollups,
+    search,
+    utils
+)
+from core.models import (
+    User,
+    Account,
+    Tag,
+    Transaction
+)
+
+DESCRIPTIONS = (
+    'Supermarket', 'Bakery', 'Gas station', 'Pharmacy', 'Restaurant', 'Rent',
+    'Electricity bill', 'Water bill', 'Internet', 'Phone', 'Salary', 'Transfer',
+    'Bookstore', 'Cinema', 'Gym', 'Insurance', 'Taxi', 'Parking', 'Coffee shop',
+)
+TAGS = ('food', 'home', 'transport', 'health', 'leisure', 'bills', 'work', 'travel')
+PASSWORD = 'benchmark'
+
+
+class Command(BaseCommand):
+    help = (
+        'Generates benchmark users, accounts and transactions (deterministic for a seed). '
+        f'Users are bench<n>@mireis.app with password "{PASSWORD}".'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--accounts', type=int, default=3, help='Accounts per user')
+        parser.add_argument('--transactions', type=int, default=100000, help='Transactions per user')
+        parser.add_argument('--years', type=int, default=10, help='History length')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username__startswith='bench', username__endswith='@mireis.app').exists():
+            raise CommandError('Benchmark users already exist')
+        rnd = random.Random(options['seed'])
+        started = time.perf_counter()
+        total = 0
+        with db_transaction.atomic():
+            # Indexing the text once at the end is cheaper than a trigger per row
+            fts = search.fts_enabled()
+            if fts:
+                search.uninstall_triggers()
+            for n in range(options['users']):
+                user = User.objects.create(username=f'bench{n}@mireis.app', password=utils.password_digest(PASSWORD))
+                accounts = [
+                    Account.objects.create(username=user, name=f'Account {a}', agency=f'{a:04d}', number=str(n * 100 + a))
+                    for a in range(options['accounts'])
+                ]
+                Tag.objects.bulk_create([Tag(username=user, name=name) for name in TAGS])
+                tag_ids = dict(Tag.objects.filter(username=user).values_list('name', 'id'))
+                total += self.seed_transactions(user, accounts, tag_ids, rnd, options)
+                rollups.rebuild(user.id)
+                self.stdout.write(f'{user.username}: {options["transactions"]} transactions')
+            if fts:
+                search.rebuild()
+                search.install()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'{total} transactions in {elapsed:.1f}s ({total / elapsed:.0f}/s)'))
+
+    def seed_transactions(self, user, accounts, tag_ids, rnd, options):
+        """
+        Plain executemany inserts with explicit ids, so the tag links and the
+        running balances are written in the same pass instead of afterwards.
+        """
+        count = options['transactions']
+        days = options['years'] * 365
+        start = datetime.date.today() - datetime.timedelta(days=days)
+        next_id = (Transaction.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+        balances = {a.id: Decimal('0') for a in accounts}
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        table = Transaction._meta.db_table
+        link_table = Transaction.tag_index.through._meta.db_table
+        insert = (
+            f'INSERT INTO {table} (id, username_id, account_id, date, description, notes, amount, '
+            f'check_code, checked, tags, balance, updated_at, opening) '
+            f'VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, 0)'
+        )
+        insert_link = f'INSERT INTO {link_table} (transaction_id, tag_id) VALUES (%s, %s)'
+        rows = []
+        links = []
+        with connection.cursor() as cursor:
+            # Ascending dates, so balances can be accumulated as rows are made
+            for i in range(count):
+                pk = next_id + i
+                date = start + datetime.timedelta(days=i * days // count)
+                account = rnd.choice(accounts)
+                if rnd.random() < 0.1:
+                    amount = Decimal(rnd.randint(100000, 900000)) / 100
+                else:
+                    amount = -Decimal(rnd.randint(100, 50000)) / 100
+                balances[account.id] += amount
+                names = sorted(rnd.sample(TAGS, rnd.randint(0, 2)))
+                links.extend((pk, tag_ids[name]) for name in names)
+                rows.append((
+                    pk, user.id, account.id, date.isoformat(), rnd.choice(DESCRIPTIONS),
+                    None if rnd.random() < 0.8 else f'Note {pk}',
+                    str(amount), str(pk), 1 if date < start + datetime.timedelta(days=days - 30) else 0,
+                    ', '.join(names) or None, str(balances[account.id]), now
+                ))
+                if len(rows) >= options['batch_size']:
+                    cursor.executemany(insert, rows)
+                    cursor.executemany(insert_link, links)
+                    rows = []
+                    links = []
+            if rows:
+                cursor.executemany(insert, rows)
+                cursor.executemany(insert_link, links)
+        for account in accounts:
+            Account.objects.filter(pk=account.id).update(balance=balances[account.id], updated_at=timezone.now())
+        return count
@@ -0,0 +1,34 @@
+from django.core.management.base import (
+    BaseCommand,
+    CommandError
+)
+
+from core.lib import startup
+
+
+class Command(BaseCommand):
+    help = 'Profiles the startup of a fresh process: settings, apps ready and URLconf, and module import times'
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=20, help='Modules and packages listed')
+        parser.add_argument('--runs', type=int, default=1, help='Boots profiled, the fastest one is shown')
+
+    def handle(self, *args, **options):
+        try:
+            timings = min((startup.profile() for _ in range(max(options['runs'], 1))), key=lambda t: t['total'])
+        except RuntimeError as e:
+            raise CommandError(e)
+        self.stdout.write(f'Startup: {timings["total"]:.1f} ms')
+        for name, ms in timings['steps']:
+            self.stdout.write(f'  {name:<40} {ms:9.1f} ms')
+            if name == 'apps':
+                for app, ready_ms in timings['ready']:
+                    self.stdout.write(f'    {app + " ready()":<38} {ready_ms:9.1f} ms')
+        modules = timings['modules']
+        self.stdout.write('Import time by package (self):')
+        for package, ms in startup.packages(modules)[:options['limit']]:
+            self.stdout.write(f'  {package:<40} {ms:9.1f} ms')
+        self.stdout.write('Slowest imports (cumulative):')
+        for module in sorted(modules, key=lambda m: -m.cumulative_ms)[:options['limit']]:
+            self.stdout.write(f'  {module.name:<40} {module.cumulative_ms:9.1f} ms')
@@ -0,0 +1,129 @@
+import asyncio
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import (
+    FileResponse,
+    HttpResponseNotModified
+)
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+from .lib import (
+    assets,
+    profiling
+)
+
+
+class ProfilingMiddleware:
+    """
+    Records the profile of every request (see core.lib.profiling). Only
+    active with PROFILING on; works for sync and async views alike, so the
+    async ones are not pushed back to a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROFILING:
+            raise MiddlewareNotUsed()
+        profiling.install_template_timing()
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Marks the instance as a coroutine function for Django
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        profile, token = profiling.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiling.stop(token)
+        return self.finish(request, response, profile)
+
+    async def __acall__(self, request):
+        profile, token = profiling.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            profiling.stop(token)
+        return self.finish(request, response, profile)
+
+    def finish(self, request, response, profile):
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        if response.streaming:
+            # Recorded once the body is sent, which is when it is produced
+            response.streaming_content = self.counted(request, response, response.streaming_content, view, profile)
+        else:
+            profiling.record(view, request.method, response.status_code, profile, len(response.content))
+        return response
+
+    def counted(self, request, response, content, view, profile):
+        size = 0
+        _, token = profiling.start(profile)
+        try:
+            for chunk in content:
+                size += len(chunk)
+                yield chunk
+        finally:
+            profiling.stop(token)
+            profiling.record(view, request.method, response.status_code, profile, size)
+
+
+class StaticFilesMiddleware:
+    """
+    Serves the collected static files (STATIC_ROOT) before the rest of the
+    stack, with the cache headers and precompressed variants of
+    core.lib.assets. Only with STATIC_SERVE on and STATIC_ROOT collected;
+    files collected after it started are not seen until a restart.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        root = settings.STATIC_ROOT
+        if not settings.STATIC_SERVE or not root:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+        self.prefix = settings.STATIC_URL
+        self.files = assets.index(root)
+
+    def find(self, request):
+        if request.path_info.startswith(self.prefix) and request.method in ('GET', 'HEAD'):
+            return self.files.get(request.path_info[len(self.prefix):])
+        return None
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        static_file = self.find(request)
+        if static_file is None:
+            return self.get_response(request)
+        return self.serve(request, static_file)
+
+    async def __acall__(self, request):
+        static_file = self.find(request)
+        if static_file is None:
+            return await self.get_response(request)
+        return self.serve(request, static_file)
+
+    def serve(self, request, static_file):
+        last_modified = http_date(static_file.mtime)
+        if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), static_file.mtime, static_file.size):
+            response = HttpResponseNotModified()
+        else:
+            path, size, encoding = static_file.variant(request.META.get('HTTP_ACCEPT_ENCODING'))
+            response = FileResponse(open(path, 'rb'), content_type=static_file.content_type)
+            response['Content-Length'] = size
+            if encoding:
+                response['Content-Encoding'] = encoding
+        response['Last-Modified'] = last_modified
+        response['Cache-Control'] = assets.cache_control(static_file)
+        if static_file.variants:
+            response['Vary'] = 'Accept-Encoding'
+        return response
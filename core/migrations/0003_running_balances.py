@@ -0,0 +1,44 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:50
+
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+def compute_balances(apps, schema_editor):
+    Account = apps.get_model('core', 'Account')
+    Transaction = apps.get_model('core', 'Transaction')
+    for account in Account.objects.all():
+        balance = Decimal('0')
+        batch = []
+        for trs in Transaction.objects.filter(account=account).order_by('date', 'id').iterator():
+            balance += trs.amount
+            trs.balance = balance
+            batch.append(trs)
+            if len(batch) >= 1000:
+                Transaction.objects.bulk_update(batch, ['balance'])
+                batch = []
+        Transaction.objects.bulk_update(batch, ['balance'])
+        account.balance = balance
+        account.save(update_fields=['balance'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_transaction_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='balance',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='balance',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=14, null=True),
+        ),
+        migrations.RunPython(compute_balances, migrations.RunPython.noop),
+    ]
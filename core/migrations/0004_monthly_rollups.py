@@ -0,0 +1,67 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:51
+
+from decimal import Decimal
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_rollups(apps, schema_editor):
+    MonthlyRollup = apps.get_model('core', 'MonthlyRollup')
+    Transaction = apps.get_model('core', 'Transaction')
+    zero = Decimal('0')
+    rows = {}
+    for trs in Transaction.objects.order_by().iterator():
+        key = (trs.username_id, trs.account_id, trs.date.replace(day=1))
+        row = rows.setdefault(key, MonthlyRollup(
+            username_id=key[0],
+            account_id=key[1],
+            month=key[2],
+            income=zero,
+            expense=zero,
+            net=zero,
+            count=0,
+            checked_total=zero,
+            unchecked_total=zero
+        ))
+        if trs.amount > 0:
+            row.income += trs.amount
+        else:
+            row.expense -= trs.amount
+        row.net += trs.amount
+        row.count += 1
+        if trs.checked:
+            row.checked_total += trs.amount
+        else:
+            row.unchecked_total += trs.amount
+    MonthlyRollup.objects.bulk_create(rows.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_running_balances'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('income', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('expense', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('net', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('count', models.IntegerField(default=0)),
+                ('checked_total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('unchecked_total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('account', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='core.account')),
+                ('username', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.user')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='monthlyrollup',
+            index=models.Index(fields=['username', 'month'], name='rollup_user_month_idx'),
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def link_tags(apps, schema_editor):
+    # Same rules as core.lib.tags.parse_tags, at the time of this migration
+    Tag = apps.get_model('core', 'Tag')
+    Transaction = apps.get_model('core', 'Transaction')
+    Link = Transaction.tag_index.through
+    tag_ids = {}
+    links = []
+    # The tags text is rewritten as format_tags(parse_tags(text)), as saves
+    # do from now on, so the text and the links agree
+    rewritten = []
+    for pk, user_id, text in Transaction.objects.exclude(tags=None).values_list('id', 'username_id', 'tags').iterator():
+        names = sorted({n.strip().lstrip('#').strip().lower()[:100] for n in text.split(',')} - {''})
+        for name in names:
+            if (user_id, name) not in tag_ids:
+                tag_ids[(user_id, name)] = Tag.objects.create(username_id=user_id, name=name).id
+            links.append(Link(transaction_id=pk, tag_id=tag_ids[(user_id, name)]))
+        formatted = ', '.join(names) if names else None
+        if formatted != text:
+            rewritten.append(Transaction(id=pk, tags=formatted))
+        if len(links) >= 1000:
+            Link.objects.bulk_create(links)
+            links = []
+    Link.objects.bulk_create(links)
+    # Not while iterating the same table (SQLite reads it in batches)
+    Transaction.objects.bulk_update(rewritten, ['tags'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_monthly_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('username', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.user')),
+            ],
+            options={
+                'unique_together': {('username', 'name')},
+            },
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='tag_index',
+            field=models.ManyToManyField(blank=True, related_name='transactions', to='core.Tag'),
+        ),
+        migrations.RunPython(link_tags, migrations.RunPython.noop),
+    ]
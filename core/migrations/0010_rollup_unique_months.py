@@ -0,0 +1,45 @@
+# Generated by Django 3.2.25 on 2026-10-18 14:05
+
+from django.db import migrations, models
+
+
+FIELDS = ('income', 'expense', 'net', 'count', 'checked_total', 'unchecked_total')
+
+
+def merge_duplicates(apps, schema_editor):
+    # Rows a race inserted twice for the same month, added into the first
+    MonthlyRollup = apps.get_model('core', 'MonthlyRollup')
+    first = {}
+    for row in MonthlyRollup.objects.order_by('id').iterator():
+        key = (row.username_id, row.account_id, row.month)
+        if key not in first:
+            first[key] = row
+            continue
+        kept = first[key]
+        for field in FIELDS:
+            setattr(kept, field, getattr(kept, field) + getattr(row, field))
+        kept.save(update_fields=FIELDS)
+        row.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_archive'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='monthlyrollup',
+            name='rollup_user_month_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='monthlyrollup',
+            constraint=models.UniqueConstraint(fields=('username', 'month', 'account'), name='rollup_user_month_account_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='monthlyrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('account', None)), fields=('username', 'month'), name='rollup_user_month_no_account_uniq'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.25 on 2026-10-18 14:07
+
+from django.db import migrations, models
+
+
+def running_since_started(apps, schema_editor):
+    Job = apps.get_model('core', 'Job')
+    Job.objects.filter(status='running').update(heartbeat_at=models.F('started_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_rollup_unique_months'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(running_since_started, migrations.RunPython.noop),
+    ]
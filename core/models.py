@@ -1,10 +1,27 @@
 from django.db import models
+from django.db.models import Q
+from django.utils import timezone
 
 # Create your models here.
 
 class User(models.Model):
     username = models.CharField(max_length=150, unique=True)
     password = models.TextField()
+    # Set when deleted; the rows go with the purge (see core.lib.purge)
+    deleted_at = models.DateTimeField(null=True, blank=True)
+    # Transactions dated before this are in ArchivedTransaction (see core.lib.archive)
+    archived_before = models.DateField(null=True, blank=True)
+    # Bumped in the database transaction of every write to the user's data,
+    # so every process stamps conditional GETs alike (see core.lib.usercache)
+    data_version = models.PositiveIntegerField(default=0)
+    data_changed_at = models.DateTimeField(null=True, blank=True)
+
+
+class AccountManager(models.Manager):
+    """Leaves out deleted accounts, which only all_objects sees until purged."""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at=None)
 
 
 class Account(models.Model):
@@ -12,6 +29,43 @@ class Account(models.Model):
     name = models.CharField(max_length=100)
     agency = models.CharField(max_length=50, null=True, blank=True)
     number = models.CharField(max_length=50, null=True, blank=True)
+    balance = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    # Also set by the bulk and balance updates, which skip auto_now
+    updated_at = models.DateTimeField(auto_now=True)
+    # Set when deleted; the account is hidden from then on and its
+    # transactions are purged in the background (see core.lib.purge)
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    objects = AccountManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        indexes = [
+            # The deleted accounts every Transaction query leaves out
+            # (TransactionManager), read off this index alone
+            models.Index(fields=['deleted_at'], name='account_deleted_idx', condition=Q(deleted_at__isnull=False)),
+        ]
+
+
+class Tag(models.Model):
+    """Normalized tags, linked to the transactions whose tags text has them."""
+    username = models.ForeignKey(User, on_delete=models.CASCADE)
+    name = models.CharField(max_length=100)
+
+    class Meta:
+        unique_together = [['username', 'name']]
+
+
+class TransactionManager(models.Manager):
+    """Leaves out the transactions of deleted accounts, waiting to be purged."""
+
+    def get_queryset(self):
+        # A handful of ids at most, read once per query by SQLite off
+        # account_deleted_idx; isnull=False is what matches its condition,
+        # SQLite does not take exclude()'s NOT (... IS NULL) for it
+        return super().get_queryset().exclude(
+            account_id__in=Account.all_objects.filter(deleted_at__isnull=False).values('id')
+        )
 
 
 class Transaction(models.Model):
@@ -24,4 +78,113 @@ class Transaction(models.Model):
     check_code = models.CharField(max_length=50)
     checked = models.SmallIntegerField()
     tags = models.TextField(null=True, blank=True)
+    # Kept in sync with the tags text by core.lib.tags
+    tag_index = models.ManyToManyField(Tag, related_name='transactions', blank=True)
+    # Account balance right after this transaction, in (date, id) order
+    balance = models.DecimalField(max_digits=14, decimal_places=2, null=True, blank=True)
+    # Also set by the bulk and balance updates, which skip auto_now
+    updated_at = models.DateTimeField(auto_now=True)
+    # Carries the total of the archived transactions of the account; never
+    # listed nor counted in the rollups
+    opening = models.BooleanField(default=False)
+
+    objects = TransactionManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        indexes = [
+            # Keyset pagination: (date, id) is the journal cursor
+            models.Index(fields=['username', 'date', 'id'], name='trs_user_date_id_idx'),
+            models.Index(fields=['account', 'date', 'id'], name='trs_account_date_id_idx'),
+        ]
+
+
+class ArchivedTransaction(models.Model):
+    """A transaction of an archived year: the columns of Transaction, same id."""
+    id = models.IntegerField(primary_key=True)
+    username = models.ForeignKey(User, on_delete=models.CASCADE)
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, null=True, blank=True)
+    date = models.DateField()
+    description = models.TextField()
+    notes = models.TextField(null=True, blank=True)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    check_code = models.CharField(max_length=50)
+    checked = models.SmallIntegerField()
+    tags = models.TextField(null=True, blank=True)
+    balance = models.DecimalField(max_digits=14, decimal_places=2, null=True, blank=True)
+    updated_at = models.DateTimeField()
+
+    objects = TransactionManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['username', 'date', 'id'], name='arch_user_date_id_idx'),
+            models.Index(fields=['account', 'date', 'id'], name='arch_account_date_id_idx'),
+        ]
+
+
+class MonthlyRollup(models.Model):
+    """Per user/account/month totals, kept in sync with Transaction writes."""
+    username = models.ForeignKey(User, on_delete=models.CASCADE)
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, null=True, blank=True)
+    # First day of the month
+    month = models.DateField()
+    income = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    expense = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    net = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.IntegerField(default=0)
+    checked_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    unchecked_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            # Also the index of the summaries (user, month range)
+            models.UniqueConstraint(fields=['username', 'month', 'account'], name='rollup_user_month_account_uniq'),
+            # NULLs are distinct in the one above
+            models.UniqueConstraint(
+                fields=['username', 'month'],
+                condition=models.Q(account=None),
+                name='rollup_user_month_no_account_uniq'
+            ),
+        ]
+
+
+class Job(models.Model):
+    """A task run in the background by the run_worker command (see core.lib.jobs)."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    # Kept (without an owner) when the user is purged
+    username = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    name = models.CharField(max_length=50)
+    args = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=1)
+    # Not claimed before this, pushed back by the retries
+    run_after = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Last sign of life of the running job: its progress, or its worker's tick
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # host:pid of the worker that claimed it
+    worker = models.CharField(max_length=100, blank=True)
+    progress = models.JSONField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_status_run_after_idx'),
+            models.Index(fields=['username', 'created_at'], name='job_user_created_idx'),
+        ]
@@ -0,0 +1,19 @@
+from django.db.models.signals import (
+    post_delete,
+    post_save
+)
+from django.dispatch import receiver
+
+from .lib import usercache
+from .models import (
+    Account,
+    Transaction
+)
+
+
+@receiver(post_save, sender=Account, dispatch_uid='account_saved_cache')
+@receiver(post_delete, sender=Account, dispatch_uid='account_deleted_cache')
+@receiver(post_save, sender=Transaction, dispatch_uid='transaction_saved_cache')
+@receiver(post_delete, sender=Transaction, dispatch_uid='transaction_deleted_cache')
+def invalidate_user_cache(sender, instance, **kwargs):
+    usercache.bump(instance.username_id)
@@ -0,0 +1,60 @@
+"""
+The tasks run by the background jobs (see core.lib.jobs). Each one takes the
+job's progress callback and its JSON args, and returns a JSON result.
+"""
+import contextlib
+import datetime
+import os
+
+from .lib import (
+    archive,
+    jobs,
+    purge,
+    rollups,
+    statements
+)
+from .lib.jobs import task
+
+
+# Retrying would fail the same way on a bad file, and an import is not undone
+@task('import-statement', max_attempts=1)
+def import_statement(progress, user_id, upload, account_id=None, statement_format='csv', encoding='utf-8-sig'):
+    """Imports the statement saved by jobs.save_upload() as upload, streamed as inline imports are."""
+    path = jobs.upload_path(upload)
+    try:
+        with open(path, 'rb') as binary:
+            imported, errors = statements.import_statement(
+                statements.text_stream(binary, encoding),
+                user_id,
+                account_id=account_id,
+                statement_format=statement_format
+            )
+    except statements.StatementError as e:
+        return {'error_message': str(e)}
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+    return {
+        'imported': imported,
+        'errors': [{'line': line, 'error_message': message} for line, message in errors]
+    }
+
+
+@task('rebuild-rollups')
+def rebuild_rollups(progress, user_id=None):
+    return {'rows': rollups.rebuild(user_id=user_id)}
+
+
+@task('archive-transactions')
+def archive_transactions(progress, user_id, before):
+    return {'archived': archive.archive(user_id, datetime.date.fromisoformat(before))}
+
+
+@task('purge-account')
+def purge_account(progress, account_id):
+    return {'deleted': purge.purge_account(account_id, progress=lambda n: progress({'deleted': n}))}
+
+
+@task('purge-user')
+def purge_user(progress, user_id):
+    return {'deleted': purge.purge_user(user_id, progress=lambda n: progress({'deleted': n}))}
@@ -1,20 +1,108 @@
+import asyncio
+import io
 import json
+import os
+import shutil
+import tempfile
+import threading
 
-from datetime import datetime
+from datetime import (
+    datetime,
+    timezone
+)
 from decimal import Decimal
+from unittest import mock
 
-from django.test import TestCase
-from django.urls import reverse
+from django.core.files.uploadedfile import SimpleUploadedFile
+from asgiref.sync import (
+    async_to_sync,
+    sync_to_async
+)
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import (
+    IntegrityError,
+    connection,
+    transaction as db_transaction
+)
+from django.template import engines
+from django.template.backends import jinja2 as jinja2_backend
+from django.test import (
+    RequestFactory,
+    TestCase,
+    override_settings
+)
+from django.test.signals import template_rendered
+from django.test.utils import CaptureQueriesContext
+from django.urls import (
+    resolve,
+    reverse
+)
 from core.models import (
     User,
     Account,
+    ArchivedTransaction,
+    Job,
+    MonthlyRollup,
     Transaction
 )
-from core.lib import utils
+from core import (
+    checks,
+    views
+)
+from core.asgi import (
+    ASGIHandler,
+    route
+)
+from core.lib import (
+    archive,
+    assets,
+    balances,
+    events,
+    exports,
+    jobs,
+    profiling,
+    purge,
+    rollups,
+    search,
+    serializers,
+    sqlite,
+    startup,
+    statements,
+    tags,
+    usercache,
+    utils
+)
+
+def instrumented_jinja2_render(render):
+    """
+    Jinja2 renders sending template_rendered, as Django's test runner makes
+    Django templates do, so the test client fills response.context in.
+    """
+    def instrumented(self, context=None, request=None):
+        template_rendered.send(sender=self, template=self, context=context or {})
+        return render(self, context, request)
+    return instrumented
+
 
+@override_settings(ASYNC_VIEWS_THREAD_SENSITIVE=True, QUERY_BUDGET='raise')
 class BaseRequestTestCase(TestCase):
 
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        patcher = mock.patch.object(
+            jinja2_backend.Template, 'render', instrumented_jinja2_render(jinja2_backend.Template.render)
+        )
+        patcher.start()
+        cls.addClassCleanup(patcher.stop)
+
     def setUp(self):
+        # Cached reads from other tests may share user ids
+        cache.clear()
         # Default username
         self.test_username = 'usertest@test.app'
         self.test_password = 'test_password'
@@ -42,6 +130,14 @@ class BaseRequestTestCase(TestCase):
             agency=agency,
             number=number
         )
+
+    def request_within_budget(self, url_name, *args, method='get', **kwargs):
+        """Requests a view, failing when it has no query budget or goes over it."""
+        url = reverse(url_name, args=args)
+        view = resolve(url).func
+        self.assertTrue(hasattr(view, 'query_budget'), f'{url_name} has no query budget')
+        with self.settings(QUERY_BUDGET='raise'):
+            return getattr(self.client, method)(url, **kwargs)
     
         
 class ValidateTest(TestCase):
@@ -62,6 +158,42 @@ class ValidateTest(TestCase):
             self.assertEqual(utils.email_validate(email[0]), email[1])
 
 
+class SQLiteProfileTest(TestCase):
+
+    def test_pragmas_applied(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+
+    def test_pragma_validation(self):
+        with self.assertRaises(ValueError):
+            sqlite.pragma_statements({'journal_mode': 'wal; DROP TABLE core_user'})
+
+
+class StartupTest(TestCase):
+
+    def test_parse_importtime(self):
+        modules = startup.parse_importtime(
+            'import time: self [us] | cumulative | imported package\n'
+            'import time:       200 |        200 |     numpy.core\n'
+            'import time:      1000 |       1200 |   numpy\n'
+            'import time:       500 |       1700 | core.lib.reports\n'
+        )
+        self.assertEqual([(m.name, m.depth) for m in modules], [('numpy.core', 2), ('numpy', 1), ('core.lib.reports', 0)])
+        self.assertEqual(startup.packages(modules), [('numpy', 1.2), ('core', 0.5)])
+
+    def test_boot_leaves_heavy_modules_out(self):
+        out = io.StringIO()
+        call_command('startup_profile', limit=5, stdout=out)
+        self.assertIn('core ready()', out.getvalue())
+        # Loaded on first use: reports, template timing (PROFILING) and the process pool
+        names = {m.name for m in startup.profile()['modules']}
+        for name in ('numpy', 'jinja2', 'cryptography', 'multiprocessing'):
+            self.assertNotIn(name, names)
+
+
 class LoginRequestTest(BaseRequestTestCase):
    
     def test_login_action_success(self):
@@ -189,6 +321,186 @@ class AccountRequestTest(BaseRequestTestCase):
             Account.objects.get(pk=1)
 
 
+class PurgeTest(BaseRequestTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.authenticated_session()
+        self.account = self.create_account(user=self.test_user, name='Purged Account', agency='0001', number='1')
+        self.kept = self.create_account(user=self.test_user, name='Kept Account', agency='0001', number='2')
+        for i, account in enumerate([self.account] * 5 + [self.kept, None]):
+            self.client.post(reverse('core:save-transaction-add'), {
+                'date': f'2020-01-0{i % 7 + 1}', 'description': f'Purge market {i}', 'amount': '-10.00',
+                'checked': '0', 'account_id': account.id if account else '', 'tags': 'food',
+            })
+
+    def get_data(self, url_name, *args, **params):
+        response = self.client.get(reverse(url_name, args=args), params)
+        return json.loads(response.content.decode('utf-8'))
+
+    def test_deleted_account_hidden_then_purged(self):
+        self.request_within_budget('core:del-account', self.account.id)
+        self.assertFalse(Account.objects.filter(pk=self.account.id).exists())
+        self.assertEqual(len(self.get_data('core:transactions')['data']), 2)
+        self.assertEqual(len(self.get_data('core:search-transactions', q='market')['data']), 2)
+        self.assertEqual(self.get_data('core:tag-summary')['data'][0]['count'], 2)
+        self.assertEqual(self.get_data('core:transaction-summary')['totals']['count'], 2)
+        response = self.request_within_budget('core:del-account-status', self.account.id)
+        status = json.loads(response.content.decode('utf-8'))['data'][0]
+        self.assertEqual((status['deleted'], status['remaining']), (True, 5))
+
+        progress = []
+        deleted = purge.run(batch_size=2, progress=lambda *args: progress.append(args))
+        self.assertEqual(deleted, 5)
+        self.assertEqual([n for _, _, n in progress], [2, 4, 5])
+        self.assertFalse(Account.all_objects.filter(pk=self.account.id).exists())
+        self.assertEqual(Transaction.all_objects.count(), 2)
+        self.assertEqual(Transaction.tag_index.through.objects.count(), 2)
+        self.assertEqual(
+            self.get_data('core:del-account-status', self.account.id)['error_message'], 'Account not found'
+        )
+        self.kept.refresh_from_db()
+        self.assertEqual(self.kept.balance, Decimal('-10.00'))
+
+    def test_deleted_user_purged(self):
+        purge.delete_user(self.test_user)
+        response = self.client.post(reverse('core:login'), {'username': self.test_username, 'password': self.test_password})
+        self.assertRedirects(response, reverse('core:index'))
+        self.assertEqual(Account.objects.filter(username=self.test_user).count(), 0)
+        out = io.StringIO()
+        call_command('purge_deleted', verbosity=2, batch_size=3, stdout=out)
+        self.assertIn('7 transactions purged', out.getvalue())
+        self.assertFalse(User.objects.filter(pk=self.test_user.id).exists())
+        self.assertEqual(Transaction.all_objects.count(), 0)
+
+
+class JobTest(BaseRequestTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.authenticated_session()
+
+    def get_data(self, url_name, *args, **params):
+        response = self.request_within_budget(url_name, *args, data=params)
+        return json.loads(response.content.decode('utf-8'))
+
+    def test_background_import(self):
+        upload_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, upload_dir)
+        account = self.create_account(user=self.test_user, name='Import Account', agency='0001', number='1')
+        with override_settings(JOBS_UPLOAD_DIR=upload_dir):
+            response = self.client.post(reverse('core:import-statement'), {
+                'account_id': account.id,
+                'background': '1',
+                'statement': SimpleUploadedFile('statement.csv', b'Date,Description,Amount\n2020-01-02,Salary,1000.00\n'),
+            })
+            job_id = json.loads(response.content.decode('utf-8'))['data'][0]['job_id']
+            self.assertEqual(Transaction.objects.count(), 0)
+            # The statement waits in a file, the job only names it
+            self.assertNotIn('content', Job.objects.get(pk=job_id).args)
+            self.assertEqual(len(os.listdir(upload_dir)), 1)
+            self.assertEqual([j['id'] for j in self.get_data('core:jobs', active='1')['data']], [job_id])
+            self.assertEqual(jobs.run_pending(), 1)
+        self.assertEqual(os.listdir(upload_dir), [])
+        job = self.get_data('core:job', job_id)['data'][0]
+        self.assertEqual((job['status'], job['attempts']), (Job.DONE, 1))
+        self.assertEqual(job['result'], {'imported': 1, 'errors': []})
+        self.assertEqual(self.get_data('core:jobs', active='1')['data'], [])
+        account.refresh_from_db()
+        self.assertEqual(account.balance, Decimal('1000.00'))
+
+    def test_job_of_other_user(self):
+        other = self.create_user(username='other@test.app', password='other')
+        job = jobs.enqueue('rebuild-rollups', owner_id=other.id, user_id=other.id)
+        self.assertEqual(self.get_data('core:job', job.id)['error_message'], 'Job not found')
+        self.assertEqual(self.get_data('core:jobs')['data'], [])
+
+    def test_retry_with_backoff(self):
+        calls = []
+
+        def flaky(progress, fail_times):
+            calls.append(len(calls))
+            progress({'call': len(calls)})
+            if len(calls) <= fail_times:
+                raise RuntimeError('Not yet')
+            return {'calls': len(calls)}
+
+        with mock.patch.dict(jobs.TASKS, {'flaky': (flaky, 2)}), self.settings(JOBS_RETRY_DELAY=60):
+            job = jobs.enqueue('flaky', fail_times=1)
+            self.assertEqual(jobs.run_pending(), 1)
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts, job.progress), (Job.QUEUED, 1, {'call': 1}))
+            self.assertIn('Not yet', job.error)
+            self.assertAlmostEqual((job.run_after - job.started_at).total_seconds(), 60, delta=5)
+            # Not due before the delay
+            self.assertEqual(jobs.run_pending(), 0)
+            Job.objects.filter(pk=job.id).update(run_after=job.started_at)
+            self.assertEqual(jobs.run_pending(), 1)
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.result, job.error), (Job.DONE, {'calls': 2}, ''))
+
+            failing = jobs.enqueue('flaky', fail_times=10)
+            Job.objects.filter(pk=failing.id).update(max_attempts=1)
+            jobs.run_pending()
+            failing.refresh_from_db()
+            self.assertEqual(failing.status, Job.FAILED)
+            self.assertIsNotNone(failing.finished_at)
+
+    def test_claim_once_and_requeue_stale(self):
+        job = jobs.enqueue('rebuild-rollups', owner_id=self.test_user.id, user_id=self.test_user.id)
+        self.assertEqual(jobs.claim('worker-1'), job.id)
+        self.assertIsNone(jobs.claim('worker-2'))
+        self.assertEqual(jobs.requeue_stale(), 0)
+        with self.settings(JOBS_STALE_AFTER=0):
+            self.assertEqual(jobs.requeue_stale(), 1)
+        self.assertEqual(jobs.claim('worker-2'), job.id)
+        job.refresh_from_db()
+        self.assertEqual((job.worker, job.attempts), ('worker-2', 2))
+        with self.assertRaises(ValueError):
+            jobs.enqueue('no-such-task')
+
+    def test_long_job_kept_alive(self):
+        job = jobs.enqueue('rebuild-rollups', owner_id=self.test_user.id, user_id=self.test_user.id)
+        jobs.claim('worker-1')
+        # Started long ago, but its worker (or its progress) says it is alive
+        long_ago = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        Job.objects.filter(pk=job.id).update(started_at=long_ago, heartbeat_at=long_ago)
+        self.assertEqual(jobs.heartbeat([job.id]), 1)
+        with self.settings(JOBS_STALE_AFTER=60):
+            self.assertEqual(jobs.requeue_stale(), 0)
+        Job.objects.filter(pk=job.id).update(heartbeat_at=long_ago)
+        with self.settings(JOBS_STALE_AFTER=60):
+            self.assertEqual(jobs.requeue_stale(), 1)
+
+    def test_stale_attempt_result_not_recorded(self):
+        def slow(progress):
+            # Meanwhile taken for dead, and out of attempts
+            with self.settings(JOBS_STALE_AFTER=0):
+                jobs.requeue_stale()
+            progress({'step': 1})
+            return {'done': True}
+
+        with mock.patch.dict(jobs.TASKS, {'slow': (slow, 1)}):
+            job = jobs.enqueue('slow')
+            jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result, job.progress), (Job.FAILED, None, None))
+
+    def test_deleted_account_purged_by_job(self):
+        account = self.create_account(user=self.test_user, name='Purged Account', agency='0001', number='1')
+        self.client.post(reverse('core:save-transaction-add'), {
+            'date': '2020-01-01', 'description': 'Market', 'amount': '-10.00', 'checked': '0',
+            'account_id': account.id,
+        })
+        self.request_within_budget('core:del-account', account.id)
+        job = Job.objects.get(name='purge-account')
+        self.assertEqual(job.args, {'account_id': account.id})
+        jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result, job.progress), (Job.DONE, {'deleted': 1}, {'deleted': 1}))
+        self.assertFalse(Account.all_objects.filter(pk=account.id).exists())
+
+
 class TransactionRequestTest(BaseRequestTestCase):
 
     def test_get_transaction_success(self):
@@ -200,10 +512,13 @@ class TransactionRequestTest(BaseRequestTestCase):
             amount=120.15,
             checked=0,
         )
+        data = utils.model_as_dict([test_transaction])
+        # Opening rows are never served, so the flag is not either
+        del data[0]['opening']
         test_json_response = json.dumps(
             {
                 'error_message': '',
-                'data': utils.model_as_dict([test_transaction]),
+                'data': data,
             },
             ensure_ascii=False
         )
@@ -253,3 +568,1358 @@ class TransactionRequestTest(BaseRequestTestCase):
         self.assertEqual(saved_model.amount, Decimal(data_test['amount']))
         self.assertEqual(saved_model.date, datetime.strptime(data_test['date'], '%Y-%m-%d').date())
         self.assertEqual(saved_model.checked, int(data_test['checked']))
+
+
+class SerializerTest(BaseRequestTestCase):
+
+    def test_serializer_types(self):
+        account = self.create_account(user=self.test_user, name='Serializer Account', agency='0001', number='1')
+        trs = Transaction.objects.create(
+            username=self.test_user,
+            account=account,
+            date=datetime(2020, 5, 17).date(),
+            description='Serializer Test',
+            amount=Decimal('120.15'),
+            checked=1,
+        )
+        serializer = serializers.serializer_for(Transaction)
+        row = serializer.from_model(trs)
+        self.assertEqual(row['amount'], 120.15)
+        self.assertEqual(row['date'], '2020-05-17')
+        self.assertEqual(row['account'], account.id)
+        self.assertEqual(row['username'], self.test_user.id)
+        self.assertIsNone(row['notes'])
+        self.assertEqual(serializer.serialize(Transaction.objects.filter(pk=trs.pk)), [row])
+
+
+class TransactionListRequestTest(BaseRequestTestCase):
+
+    def create_transaction(self, user, date, amount, account=None, checked=0):
+        return Transaction.objects.create(
+            username=user,
+            account=account,
+            date=date,
+            description='Transaction List Test',
+            amount=amount,
+            checked=checked,
+        )
+
+    def get_list(self, **params):
+        response = self.client.get(reverse('core:transactions'), params)
+        return json.loads(response.content.decode('utf-8'))
+
+    def test_list_keyset_pages(self):
+        self.authenticated_session()
+        for day in (1, 2, 2, 3, 5):
+            self.create_transaction(self.test_user, datetime(2020, 1, day).date(), 10)
+        seen = []
+        cursor = None
+        while True:
+            params = {'limit': 2}
+            if cursor:
+                params['cursor'] = cursor
+            response_obj = self.get_list(**params)
+            seen.extend((r['date'], int(r['id'])) for r in response_obj['data'])
+            cursor = response_obj['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(seen, sorted(seen, reverse=True))
+
+    def test_list_page_is_an_index_range(self):
+        cursor_date, cursor_id = datetime(2020, 1, 2).date(), 10
+        for qs, index in (
+            (Transaction.objects.filter(username=self.test_user), 'trs_user_date_id_idx (username_id=? AND date<?)'),
+            (Transaction.objects.filter(account_id=1), 'trs_account_date_id_idx (account_id=? AND date<?)'),
+        ):
+            plan = qs.filter(views.before_cursor(cursor_date, cursor_id)).order_by('-date', '-id').explain()
+            self.assertIn(index, plan)
+
+    def test_deleted_accounts_read_off_an_index(self):
+        for model in (Transaction, ArchivedTransaction):
+            plan = model.objects.filter(username=self.test_user).explain()
+            self.assertIn('USING COVERING INDEX account_deleted_idx', plan)
+            self.assertNotIn('SCAN', plan)
+
+    def test_list_filters(self):
+        self.authenticated_session()
+        account = self.create_account(user=self.test_user, name='Filter Account', agency='0001', number='1')
+        self.create_transaction(self.test_user, datetime(2020, 1, 1).date(), 10, account=account, checked=1)
+        self.create_transaction(self.test_user, datetime(2020, 2, 1).date(), 20, account=account)
+        self.create_transaction(self.test_user, datetime(2020, 2, 1).date(), 30)
+        response_obj = self.get_list(account_id=account.id, date_from='2020-01-15', date_to='2020-12-31')
+        self.assertEqual([r['amount'] for r in response_obj['data']], [20.0])
+        response_obj = self.get_list(checked=1)
+        self.assertEqual([r['amount'] for r in response_obj['data']], [10.0])
+
+    def test_list_only_logged(self):
+        self.authenticated_session()
+        another_user = self.create_user(username='other_user_test@test.com', password='secret-321')
+        self.create_transaction(another_user, datetime(2020, 1, 1).date(), 10)
+        response_obj = self.get_list()
+        self.assertEqual(response_obj['data'], [])
+
+    def test_list_invalid_cursor(self):
+        self.authenticated_session()
+        response_obj = self.get_list(cursor='not-a-cursor')
+        self.assertNotEqual(response_obj['error_message'], '')
+
+    def test_list_invalid_limit(self):
+        self.authenticated_session()
+        self.create_transaction(self.test_user, datetime(2020, 1, 1).date(), 10)
+        for url_name in ('core:transactions', 'core:search-transactions'):
+            for limit in ('0', '-1', '-5'):
+                response = self.client.get(reverse(url_name), {'limit': limit, 'q': 'list'})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(json.loads(response.content.decode('utf-8'))['error_message'], 'Invalid filter parameters')
+
+
+class BalanceRequestTest(BaseRequestTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.authenticated_session()
+        self.account = self.create_account(user=self.test_user, name='Balance Account', agency='0001', number='1')
+        self.other_account = self.create_account(user=self.test_user, name='Other Account', agency='0001', number='2')
+
+    def test_shift_is_an_index_range(self):
+        date = datetime(2020, 1, 2).date()
+        for bound, index in ((balances._after, 'date>?'), (balances._before, 'date<?')):
+            plan = Transaction.objects.filter(bound(date, 10), account_id=self.account.id).explain()
+            self.assertIn(f'trs_account_date_id_idx (account_id=? AND {index})', plan)
+
+    def save(self, date, amount, account, pk=None):
+        url = reverse('core:save-transaction-edit', args=(pk,)) if pk else reverse('core:save-transaction-add')
+        response = self.client.post(url, {
+            'date': date,
+            'description': 'Balance test',
+            'amount': amount,
+            'checked': '0',
+            'account_id': account.id if account else '',
+        })
+        return json.loads(response.content.decode('utf-8'))['data'][0]
+
+    def assertBalances(self, account):
+        account.refresh_from_db()
+        running = Decimal('0')
+        for trs in Transaction.objects.filter(account=account).order_by('date', 'id'):
+            running += trs.amount
+            self.assertEqual(trs.balance, running)
+        self.assertEqual(account.balance, running)
+
+    def test_balance_append_and_insert(self):
+        self.save('2020-01-10', '100.00', self.account)
+        self.save('2020-01-20', '-30.00', self.account)
+        # Inserted before the others, must shift their balances
+        self.save('2020-01-01', '5.50', self.account)
+        self.assertBalances(self.account)
+        self.assertEqual(self.account.balance, Decimal('75.50'))
+
+    def test_balance_edit_moves_date_and_account(self):
+        first = self.save('2020-01-10', '100.00', self.account)
+        self.save('2020-01-20', '-30.00', self.account)
+        self.save('2020-01-15', '10.00', self.other_account)
+        self.save('2020-01-25', '-40.00', self.account, pk=first['id'])
+        self.assertBalances(self.account)
+        self.save('2020-01-01', '-40.00', self.other_account, pk=first['id'])
+        self.assertBalances(self.account)
+        self.assertBalances(self.other_account)
+        self.assertEqual(self.account.balance, Decimal('-30.00'))
+        self.assertEqual(self.other_account.balance, Decimal('-30.00'))
+        self.save('2020-01-01', '-40.00', None, pk=first['id'])
+        self.assertBalances(self.other_account)
+        self.assertEqual(self.other_account.balance, Decimal('10.00'))
+
+    def test_amount_stored_as_cents(self):
+        for _ in range(3):
+            row = self.save('2020-01-10', '1.005', self.account)
+            self.assertEqual(row['amount'], 1.0)
+        self.assertBalances(self.account)
+        self.assertEqual(self.account.balance, Decimal('3.00'))
+        self.assertEqual(rollups.summary(self.test_user.id)[1]['net'], Decimal('3.00'))
+
+    def test_invalid_amount(self):
+        self.save('2020-01-10', '10.00', self.account)
+        for amount in ('abc', 'NaN', '1e20', ''):
+            with self.subTest(amount=amount):
+                response = self.client.post(reverse('core:save-transaction-add'), {
+                    'date': '2020-01-01',
+                    'description': 'Balance test',
+                    'amount': amount,
+                    'checked': '0',
+                    'account_id': self.account.id,
+                })
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response.json()['error_message'], '')
+        self.assertEqual(Transaction.objects.filter(account=self.account).count(), 1)
+        self.assertBalances(self.account)
+        self.assertEqual(self.account.balance, Decimal('10.00'))
+
+    def test_balance_foreign_account(self):
+        another_user = self.create_user(username='other_user_test@test.com', password='secret-321')
+        another_account = self.create_account(user=another_user, name='Not Mine', agency='0002', number='2')
+        response = self.client.post(reverse('core:save-transaction-add'), {
+            'date': '2020-01-01',
+            'description': 'Balance test',
+            'amount': '10.00',
+            'checked': '0',
+            'account_id': another_account.id,
+        })
+        self.assertEqual(response.status_code, 404)
+        another_account.refresh_from_db()
+        self.assertEqual(another_account.balance, Decimal('0'))
+
+
+class SummaryRequestTest(BaseRequestTestCase):
+
+    def save(self, date, amount, checked='0', pk=None):
+        url = reverse('core:save-transaction-edit', args=(pk,)) if pk else reverse('core:save-transaction-add')
+        response = self.client.post(url, {
+            'date': date,
+            'description': 'Summary test',
+            'amount': amount,
+            'checked': checked,
+        })
+        return json.loads(response.content.decode('utf-8'))['data'][0]
+
+    def get_summary(self, **params):
+        response = self.client.get(reverse('core:transaction-summary'), params)
+        return json.loads(response.content.decode('utf-8'))
+
+    def test_summary_follows_writes(self):
+        self.authenticated_session()
+        self.save('2020-01-05', '100.00', checked='1')
+        moved = self.save('2020-01-10', '-30.00')
+        self.save('2020-02-01', '-10.00')
+        self.save('2020-03-01', '-45.00', pk=moved['id'])
+        response_obj = self.get_summary(date_from='2020-01-01', date_to='2020-02-28')
+        self.assertEqual([r['month'] for r in response_obj['data']], ['2020-01-01', '2020-02-01'])
+        self.assertEqual(response_obj['totals']['income'], 100.0)
+        self.assertEqual(response_obj['totals']['expense'], 10.0)
+        self.assertEqual(response_obj['totals']['net'], 90.0)
+        self.assertEqual(response_obj['totals']['count'], 2)
+        self.assertEqual(response_obj['totals']['checked_total'], 100.0)
+        self.assertEqual(response_obj['data'][0]['count'], 1)
+        self.assertEqual(response_obj['data'][1]['expense'], 10.0)
+
+    def test_summary_matches_rebuild(self):
+        self.authenticated_session()
+        self.save('2020-01-05', '100.00', checked='1')
+        self.save('2020-01-10', '-30.00')
+        self.save('2021-06-01', '-10.00')
+        incremental = self.get_summary()
+        rollups.rebuild()
+        self.assertEqual(self.get_summary(), incremental)
+
+    def test_one_rollup_per_month(self):
+        account = self.create_account(user=self.test_user, name='Rollup Account', agency='0001', number='1')
+        for account_id in (account.id, None):
+            MonthlyRollup.objects.create(username=self.test_user, account_id=account_id, month=datetime(2020, 1, 1).date())
+            with self.assertRaises(IntegrityError), db_transaction.atomic():
+                MonthlyRollup.objects.create(username=self.test_user, account_id=account_id, month=datetime(2020, 1, 1).date())
+
+    def test_month_inserted_by_another_writer(self):
+        self.authenticated_session()
+        self.save('2020-01-05', '100.00')
+        trs = Transaction(username=self.test_user, date=datetime(2020, 1, 6).date(), amount=Decimal('-30.00'), checked=0)
+        # The other writer inserted the month after this one looked for it
+        with mock.patch('core.lib.rollups._existing', return_value=set()):
+            rollups.add(trs)
+        self.assertEqual(MonthlyRollup.objects.filter(username=self.test_user).count(), 1)
+        self.assertEqual(self.get_summary()['totals']['net'], 70.0)
+
+    def test_emptied_month_not_listed(self):
+        self.authenticated_session()
+        self.save('2020-01-05', '100.00')
+        moved = self.save('2020-02-10', '-30.00')
+        self.save('2020-03-01', '-30.00', pk=moved['id'])
+        self.assertEqual([r['month'] for r in self.get_summary()['data']], ['2020-01-01', '2020-03-01'])
+
+
+
+class StatementImportTest(BaseRequestTestCase):
+
+    def test_import_csv_with_errors(self):
+        self.authenticated_session()
+        account = self.create_account(user=self.test_user, name='Import Account', agency='0001', number='1')
+        content = (
+            'Date,Description,Amount\n'
+            '2020-01-02,Salary,1000.00\n'
+            '2020-01-03,Market,not-a-number\n'
+            '05/01/2020,Rent,"-500,50"\n'
+            '2020-01-04,,10\n'
+        )
+        response = self.client.post(reverse('core:import-statement'), {
+            'account_id': account.id,
+            'statement': SimpleUploadedFile('statement.csv', content.encode('utf-8')),
+        })
+        data = json.loads(response.content.decode('utf-8'))['data'][0]
+        self.assertEqual(data['imported'], 2)
+        self.assertEqual([e['line'] for e in data['errors']], [3, 5])
+        account.refresh_from_db()
+        self.assertEqual(account.balance, Decimal('499.50'))
+        last = Transaction.objects.filter(account=account).order_by('-date', '-id').first()
+        self.assertEqual(last.balance, Decimal('499.50'))
+        months, totals = rollups.summary(self.test_user.id)
+        self.assertEqual(totals['count'], 2)
+        self.assertEqual(totals['expense'], Decimal('500.50'))
+
+    def test_parse_amount_out_of_range(self):
+        self.assertEqual(statements.parse_amount('9999999999.99'), Decimal('9999999999.99'))
+        for value in ('NaN', 'sNaN', 'Infinity', '-inf', '1e20', '10000000000', '-10000000000.00'):
+            with self.assertRaises(ValueError):
+                statements.parse_amount(value)
+
+    def test_import_reports_unstorable_amounts_per_line(self):
+        content = (
+            'Date,Description,Amount\n'
+            '2020-01-02,Salary,1000.00\n'
+            '2020-01-03,Not a number,NaN\n'
+            '2020-01-04,Too large,1e20\n'
+        )
+        imported, errors = statements.import_statement(io.StringIO(content), self.test_user.id)
+        self.assertEqual(imported, 1)
+        self.assertEqual([line for line, _ in errors], [3, 4])
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_import_csv_missing_columns(self):
+        self.authenticated_session()
+        response = self.client.post(reverse('core:import-statement'), {
+            'statement': SimpleUploadedFile('statement.csv', b'Date,Value\n2020-01-01,10\n'),
+        })
+        self.assertNotEqual(json.loads(response.content.decode('utf-8'))['error_message'], '')
+        self.assertEqual(Transaction.objects.count(), 0)
+
+    def test_import_ofx_batches(self):
+        entries = ''.join(
+            f'<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>202001{day:02d}120000[-3:BRT]'
+            f'<TRNAMT>-{day}.00<FITID>{day}<MEMO>Purchase {day}</STMTTRN>'
+            for day in range(1, 29)
+        )
+        content = f'OFXHEADER:100\n<OFX><BANKTRANLIST>{entries}<STMTTRN><DTPOSTED>bad<TRNAMT>1</STMTTRN></BANKTRANLIST></OFX>'
+        imported, errors = statements.import_statement(
+            io.StringIO(content),
+            self.test_user.id,
+            statement_format='ofx',
+            batch_size=5
+        )
+        self.assertEqual(imported, 28)
+        self.assertEqual(errors, [(29, 'Invalid date: "bad"')])
+        trs = Transaction.objects.get(check_code='7')
+        self.assertEqual(trs.amount, Decimal('-7.00'))
+        self.assertEqual(trs.description, 'Purchase 7')
+
+
+class ArchiveTest(BaseRequestTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.authenticated_session()
+        self.account = self.create_account(user=self.test_user, name='Archive Account', agency='0001', number='1')
+        self.ids = []
+        for date, amount, account, tags_text in [
+            ('2019-03-01', '100.00', self.account, ''),
+            ('2019-05-01', '-10.00', self.account, 'food'),
+            ('2019-06-01', '-3.00', None, 'food, home'),
+            ('2020-02-01', '-5.00', self.account, 'food'),
+            ('2021-04-01', '7.00', self.account, 'home'),
+        ]:
+            response = self.client.post(reverse('core:save-transaction-add'), {
+                'date': date, 'description': f'Archive {date}', 'amount': amount, 'checked': '0',
+                'account_id': account.id if account else '', 'tags': tags_text,
+            })
+            self.ids.append(json.loads(response.content.decode('utf-8'))['data'][0]['id'])
+
+    def get_data(self, url_name, *args, **params):
+        response = self.request_within_budget(url_name, *args, data=params)
+        return json.loads(response.content.decode('utf-8'))
+
+    def journal(self, **params):
+        rows = []
+        cursor = None
+        while True:
+            data = self.get_data('core:transactions', limit=2, **params, **({'cursor': cursor} if cursor else {}))
+            rows.extend(data['data'])
+            cursor = data['next_cursor']
+            if not cursor:
+                return rows
+
+    def snapshot(self):
+        self.account.refresh_from_db()
+        return {
+            'journal': self.journal(),
+            'food': [r['id'] for r in self.journal(tag='food')],
+            'summary': self.get_data('core:transaction-summary')['totals'],
+            'tags': self.get_data('core:tag-summary')['data'],
+            'reports': self.get_data('core:report-totals', period='year', by='tag')['data'],
+            'top': [r['id'] for r in self.get_data('core:report-top-expenses')['data']],
+            'export': self.client.get(reverse('core:export-transactions'), {'format': 'csv'}).getvalue(),
+            'balance': self.account.balance,
+        }
+
+    def test_archived_years_read_the_same(self):
+        before = self.snapshot()
+        self.assertEqual(archive.archive(self.test_user.id, datetime(2021, 1, 1).date()), 4)
+        self.assertEqual(ArchivedTransaction.objects.count(), 4)
+        opening = Transaction.objects.get(opening=True)
+        self.assertEqual((opening.date.isoformat(), opening.amount), ('2020-12-31', Decimal('85.00')))
+        self.assertEqual(self.snapshot(), before)
+        self.assertEqual(self.get_data('core:transaction', self.ids[0])['data'][0]['amount'], 100.0)
+
+        balances.rebalance(self.account.id)
+        rollups.rebuild(self.test_user.id)
+        self.assertEqual(self.snapshot(), before)
+
+        # Only later whole years, the opening row carried over
+        self.assertEqual(archive.archive(self.test_user.id, datetime(2020, 1, 1).date()), 0)
+        self.assertEqual(archive.archive(self.test_user.id, datetime(2022, 1, 1).date()), 1)
+        self.assertEqual(
+            list(Transaction.all_objects.values_list('opening', 'amount')), [(True, Decimal('92.00'))]
+        )
+        self.assertEqual(self.snapshot(), before)
+
+    def test_writes_in_archived_years_refused(self):
+        archive.archive(self.test_user.id, datetime(2021, 1, 1).date())
+        response = self.client.post(reverse('core:save-transaction-add'), {
+            'date': '2020-12-01', 'description': 'Late', 'amount': '1.00', 'checked': '0',
+        })
+        self.assertIn('archived', json.loads(response.content.decode('utf-8'))['error_message'])
+        opening = Transaction.objects.get(opening=True)
+        response = self.client.post(reverse('core:save-transaction-edit', args=(opening.id,)), {
+            'date': '2021-12-01', 'description': 'Edited', 'amount': '1.00', 'checked': '0',
+        })
+        self.assertEqual(response.status_code, 404)
+        imported, errors = statements.import_statement(
+            io.StringIO('Date,Description,Amount\n2020-12-01,Late,1\n2021-12-01,Fine,1\n'), self.test_user.id
+        )
+        self.assertEqual((imported, [line for line, _ in errors]), (1, [2]))
+
+    def test_archived_rows_purged(self):
+        archive.archive(self.test_user.id, datetime(2021, 1, 1).date())
+        self.assertEqual(purge.remaining(account_id=self.account.id), 5)
+        purge.delete_account(self.account)
+        self.assertEqual(purge.run(batch_size=2), 5)
+        self.assertEqual(list(ArchivedTransaction.all_objects.values_list('id', flat=True)), [self.ids[2]])
+
+    def test_archive_command(self):
+        out = io.StringIO()
+        call_command('archive_transactions', keep_from=2020, verbosity=2, stdout=out)
+        self.assertIn(f'{self.test_username}: 3 transactions archived', out.getvalue())
+        self.assertEqual(User.objects.get(pk=self.test_user.id).archived_before.isoformat(), '2020-01-01')
+
+
+class ReconcileTest(BaseRequestTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.authenticated_session()
+        self.account = self.create_account(user=self.test_user, name='Reconcile Account', agency='0001', number='1')
+
+    def create(self, date, description, amount, check_code='', checked=0):
+        return Transaction.objects.create(
+            username=self.test_user, account=self.account, date=date, description=description,
+            amount=Decimal(amount), check_code=check_code, checked=checked
+        )
+
+    def reconcile(self, content, **params):
+        response = self.request_within_budget('core:reconcile-statement', method='post', data={
+            'account_id': self.account.id,
+            'statement': SimpleUploadedFile('statement.csv', content.encode('utf-8')),
+            **params
+        })
+        return json.loads(response.content.decode('utf-8'))['data'][0]
+
+    def test_reconcile_matches_and_marks(self):
+        market = self.create('2020-01-10', 'Market downtown', '-42.10')
+        other_market = self.create('2020-01-11', 'Pharmacy', '-42.10')
+        salary = self.create('2020-01-05', 'Salary', '1000.00', check_code='FIT-1')
+        far = self.create('2020-01-20', 'Rent', '-500.00')
+        self.create('2020-01-12', 'Already checked', '-7.00', checked=1)
+        rollups.rebuild(self.test_user.id)
+        content = (
+            'date,description,amount,check_code\n'
+            '2020-01-12,MARKET DOWNTOWN 123,-42.10,\n'
+            '2020-01-02,Employer payment,1000.00,FIT-1\n'
+            '2020-01-12,Card,-7.00,FIT-9\n'
+            '2020-01-31,Rent,-500.00,\n'
+            'bad,Line,1,\n'
+        )
+        data = self.reconcile(content)
+        self.assertEqual(data['matched'], 2)
+        self.assertEqual(
+            sorted((m['line'], m['transaction_id']) for m in data['matches']),
+            [(2, market.id), (3, salary.id)]
+        )
+        self.assertEqual([r['line'] for r in data['unmatched_lines']], [4, 5])
+        self.assertEqual([t['id'] for t in data['unmatched_transactions']], [other_market.id, far.id])
+        self.assertEqual([e['line'] for e in data['errors']], [6])
+        self.assertEqual(
+            set(Transaction.objects.filter(checked=1).values_list('description', flat=True)),
+            {'Market downtown', 'Salary', 'Already checked'}
+        )
+        months, totals = rollups.summary(self.test_user.id)
+        self.assertEqual(totals['checked_total'], Decimal('950.90'))
+        incremental = totals
+        rollups.rebuild(self.test_user.id)
+        self.assertEqual(rollups.summary(self.test_user.id)[1], incremental)
+
+    def test_reconcile_dry_run(self):
+        trs = self.create('2020-01-10', 'Market', '-42.10')
+        data = self.reconcile('date,description,amount\n2020-01-10,Market,-42.10\n', dry_run='1')
+        self.assertEqual(data['matches'], [{'line': 2, 'transaction_id': trs.id}])
+        trs.refresh_from_db()
+        self.assertEqual(trs.checked, 0)
+
+    def test_reconcile_statement_check_code(self):
+        trs = self.create('2020-01-10', 'Market', '-42.10')
+        self.reconcile('date,description,amount,check_code\n2020-01-11,Market,-42.10,FIT-7\n')
+        trs.refresh_from_db()
+        self.assertEqual((trs.checked, trs.check_code), (1, 'FIT-7'))
+
+
+class ExportRequestTest(BaseRequestTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.authenticated_session()
+        self.account = self.create_account(user=self.test_user, name='Export Account', agency='0001', number='1')
+        for day, amount in ((1, '10.00'), (2, '-2.50'), (3, '7.25')):
+            Transaction.objects.create(
+                username=self.test_user,
+                account=self.account if day != 3 else None,
+                date=datetime(2020, 1, day).date(),
+                description=f'Export, "{day}"',
+                amount=Decimal(amount),
+                checked=0,
+            )
+
+    def test_export_csv(self):
+        response = self.client.get(reverse('core:export-transactions'), {'account_id': self.account.id})
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(lines[0].split(','), list(exports.EXPORT_COLUMNS))
+        self.assertEqual(len(lines), 3)
+        self.assertIn('"Export, ""2"""', lines[2])
+
+    def test_export_json(self):
+        response = self.client.get(reverse('core:export-transactions'), {'format': 'json', 'date_from': '2020-01-02'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode('utf-8').splitlines()]
+        self.assertEqual([r['amount'] for r in rows], ['-2.50', '7.25'])
+        self.assertEqual(rows[0]['date'], '2020-01-02')
+
+    def test_export_invalid_format(self):
+        response = self.client.get(reverse('core:export-transactions'), {'format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+    async def test_export_under_asgi(self):
+        expected = await sync_to_async(
+            lambda: b''.join(self.client.get(reverse('core:export-transactions')).streaming_content)
+        )()
+        session_key = await sync_to_async(lambda: self.client.session.session_key)()
+        scope = {
+            'type': 'http',
+            'method': 'GET',
+            'path': reverse('core:export-transactions'),
+            'query_string': b'format=csv',
+            'headers': [
+                (b'host', b'testserver'),
+                (b'cookie', f'{settings.SESSION_COOKIE_NAME}={session_key}'.encode()),
+            ],
+        }
+        communicator = ApplicationCommunicator(route(ASGIHandler()), scope)
+        await communicator.send_input({'type': 'http.request', 'body': b''})
+        start = await communicator.receive_output()
+        self.assertEqual(start['status'], 200)
+        body = b''
+        while True:
+            message = await communicator.receive_output()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+        await communicator.wait()
+        self.assertEqual(body, expected)
+        self.assertEqual(len(body.splitlines()), 4)
+
+
+class BatchRequestTest(BaseRequestTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.authenticated_session()
+        self.account = self.create_account(user=self.test_user, name='Batch Account', agency='0001', number='1')
+
+    def post_batch(self, items):
+        response = self.client.post(
+            reverse('core:save-transactions'),
+            json.dumps(items),
+            content_type='application/json'
+        )
+        return json.loads(response.content.decode('utf-8'))
+
+    def test_batch_create_update_delete(self):
+        to_update = Transaction.objects.create(
+            username=self.test_user, account=self.account, date=datetime(2020, 1, 1).date(),
+            description='To update', amount=Decimal('10.00'), checked=0,
+        )
+        to_delete = Transaction.objects.create(
+            username=self.test_user, account=self.account, date=datetime(2020, 1, 2).date(),
+            description='To delete', amount=Decimal('20.00'), checked=0,
+        )
+        response_obj = self.post_batch([
+            {'action': 'create', 'data': {'date': '2020-01-03', 'description': 'New', 'amount': 5.5, 'account_id': self.account.id}},
+            {'action': 'update', 'id': to_update.id, 'data': {'date': '2020-01-04', 'description': 'Updated', 'amount': '-1.00', 'checked': 1, 'account_id': self.account.id}},
+            {'action': 'delete', 'id': to_delete.id},
+        ])
+        self.assertEqual(response_obj['error_message'], '')
+        created, updated, deleted = response_obj['data']
+        self.assertEqual(created['data']['amount'], 5.5)
+        self.assertEqual(updated['data']['description'], 'Updated')
+        self.assertIsNone(deleted['data'])
+        self.assertFalse(Transaction.objects.filter(pk=to_delete.id).exists())
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal('4.50'))
+        self.assertEqual(Transaction.objects.get(pk=to_update.id).balance, Decimal('4.50'))
+
+    def test_batch_is_atomic(self):
+        another_user = self.create_user(username='other_user_test@test.com', password='secret-321')
+        foreign = Transaction.objects.create(
+            username=another_user, date=datetime(2020, 1, 1).date(),
+            description='Not mine', amount=Decimal('10.00'), checked=0,
+        )
+        response_obj = self.post_batch([
+            {'action': 'create', 'data': {'date': '2020-01-03', 'description': 'New', 'amount': '5.50'}},
+            {'action': 'delete', 'id': foreign.id},
+            {'action': 'create', 'data': {'date': 'yesterday', 'description': 'Bad', 'amount': '1'}},
+        ])
+        self.assertNotEqual(response_obj['error_message'], '')
+        self.assertEqual(
+            [r['error_message'] for r in response_obj['data']],
+            ['', 'Transaction not found', 'Invalid transaction data']
+        )
+        self.assertEqual(Transaction.objects.filter(username=self.test_user).count(), 0)
+        self.assertTrue(Transaction.objects.filter(pk=foreign.id).exists())
+
+    def test_batch_amounts(self):
+        response_obj = self.post_batch([
+            {'action': 'create', 'data': {'date': '2020-01-03', 'description': 'New', 'amount': amount}}
+            for amount in ('1e20', 'NaN', 'abc', None, '1.00')
+        ])
+        self.assertEqual(
+            [r['error_message'] for r in response_obj['data']],
+            ['Invalid transaction data'] * 4 + ['']
+        )
+        self.assertEqual(Transaction.objects.filter(username=self.test_user).count(), 0)
+        response_obj = self.post_batch([
+            {'action': 'create', 'data': {'date': '2020-01-03', 'description': 'New', 'amount': amount, 'account_id': self.account.id}}
+            for amount in ('1.005', 1.005)
+        ])
+        self.assertEqual([r['data']['amount'] for r in response_obj['data']], [1.0, 1.0])
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal('2.00'))
+        self.assertEqual(rollups.summary(self.test_user.id)[1]['net'], Decimal('2.00'))
+
+
+class TagRequestTest(BaseRequestTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.authenticated_session()
+
+    def save(self, date, amount, tag_text, pk=None):
+        url = reverse('core:save-transaction-edit', args=(pk,)) if pk else reverse('core:save-transaction-add')
+        response = self.client.post(url, {
+            'date': date,
+            'description': 'Tag test',
+            'amount': amount,
+            'checked': '0',
+            'tags': tag_text,
+        })
+        return json.loads(response.content.decode('utf-8'))['data'][0]
+
+    def test_parse_tags(self):
+        self.assertEqual(tags.parse_tags(' Food, #market,,food '), ['food', 'market'])
+        self.assertEqual(tags.parse_tags(None), [])
+
+    def test_tag_filter_and_summary(self):
+        self.save('2020-01-01', '-10.00', 'Food, market')
+        edited = self.save('2020-01-02', '-20.00', 'food')
+        self.save('2020-01-03', '100.00', 'salary')
+        self.save('2020-01-02', '-25.00', 'Market', pk=edited['id'])
+        response = self.client.get(reverse('core:transactions'), {'tag': 'FOOD'})
+        rows = json.loads(response.content.decode('utf-8'))['data']
+        self.assertEqual([r['amount'] for r in rows], [-10.0])
+        self.assertEqual(Transaction.objects.get(pk=edited['id']).tags, 'market')
+        response = self.client.get(reverse('core:tag-summary'))
+        summary = {r['name']: r for r in json.loads(response.content.decode('utf-8'))['data']}
+        self.assertEqual(summary['market']['count'], 2)
+        self.assertEqual(summary['market']['expense'], 35.0)
+        self.assertEqual(summary['food']['count'], 1)
+        self.assertEqual(summary['salary']['income'], 100.0)
+
+    def test_tag_import_sync(self):
+        content = 'date,description,amount,tags\n2020-01-02,Market,-10,"food, market"\n2020-01-03,Bus,-2,transport\n'
+        statements.import_statement(io.StringIO(content), self.test_user.id)
+        response = self.client.get(reverse('core:transactions'), {'tag': 'market'})
+        rows = json.loads(response.content.decode('utf-8'))['data']
+        self.assertEqual([r['description'] for r in rows], ['Market'])
+
+
+class ReportRequestTest(BaseRequestTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.authenticated_session()
+        self.account = self.create_account(user=self.test_user, name='Report Account', agency='0001', number='1')
+        rows = [
+            ('2020-01-05', '1000.00', 'salary', self.account.id),
+            ('2020-01-10', '-30.10', 'Food, market', self.account.id),
+            ('2020-01-20', '-0.29', 'food', None),
+            ('2020-03-01', '-120.00', None, self.account.id),
+            ('2021-02-01', '-45.50', 'market', self.account.id),
+        ]
+        self.ids = [
+            Transaction.objects.create(
+                username=self.test_user, date=date, description='Report test', amount=Decimal(amount),
+                checked=0, tags=tag_text, account_id=account_id
+            ).id
+            for date, amount, tag_text, account_id in rows
+        ]
+
+    def get_report(self, url_name, **params):
+        response = self.request_within_budget(url_name, data=params)
+        response_obj = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(response_obj['error_message'], '')
+        return response_obj['data']
+
+    def test_totals(self):
+        months = self.get_report('core:report-totals', date_to='2020-12-31')
+        self.assertEqual([r['period'] for r in months], ['2020-01', '2020-03'])
+        self.assertEqual(months[0], {
+            'period': '2020-01', 'income': '1000.00', 'expense': '30.39', 'net': '969.61', 'count': 3
+        })
+        years = self.get_report('core:report-totals', period='year', by='account')
+        self.assertEqual(
+            [(r['period'], r['account_id'], r['net']) for r in years],
+            [('2020', None, '-0.29'), ('2020', self.account.id, '849.90'), ('2021', self.account.id, '-45.50')]
+        )
+        by_tag = self.get_report('core:report-totals', period='year', by='tag')
+        self.assertEqual(
+            [(r['period'], r['tag'], r['expense']) for r in by_tag],
+            [('2020', 'food', '30.39'), ('2020', 'market', '30.10'), ('2021', 'market', '45.50'), ('2020', 'salary', '0.00')]
+        )
+
+    def test_trend(self):
+        months = self.get_report('core:report-trend', date_to='2020-12-31', window=2)
+        self.assertEqual([r['period'] for r in months], ['2020-01', '2020-02', '2020-03'])
+        self.assertEqual([r['average_expense'] for r in months], ['30.39', '15.20', '60.00'])
+        self.assertEqual(months[1]['count'], 0)
+
+    def test_top_expenses(self):
+        rows = self.get_report('core:report-top-expenses', limit=2)
+        self.assertEqual([r['id'] for r in rows], [self.ids[3], self.ids[4]])
+
+    def test_invalid_parameters(self):
+        for url_name, params in (
+            ('core:report-totals', {'period': 'week'}),
+            ('core:report-totals', {'by': 'description'}),
+            ('core:report-trend', {'window': '0'}),
+            ('core:report-top-expenses', {'limit': 'x'}),
+        ):
+            response = self.client.get(reverse(url_name), params)
+            self.assertEqual(json.loads(response.content.decode('utf-8'))['error_message'], 'Invalid filter parameters')
+
+
+class SearchRequestTest(BaseRequestTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.authenticated_session()
+        another_user = self.create_user(username='other_user_test@test.com', password='secret-321')
+        for user, description, notes in (
+            (self.test_user, 'Supermarket groceries', None),
+            (self.test_user, 'Gas station', 'Groceries at the station shop'),
+            (self.test_user, 'Salary', None),
+            (another_user, 'Supermarket', None),
+        ):
+            Transaction.objects.create(
+                username=user, date=datetime(2020, 1, 1).date(), description=description,
+                notes=notes, amount=Decimal('-1.00'), checked=0,
+            )
+
+    def get_search(self, q):
+        response = self.client.get(reverse('core:search-transactions'), {'q': q})
+        return [r['description'] for r in json.loads(response.content.decode('utf-8'))['data']]
+
+    def test_search_prefix_and_scope(self):
+        self.assertTrue(search.fts_enabled())
+        self.assertEqual(self.get_search('superm'), ['Supermarket groceries'])
+        self.assertEqual(sorted(self.get_search('grocer')), ['Gas station', 'Supermarket groceries'])
+        self.assertEqual(self.get_search(''), [])
+
+    def test_search_follows_updates(self):
+        trs = Transaction.objects.get(description='Salary')
+        trs.description = 'Bonus'
+        trs.save()
+        self.assertEqual(self.get_search('salary'), [])
+        self.assertEqual(self.get_search('bonus'), ['Bonus'])
+        trs.delete()
+        self.assertEqual(self.get_search('bonus'), [])
+
+    def test_search_fallback(self):
+        with mock.patch.object(search, 'fts_enabled', return_value=False):
+            self.assertEqual(sorted(self.get_search('grocer')), ['Gas station', 'Supermarket groceries'])
+
+
+
+class UserCacheTest(BaseRequestTestCase):
+
+    def test_accounts_cached_until_changed(self):
+        account = self.create_account(user=self.test_user, name='Cached Account', agency='0001', number='1')
+        self.assertEqual([a.name for a in usercache.accounts(self.test_user.id)], ['Cached Account'])
+        with self.assertNumQueries(0):
+            usercache.accounts(self.test_user.id)
+        account.name = 'Renamed Account'
+        with self.captureOnCommitCallbacks(execute=True):
+            account.save()
+            # Read before the commit: cached under the version it bumps
+            self.assertEqual([a.name for a in usercache.accounts(self.test_user.id)], ['Cached Account'])
+        self.assertEqual([a.name for a in usercache.accounts(self.test_user.id)], ['Renamed Account'])
+        self.assertGreaterEqual(usercache.stats()['hits'], 1)
+
+    def test_transaction_cache_follows_writes(self):
+        self.authenticated_session()
+        data = {'date': '2020-01-01', 'description': 'Cached', 'amount': '1.00', 'checked': '0'}
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('core:save-transaction-add'), data)
+        pk = json.loads(response.content.decode('utf-8'))['data'][0]['id']
+        self.client.get(reverse('core:transaction', args=(pk,)))
+        data['description'] = 'Cached [edited]'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('core:save-transaction-edit', args=(pk,)), data)
+        response = self.client.get(reverse('core:transaction', args=(pk,)))
+        self.assertEqual(json.loads(response.content.decode('utf-8'))['data'][0]['description'], 'Cached [edited]')
+
+    def test_bulk_writes_invalidate(self):
+        self.authenticated_session()
+        account = self.create_account(user=self.test_user, name='Bulk Account', agency='0001', number='1')
+        usercache.accounts(self.test_user.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            statements.import_statement(io.StringIO('date,description,amount\n2020-01-01,Bulk,10\n'), self.test_user.id, account.id)
+        self.assertEqual(usercache.account(self.test_user.id, account.id).balance, Decimal('10.00'))
+
+
+class ConditionalGetTest(BaseRequestTestCase):
+
+    def save_transaction(self, account, date, amount):
+        data = {'date': date, 'description': 'Conditional', 'amount': amount, 'checked': '0', 'account_id': account.id}
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('core:save-transaction-add'), data)
+        return json.loads(response.content.decode('utf-8'))['data'][0]['id']
+
+    def test_list_not_modified_until_a_write(self):
+        self.authenticated_session()
+        account = self.create_account(user=self.test_user, name='Conditional Account', agency='0001', number='1')
+        self.save_transaction(account, '2020-01-01', '10.00')
+        url = reverse('core:transactions')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+        etag = response['ETag']
+        # The login check and the stamp, no rows loaded
+        with self.assertNumQueries(2):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.save_transaction(account, '2020-01-02', '5.00')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.content.decode('utf-8'))['data']), 2)
+
+    def test_stamp_follows_writes_of_other_processes(self):
+        self.authenticated_session()
+        account = self.create_account(user=self.test_user, name='Conditional Account', agency='0001', number='1')
+        url = reverse('core:transactions')
+        etag = self.client.get(url)['ETag']
+        # A background import by run_worker: this process's cache never hears of it
+        with mock.patch('core.lib.usercache._bump'), self.captureOnCommitCallbacks(execute=True):
+            statements.import_statement(io.StringIO('date,description,amount\n2020-01-01,Worker,10\n'), self.test_user.id, account.id)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual([r['description'] for r in response.json()['data']], ['Worker'])
+
+    def test_transaction_follows_updated_at(self):
+        self.authenticated_session()
+        account = self.create_account(user=self.test_user, name='Conditional Account', agency='0001', number='1')
+        pk = self.save_transaction(account, '2020-01-02', '10.00')
+        url = reverse('core:transaction', args=(pk,))
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # An earlier transaction moves this one's running balance
+        self.save_transaction(account, '2020-01-01', '1.00')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content.decode('utf-8'))['data'][0]['balance'], 11.0)
+
+    def test_account_list_if_modified_since(self):
+        self.authenticated_session()
+        self.create_account(user=self.test_user, name='Conditional Account', agency='0001', number='1')
+        response = self.client.get(reverse('core:account-list'))
+        last_modified = response['Last-Modified']
+        response = self.client.get(reverse('core:account-list'), HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+        # Not followed, so its flash message is still pending and must be shown
+        self.client.post(reverse('core:save-account-add'), {'account_name': 'Second', 'account_agency': '', 'account_number': ''})
+        response = self.client.get(reverse('core:account-list'), HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Last-Modified', response)
+        self.assertContains(response, 'Account save successfuly!')
+
+
+class AsyncViewTest(BaseRequestTestCase):
+
+    def test_json_views_are_async(self):
+        for view in (views.get_transaction, views.save_transaction, views.list_transactions, views.transaction_summary):
+            self.assertTrue(asyncio.iscoroutinefunction(view))
+
+    async def test_async_get_transaction(self):
+        trs = await sync_to_async(Transaction.objects.create)(
+            username=self.test_user,
+            date=datetime(2020, 1, 1).date(),
+            description='Async Test',
+            amount=Decimal('1.00'),
+            checked=0,
+        )
+        response = await self.async_client.get(reverse('core:transaction', args=(trs.id,)))
+        self.assertNotEqual(json.loads(response.content.decode('utf-8'))['error_message'], '')
+        await sync_to_async(self.authenticated_session)()
+        self.async_client.cookies = self.client.cookies
+        response = await self.async_client.get(reverse('core:transaction', args=(trs.id,)))
+        self.assertEqual(json.loads(response.content.decode('utf-8'))['data'][0]['description'], 'Async Test')
+
+
+class EventsTest(BaseRequestTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.authenticated_session()
+        self.account = self.create_account(user=self.test_user, name='Live Account', agency='0001', number='1')
+
+    def save_transaction(self, description, pk=None):
+        url = reverse('core:save-transaction-edit', args=(pk,)) if pk else reverse('core:save-transaction-add')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, {
+                'date': '2020-01-01', 'description': description, 'amount': '-10.00', 'checked': '0',
+                'account_id': self.account.id,
+            })
+        return json.loads(response.content.decode('utf-8'))['data'][0]
+
+    def bump(self):
+        self.bump_user(self.test_user.id)
+
+    def bump_user(self, user_id):
+        with self.captureOnCommitCallbacks(execute=True):
+            usercache.bump(user_id)
+
+    def test_writes_are_caught_up(self):
+        cursor = events.position(self.test_user.id).cursor
+        row = self.save_transaction('Market')
+        self.save_transaction('Supermarket', pk=row['id'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse('core:save-transactions'), json.dumps([{'action': 'delete', 'id': row['id']}]),
+                content_type='application/json'
+            )
+        sent = events.catch_up(self.test_user.id, cursor)
+        self.assertEqual([e.kind for e in sent], ['created', 'updated', 'deleted'])
+        self.assertEqual(sent[1].data['description'], 'Supermarket')
+        self.assertEqual(sent[2].data, {'id': row['id']})
+        self.assertEqual(events.catch_up(self.test_user.id, sent[-1].cursor), [])
+        response = self.client.get(reverse('core:transaction-events'), {'since': cursor})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertContains(response, f'id: {sent[0].cursor}\nevent: created\n')
+        self.assertContains(response, 'event: deleted\ndata: {"id": %d}' % row['id'])
+
+    def test_reset_when_changes_cannot_be_told(self):
+        position = events.position(self.test_user.id)
+        other = f'0ther000.{position.sequence}.{position.version}'
+        self.assertEqual([(e.kind, e.cursor) for e in events.catch_up(self.test_user.id, other)], [(None, position.cursor)])
+        self.assertEqual(events.catch_up(self.test_user.id, 'garbage')[0].kind, events.RESET)
+        # Bulk writes publish nothing but bump the cache version
+        self.bump()
+        self.assertEqual(events.catch_up(self.test_user.id, position.cursor)[0].kind, events.RESET)
+        self.assertEqual(events.catch_up(self.test_user.id, other)[0].kind, events.RESET)
+        cursor = events.position(self.test_user.id).cursor
+        with override_settings(EVENTS_BUFFER_SIZE=1):
+            self.save_transaction('First')
+            self.save_transaction('Second')
+        self.assertEqual(events.catch_up(self.test_user.id, cursor)[0].kind, events.RESET)
+
+    def test_only_listening_users_buffered(self):
+        others = [self.create_user(username=f'listener{i}@test.app', password='x').id for i in range(3)]
+        events._publish(others[0], 'created', {'id': 1})
+        self.assertNotIn(others[0], events._buffers)
+        with override_settings(EVENTS_MAX_USERS=2):
+            cursors = [events.position(user_id).cursor for user_id in others]
+            # The least recently seen went over the limit
+            self.assertEqual([user_id for user_id in others if user_id in events._buffers], others[1:])
+        self.bump_user(others[0])
+        self.assertEqual(events.catch_up(others[0], cursors[0])[0].kind, events.RESET)
+        events._publish(others[1], 'created', {'id': 2})
+        self.assertEqual([e.kind for e in events.catch_up(others[1], cursors[1])], ['created'])
+        with override_settings(EVENTS_IDLE_TIMEOUT=0):
+            events._publish(others[2], 'created', {'id': 3})
+        for user_id in others:
+            self.assertNotIn(user_id, events._buffers)
+            self.assertNotIn(user_id, events._dropped)
+
+    async def test_subscribed_users_kept(self):
+        subscription = events.subscribe(self.test_user.id)
+        try:
+            with override_settings(EVENTS_IDLE_TIMEOUT=0, EVENTS_MAX_USERS=0):
+                await sync_to_async(events._publish)(self.test_user.id, 'created', {'id': 1})
+                self.assertEqual(events._buffers[self.test_user.id][-1].data, {'id': 1})
+        finally:
+            events.unsubscribe(subscription)
+        with override_settings(EVENTS_IDLE_TIMEOUT=0):
+            await sync_to_async(events._publish)(self.test_user.id, 'created', {'id': 2})
+        self.assertNotIn(self.test_user.id, events._buffers)
+
+    @override_settings(EVENTS_HEARTBEAT=0.1)
+    async def test_asgi_stream(self):
+        async def django_application(scope, receive, send):
+            raise AssertionError('Served by Django')
+
+        position = await sync_to_async(events.position)(self.test_user.id)
+        scope = {
+            'type': 'http',
+            'method': 'GET',
+            'path': reverse('core:transaction-events'),
+            'query_string': f'since={position.cursor}'.encode(),
+            'headers': [(b'cookie', f'{settings.SESSION_COOKIE_NAME}={self.client.session.session_key}'.encode())],
+        }
+        communicator = ApplicationCommunicator(route(django_application), scope)
+        await communicator.send_input({'type': 'http.request', 'body': b''})
+        start = await communicator.receive_output()
+        self.assertEqual(start['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), start['headers'])
+        self.assertEqual((await communicator.receive_output())['body'], f'retry: {settings.EVENTS_RETRY}\n\n'.encode())
+        await sync_to_async(events._publish)(self.test_user.id, 'created', {'id': 1})
+        body = (await communicator.receive_output())['body'].decode()
+        self.assertIn('event: created\ndata: {"id": 1}', body)
+        self.assertEqual((await communicator.receive_output())['body'], b': keep-alive\n\n')
+        # Changed by another process: the heartbeat finds the new cache version
+        await sync_to_async(self.bump)()
+        self.assertIn(b'event: reset', (await communicator.receive_output())['body'])
+        await communicator.send_input({'type': 'http.disconnect'})
+        await communicator.wait()
+        self.assertNotIn(self.test_user.id, events._subscriptions)
+
+    async def test_asgi_stream_requires_login(self):
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': reverse('core:transaction-events'), 'query_string': b'',
+            'headers': [],
+        }
+        communicator = ApplicationCommunicator(route(None), scope)
+        await communicator.send_input({'type': 'http.request', 'body': b''})
+        self.assertEqual((await communicator.receive_output())['status'], 403)
+        await communicator.wait()
+
+
+class DefaultThreadPoolTest(TestCase):
+    """The shipped ASYNC_VIEWS_THREAD_SENSITIVE=False, not the one of BaseRequestTestCase."""
+
+    def test_offloaded_calls_close_old_connections(self):
+        self.assertFalse(settings.ASYNC_VIEWS_THREAD_SENSITIVE)
+        with mock.patch('core.views.close_old_connections') as close:
+            thread = async_to_sync(views.in_thread(threading.get_ident))()
+        self.assertNotEqual(thread, threading.get_ident())
+        self.assertEqual(close.call_count, 2)
+
+    def test_json_view_in_the_pool(self):
+        # The session is looked up by a pool thread, outside this test's
+        # database transaction, so the view answers as logged out
+        response = self.client.get(reverse('core:transactions'))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(json.loads(response.content.decode('utf-8'))['error_message'], '')
+
+
+class SeedBenchmarkTest(BaseRequestTestCase):
+
+    def test_seed_is_consistent(self):
+        call_command('seed_benchmark', users=2, accounts=2, transactions=300, years=1, stdout=io.StringIO())
+        user = User.objects.get(username='bench1@mireis.app')
+        self.assertEqual(Transaction.objects.filter(username=user).count(), 300)
+        for account in Account.objects.filter(username=user):
+            last = Transaction.objects.filter(account=account).order_by('-date', '-id').first()
+            total = sum(Transaction.objects.filter(account=account).values_list('amount', flat=True))
+            self.assertEqual(account.balance, total)
+            self.assertEqual(last.balance, total)
+        months, totals = rollups.summary(user.id)
+        self.assertEqual(totals['count'], 300)
+        self.assertTrue(search.search_ids(user.id, 'supermarket', 1))
+        trs = Transaction.objects.filter(username=user).exclude(tags=None).first()
+        self.assertEqual(sorted(trs.tag_index.values_list('name', flat=True)), tags.parse_tags(trs.tags))
+
+
+@override_settings(PROFILING=True, PROFILING_METRICS_TOKEN='secret', PROFILING_SLOW_REQUEST_MS=60000)
+class ProfilingTest(BaseRequestTestCase):
+
+    def setUp(self):
+        super().setUp()
+        profiling.reset()
+        self.authenticated_session()
+        Transaction.objects.create(
+            username=self.test_user, date=datetime(2020, 1, 1).date(), description='Profiled',
+            amount=Decimal('1.00'), checked=0,
+        )
+
+    def get_metrics(self):
+        response = self.client.get(reverse('core:metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode('utf-8')
+
+    def metric(self, text, line_start):
+        return [float(line.split()[-1]) for line in text.splitlines() if line.startswith(line_start)][0]
+
+    def test_view_metrics(self):
+        self.client.get(reverse('core:transactions'))
+        self.client.get(reverse('core:transactions'))
+        self.client.get(reverse('core:journal'))
+        b''.join(self.client.get(reverse('core:export-transactions')).streaming_content)
+        text = self.get_metrics()
+        self.assertIn('mireis_requests_total{view="core:transactions",method="GET",status="200"} 2', text)
+        self.assertEqual(self.metric(text, 'mireis_request_duration_seconds_count{view="core:transactions"'), 2)
+        self.assertGreater(self.metric(text, 'mireis_request_db_queries_sum{view="core:transactions"'), 0)
+        self.assertGreater(self.metric(text, 'mireis_request_template_duration_seconds_sum{view="core:journal"'), 0)
+        self.assertEqual(self.metric(text, 'mireis_request_template_duration_seconds_sum{view="core:transactions"'), 0)
+        # Streamed: counted once the body has been read
+        self.assertGreater(self.metric(text, 'mireis_response_size_bytes_sum{view="core:export-transactions"'), 0)
+        self.assertIn('mireis_response_size_bytes_bucket{view="core:transactions",method="GET",le="+Inf"} 2', text)
+
+    def test_slow_requests_logged(self):
+        with self.settings(PROFILING_SLOW_REQUEST_MS=0, PROFILING_SLOW_SAMPLES=1):
+            with self.assertLogs('core.profiling', level='WARNING') as logs:
+                self.client.get(reverse('core:transactions'))
+        self.assertIn('core_transaction', logs.output[0])
+        self.assertEqual(len(profiling.slow_requests()), 1)
+
+    def test_metrics_access(self):
+        self.assertEqual(self.client.get(reverse('core:metrics')).status_code, 401)
+        response = self.client.get(reverse('core:metrics'), HTTP_AUTHORIZATION='Bearer other')
+        self.assertEqual(response.status_code, 401)
+        with self.settings(PROFILING=False):
+            response = self.client.get(reverse('core:metrics'), HTTP_AUTHORIZATION='Bearer secret')
+            self.assertEqual(response.status_code, 404)
+        # No token, no metrics
+        with self.settings(PROFILING_METRICS_TOKEN=''):
+            self.assertEqual(self.client.get(reverse('core:metrics')).status_code, 404)
+            self.assertEqual([w.id for w in checks.check_metrics_token(None)], ['core.W002'])
+        self.assertEqual(checks.check_metrics_token(None), [])
+
+
+class QueryBudgetTest(BaseRequestTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.authenticated_session()
+        self.account = self.create_account(user=self.test_user, name='Budget Account', agency='0001', number='1')
+        self.other_account = self.create_account(user=self.test_user, name='Other Account', agency='0001', number='2')
+        # Enough rows, months and tags for per row queries to stand out
+        for i in range(60):
+            trs = Transaction.objects.create(
+                username=self.test_user, account=self.account if i % 2 else self.other_account,
+                date=datetime(2020, i % 12 + 1, i % 28 + 1).date(), description=f'Budget {i}',
+                amount=Decimal(i - 30), checked=0, tags=f'tag{i % 5}, budget',
+            )
+            tags.sync([trs])
+        self.trs = trs
+
+    def test_every_view_has_a_budget(self):
+        from core import urls
+        for pattern in urls.urlpatterns:
+            self.assertTrue(hasattr(pattern.callback, 'query_budget'), pattern.name)
+
+    def test_over_budget(self):
+        @views.query_budget(1)
+        def view(request):
+            list(Account.objects.all())
+            list(Transaction.objects.all())
+        request = RequestFactory().get('/')
+        request.resolver_match = None
+        with self.assertRaises(profiling.QueryBudgetExceeded) as raised:
+            view(request)
+        self.assertIn('over its budget of 1', str(raised.exception))
+        self.assertIn('core_transaction', str(raised.exception))
+        with self.settings(QUERY_BUDGET='log'), self.assertLogs('core.profiling', level='WARNING'):
+            view(request)
+        with self.settings(QUERY_BUDGET='off'):
+            view(request)
+
+    def test_read_views_within_budget(self):
+        for url_name, args, data in (
+            ('core:index', (), {}),
+            ('core:register', (), {}),
+            ('core:journal', (), {}),
+            ('core:account-list', (), {}),
+            ('core:add-account', (), {}),
+            ('core:edit-account', (self.account.id,), {}),
+            ('core:transactions', (), {'tag': 'budget'}),
+            ('core:search-transactions', (), {'q': 'budget'}),
+            ('core:transaction-summary', (), {}),
+            ('core:tag-summary', (), {}),
+            ('core:export-transactions', (), {}),
+            ('core:transaction', (self.trs.id,), {}),
+        ):
+            response = self.request_within_budget(url_name, *args, data=data)
+            self.assertEqual(response.status_code, 200, url_name)
+
+    def test_write_views_within_budget(self):
+        data = {
+            'date': '2020-06-15', 'description': 'Budget edit', 'amount': '-5.00', 'checked': '0',
+            'account_id': self.account.id, 'tags': 'new tag, budget',
+        }
+        self.request_within_budget('core:save-transaction-add', method='post', data=data)
+        self.request_within_budget('core:save-transaction-edit', self.trs.id, method='post', data=data)
+        batch_data = json.dumps([
+            {'action': 'create', 'data': data},
+            {'action': 'update', 'id': self.trs.id, 'data': dict(data, account_id=self.other_account.id)},
+        ])
+        response = self.request_within_budget(
+            'core:save-transactions', method='post', data=batch_data, content_type='application/json'
+        )
+        self.assertEqual(json.loads(response.content.decode('utf-8'))['error_message'], '')
+        lines = ['date,description,amount,tags'] + [f'2020-{m:02d}-10,Imported,-1.00,budget' for m in range(1, 13)]
+        statement = SimpleUploadedFile('statement.csv', '\n'.join(lines).encode())
+        self.request_within_budget(
+            'core:import-statement', method='post', data={'statement': statement, 'account_id': self.account.id}
+        )
+        account_data = {'account_name': 'Edited', 'account_agency': '0002', 'account_number': '3'}
+        self.request_within_budget('core:save-account-add', method='post', data=account_data)
+        self.request_within_budget('core:save-account-edit', self.account.id, method='post', data=account_data)
+        self.request_within_budget('core:del-account', self.other_account.id)
+        self.request_within_budget('core:logout')
+        self.request_within_budget(
+            'core:login', method='post', data={'username': self.test_username, 'password': self.test_password}
+        )
+        self.request_within_budget('core:metrics')
+
+    def test_save_transaction_budget_holds_for_any_tags(self):
+        data = {
+            'date': '2020-06-15', 'description': 'Many tags', 'amount': '-5.00', 'checked': '0',
+            'account_id': self.other_account.id, 'tags': ', '.join(f'many{i}' for i in range(tags.MAX_TAGS)),
+        }
+        self.request_within_budget('core:save-transaction-edit', self.trs.id, method='post', data=data)
+        data['tags'] += ', one more'
+        response = self.request_within_budget('core:save-transaction-add', method='post', data=data)
+        self.assertIn('Too many tags', json.loads(response.content.decode('utf-8'))['error_message'])
+
+    def test_bulk_writes_grow_with_months_not_items(self):
+        def queries(post):
+            with CaptureQueriesContext(connection) as captured:
+                response = post()
+            self.assertEqual(json.loads(response.content.decode('utf-8'))['error_message'], '')
+            return len(captured)
+
+        def batch_create(count):
+            items = [
+                {'action': 'create', 'data': {
+                    'date': '2020-06-15', 'description': f'Bulk {i}', 'amount': '1.00',
+                    'account_id': self.account.id, 'tags': f'bulk{i % 3}',
+                }}
+                for i in range(count)
+            ]
+            return self.client.post(reverse('core:save-transactions'), json.dumps(items), content_type='application/json')
+
+        def import_rows(count):
+            lines = ['date,description,amount,tags'] + [f'2020-06-{i % 28 + 1:02d},Bulk {i},-1.00,budget' for i in range(count)]
+            statement = SimpleUploadedFile('statement.csv', '\n'.join(lines).encode())
+            return self.client.post(reverse('core:import-statement'), {'statement': statement, 'account_id': self.account.id})
+
+        # Same tags in every run (new ones cost two queries more) and rows
+        # within one bulk insert statement (past it, one INSERT more each)
+        batch_create(3)
+        self.assertEqual(queries(lambda: batch_create(1)), queries(lambda: batch_create(50)))
+        import_rows(1)
+        self.assertEqual(queries(lambda: import_rows(1)), queries(lambda: import_rows(50)))
+
+
+class Jinja2TemplateTest(BaseRequestTestCase):
+
+    def test_csrf_and_messages(self):
+        response = self.client.get(reverse('core:index'))
+        self.assertContains(response, 'name="csrfmiddlewaretoken"')
+        response = self.client.post(reverse('core:login'), {'username': 'nobody@test.app', 'password': 'x'}, follow=True)
+        self.assertContains(response, 'User and/or password invalid!')
+
+    def test_pages_render(self):
+        self.authenticated_session()
+        account = self.create_account(user=self.test_user, name='Jinja <Account>', agency='0001', number='1')
+        response = self.client.get(reverse('core:journal'))
+        self.assertContains(response, f'<option value="{account.id}">Jinja &lt;Account&gt;</option>', html=True)
+        self.assertContains(response, reverse('core:transactions'))
+        response = self.client.get(reverse('core:account-list'))
+        self.assertContains(response, reverse('core:edit-account', args=(account.id,)))
+        self.assertContains(response, self.test_username)
+        response = self.client.get(reverse('core:edit-account', args=(account.id,)))
+        self.assertContains(response, reverse('core:save-account-edit', args=(account.id,)))
+
+    def test_django_templates_in_sync(self):
+        # benchmarks.templates compares the two, they must render the same page
+        account = self.create_account(user=self.test_user, name='Account', agency='0001', number='1')
+        request = RequestFactory().get('/')
+        request.session = self.client.session
+        request.session['user'] = {'user_id': self.test_user.id, 'username': self.test_username}
+        request._messages = FallbackStorage(request)
+        context = {'account_list': [account], 'events_cursor': 'a.1.2'}
+        for page in ('journal.html', 'account-list.html'):
+            with self.subTest(page=page):
+                django_page = engines['django'].get_template(f'core/{page}').render(context, request)
+                jinja2_page = engines['jinja2'].get_template(f'core/{page}.j2').render(context, request)
+                self.assertEqual(' '.join(jinja2_page.split()), ' '.join(django_page.split()))
+
+
+class StaticFilesTest(TestCase):
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        settings_override = self.settings(STATIC_ROOT=root, STATIC_SERVE=True)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+        with open(os.path.join(root, 'staticfiles.json')) as f:
+            self.manifest = json.load(f)['paths']
+
+    def test_hashed_and_compressed(self):
+        css = self.manifest['core/css/fontawesome.min.css']
+        self.assertNotEqual(css, 'core/css/fontawesome.min.css')
+        response = self.client.get(f'/static/{css}', HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+        self.assertEqual(response['Content-Encoding'], 'br' if assets.brotli else 'gzip')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertLess(int(response['Content-Length']), 20000)
+        response = self.client.get(f'/static/{css}', HTTP_ACCEPT_ENCODING='gzip;q=1, br;q=0')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        response = self.client.get(f'/static/{css}')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        # The fonts it points to are hashed too, and only woff2 is shipped
+        body = b''.join(response.streaming_content).decode('utf-8')
+        self.assertIn(self.manifest['core/webfonts/fa-solid-900.woff2'].split('/')[-1], body)
+        self.assertNotIn('.eot', body)
+
+    def test_unhashed_names(self):
+        response = self.client.get('/static/core/css/base.css')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=3600')
+        response = self.client.get('/static/core/css/base.css', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.get('/static/core/css/missing.css').status_code, 404)
+
+    def test_templates_use_hashed_names(self):
+        response = self.client.get(reverse('core:index'))
+        self.assertContains(response, self.manifest['core/css/base.css'])
+
+    def test_accepted_encodings(self):
+        self.assertEqual(assets.accepted_encodings('gzip, br;q=0.5, deflate;q=0'), {'gzip', 'br'})
+        self.assertEqual(assets.accepted_encodings(None), set())
@@ -15,7 +15,23 @@ urlpatterns = [
     path('save-account', views.save_account, name='save-account-add'),
     path('save-account/<int:pk>', views.save_account, name='save-account-edit'),
     path('del-account/<int:pk>', views.del_account, name='del-account'),
+    path('del-account/<int:pk>/status', views.del_account_status, name='del-account-status'),
+    path('transactions', views.list_transactions, name='transactions'),
+    path('transactions/search', views.search_transactions, name='search-transactions'),
+    path('transactions/summary', views.transaction_summary, name='transaction-summary'),
+    path('transactions/export', views.export_transactions, name='export-transactions'),
+    path('transactions/events', views.transaction_events, name='transaction-events'),
+    path('tags/summary', views.tag_summary, name='tag-summary'),
+    path('reports/totals', views.report_totals, name='report-totals'),
+    path('reports/trend', views.report_trend, name='report-trend'),
+    path('reports/top-expenses', views.report_top_expenses, name='report-top-expenses'),
     path('transaction/<int:pk>', views.get_transaction, name='transaction'),
     path('save-transaction', views.save_transaction, name='save-transaction-add'),
     path('save-transaction/<int:pk>', views.save_transaction, name='save-transaction-edit'),
+    path('save-transactions', views.batch_transactions, name='save-transactions'),
+    path('import-statement', views.import_statement, name='import-statement'),
+    path('reconcile-statement', views.reconcile_statement, name='reconcile-statement'),
+    path('jobs', views.list_jobs, name='jobs'),
+    path('jobs/<int:pk>', views.get_job, name='job'),
+    path('metrics', views.metrics, name='metrics'),
 ]
\ No newline at end of file
@@ -1,44 +1,113 @@
+import asyncio
+import calendar
+import copy
 import functools
 import datetime
+import json
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.shortcuts import (
     render,
     get_object_or_404,
     redirect
 )
 from django.http import (
+    HttpResponse,
     JsonResponse,
-    Http404
+    Http404,
+    HttpResponseBadRequest,
+    StreamingHttpResponse
 )
 from django.urls import reverse
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control
+)
+from django.utils.http import (
+    http_date,
+    quote_etag
+)
 from django.contrib import messages
+from django.db import (
+    close_old_connections,
+    transaction as db_transaction
+)
+from django.db.models import Q
 
-from .lib import utils
+from .lib import (
+    archive,
+    balances,
+    batch,
+    events,
+    exports,
+    jobs,
+    profiling,
+    purge,
+    reconcile,
+    rollups,
+    search,
+    serializers,
+    statements,
+    tags,
+    usercache,
+    utils
+)
 
 # Models
 from .models import (
     User,
     Account,
+    ArchivedTransaction,
+    Job,
     Transaction
 )
 
+TRANSACTION_PAGE_SIZE = 50
+TRANSACTION_PAGE_SIZE_MAX = 500
+SEARCH_RESULTS_MAX = 100
+REPORT_TOP_EXPENSES = 10
+REPORT_TOP_EXPENSES_MAX = 100
+REPORT_WINDOW_MAX = 36
+JOBS_RECENT = 10
+
+# The columns archived transactions have too
+TRANSACTION_SERIALIZER = serializers.serializer_for(Transaction, archive.FIELDS)
+# The error is a traceback, for the logs only
+JOB_SERIALIZER = serializers.serializer_for(Job, (
+    'id', 'name', 'status', 'attempts', 'max_attempts', 'run_after', 'created_at', 'started_at', 'finished_at',
+    'progress', 'result'
+))
+
   
 def require_login(_func=None, *, response_type=None):
+    def login_denied(request):
+        if response_type == 'json':
+            return JsonResponse(
+                {
+                    'error_message':'You must be logged in to access this resource',
+                    'data': []
+                }
+            )
+        messages.add_message(request, messages.WARNING, 'You must be logged in to access this resource!')
+        return redirect('core:index')
+
     def real_decorator(f):
+        if asyncio.iscoroutinefunction(f):
+            # Loading the session hits the database, so it can't run in the event loop
+            @functools.wraps(f)
+            async def async_f_wrapper(request, **kw):
+                if await in_thread(is_logged)(request):
+                    return await f(request, **kw)
+                return await in_thread(login_denied)(request)
+            return async_f_wrapper
+
         @functools.wraps(f) # Keep original information about decorated function
         def f_wrapper(request, **kw):
-            if 'user' in request.session:
+            if is_logged(request):
                 return f(request, **kw)
             else:
-                if response_type == 'json':
-                    return JsonResponse(
-                        {
-                            'error_message':'You must be logged in to access this resource',
-                            'data': []
-                        }
-                    )
-                messages.add_message(request, messages.WARNING, 'You must be logged in to access this resource!')
-                return redirect('core:index')
+                return login_denied(request)
         return f_wrapper
     if _func is None:
         return real_decorator
@@ -46,6 +115,147 @@ def require_login(_func=None, *, response_type=None):
         return real_decorator(_func)
 
 
+def query_budget(limit):
+    """
+    Declares how many queries a view may run (login check included when it
+    goes above require_login), so N+1 regressions show up. Going over it is
+    logged or raised depending on QUERY_BUDGET, which is off unless DEBUG is
+    on or under tests. Queries made while a streamed body is sent come after
+    the view and are not counted.
+
+    A limit of None exempts the view: used by the bulk writes, whose queries
+    grow with the accounts, months and rows they touch (insert, tag and
+    rebalance chunks), where no fixed number would hold for every input.
+    """
+    def real_decorator(f):
+        if limit is None:
+            f.query_budget = None
+            return f
+
+        def check(request, count):
+            match = request.resolver_match
+            profiling.check_budget(match.view_name if match else f.__name__, limit, count)
+
+        if asyncio.iscoroutinefunction(f):
+            @functools.wraps(f)
+            async def async_f_wrapper(request, **kw):
+                if settings.QUERY_BUDGET == 'off':
+                    return await f(request, **kw)
+                with profiling.counting() as count:
+                    response = await f(request, **kw)
+                check(request, count)
+                return response
+            async_f_wrapper.query_budget = limit
+            return async_f_wrapper
+
+        @functools.wraps(f)
+        def f_wrapper(request, **kw):
+            if settings.QUERY_BUDGET == 'off':
+                return f(request, **kw)
+            with profiling.counting() as count:
+                response = f(request, **kw)
+            check(request, count)
+            return response
+        f_wrapper.query_budget = limit
+        return f_wrapper
+    return real_decorator
+
+
+def is_logged(request):
+    return 'user' in request.session
+
+
+def closing_connections(f):
+    """
+    Runs f between two close_old_connections(), as Django does around a
+    request in its own thread: those of a pool thread would otherwise outlive
+    CONN_MAX_AGE, or stay broken, as long as the thread.
+    """
+    @functools.wraps(f)
+    def f_wrapper(*args, **kw):
+        close_old_connections()
+        try:
+            return f(*args, **kw)
+        finally:
+            close_old_connections()
+    return f_wrapper
+
+
+def in_thread(f):
+    # Thread sensitive runs everything in the one thread of the sync views,
+    # whose connections Django looks after; the tests need it, their database
+    # transaction belongs to that thread's connection
+    if settings.ASYNC_VIEWS_THREAD_SENSITIVE:
+        return sync_to_async(f, thread_sensitive=True)
+    return sync_to_async(closing_connections(f), thread_sensitive=False)
+
+
+def offload(f):
+    """
+    Turns a sync view into an async one that runs it in the thread pool.
+
+    Under ASGI Django runs sync views one at a time in a single thread, while
+    these run side by side, each thread with its own database connection.
+    Django 3.x has no async ORM, so this is how the JSON endpoints go async.
+    """
+    @functools.wraps(f)
+    async def f_wrapper(request, **kw):
+        return await in_thread(f)(request, **kw)
+    return f_wrapper
+
+
+def conditional(stamp):
+    """
+    Answers GETs whose If-None-Match / If-Modified-Since still match with 304,
+    before the view runs. stamp(request, **kw) gives the (etag, last_modified)
+    pair of what the view would return, (None, None) for no validators; it
+    must be a single cheap lookup, never the rows themselves. Responses are
+    private and revalidated on every use, so browsers keep asking.
+    """
+    def real_decorator(f):
+        @functools.wraps(f)
+        def f_wrapper(request, **kw):
+            if request.method not in ('GET', 'HEAD'):
+                return f(request, **kw)
+            etag, last_modified = stamp(request, **kw)
+            etag = quote_etag(etag) if etag else None
+            last_modified = calendar.timegm(last_modified.utctimetuple()) if last_modified else None
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = f(request, **kw)
+                if response.status_code != 200:
+                    return response
+            if etag:
+                response['ETag'] = etag
+            if last_modified:
+                response['Last-Modified'] = http_date(last_modified)
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return f_wrapper
+    return real_decorator
+
+
+def user_stamp(request, **kw):
+    """Validators of anything built from the user's data, from User.data_version."""
+    if len(messages.get_messages(request)):
+        # Flash messages are shown once, a cached copy would drop them
+        return None, None
+    user_id = request.session['user'].get('user_id')
+    version, modified = usercache.stamp(user_id)
+    return f'{user_id}-{version}', modified
+
+
+def transaction_stamp(request, pk):
+    """Validators of a single transaction, from its updated_at."""
+    updated_at = Transaction.objects.filter(
+        username=request.session['user'].get('user_id'),
+        pk=pk
+    ).values_list('updated_at', flat=True).first()
+    if updated_at is None:
+        return None, None
+    return f'{pk}-{updated_at.timestamp()}', updated_at
+
+
 # def ajax_require_login(f):
 #     def f_wrapper(request, **kw):
 #         if 'user' in request.session:
@@ -60,11 +270,13 @@ def require_login(_func=None, *, response_type=None):
 #     return f_wrapper
 
 
+@query_budget(1)
 def index(request):
     context = {}
-    return render(request, 'core/index.html', context)
+    return render(request, 'core/index.html.j2', context)
 
 
+@query_budget(2)
 def login(request):
     username = request.POST.get('username')
     in_password = request.POST.get('password')
@@ -72,7 +284,7 @@ def login(request):
     if in_password:
         password = utils.password_digest(in_password)
     try:
-        user = User.objects.get(username=username)
+        user = User.objects.get(username=username, deleted_at=None)
         if user and user.password == password:
             request.session['user'] = {
                 'user_id': user.id,
@@ -86,6 +298,7 @@ def login(request):
     return redirect('core:index')
 
 
+@query_budget(3)
 def register(request):
     context = {}
     if request.POST:
@@ -113,22 +326,29 @@ def register(request):
         except Exception as e:
             messages.add_message(request, messages.ERROR, e)
         return redirect('core:register')
-    return render(request, 'core/register.html', context)
+    return render(request, 'core/register.html.j2', context)
 
 
+@query_budget(2)
 @require_login
 def journal(request):
-    context = {}
-    return render(request, 'core/journal.html', context)
+    context = {
+        # Live updates start from here, the rows are loaded after
+        'events_cursor': events.position(request.session['user'].get('user_id')).cursor
+    }
+    return render(request, 'core/journal.html.j2', context)
 
 
+@query_budget(3)
 @require_login
+@conditional(user_stamp)
 def account_list(request):
     context = {}
-    context['account_list'] = Account.objects.filter(username=request.session['user'].get('user_id'))
-    return render(request, 'core/account-list.html', context)
+    context['account_list'] = usercache.accounts(request.session['user'].get('user_id'))
+    return render(request, 'core/account-list.html.j2', context)
 
 
+@query_budget(1)
 @require_login
 def add_account(request):
     context = {
@@ -139,12 +359,15 @@ def add_account(request):
             'account_number': '',
         }
     }
-    return render(request, 'core/edit-account.html', context)
+    return render(request, 'core/edit-account.html.j2', context)
 
 
+@query_budget(2)
 @require_login
 def edit_account(request, pk):
-    account = get_object_or_404(Account, username=request.session['user'].get('user_id'), pk=pk)
+    account = usercache.account(request.session['user'].get('user_id'), pk)
+    if account is None:
+        raise Http404('Resource not found')
     context = {
         'form': {
             'account_id': account.id,
@@ -153,9 +376,10 @@ def edit_account(request, pk):
             'account_number': account.number,
         }
     }
-    return render(request, 'core/edit-account.html', context)
+    return render(request, 'core/edit-account.html.j2', context)
 
 
+@query_budget(4)
 @require_login
 def save_account(request, pk=None):
     if request.POST:
@@ -173,52 +397,559 @@ def save_account(request, pk=None):
     raise Http404('Resource not found')
 
 
+@query_budget(8)
 @require_login
 def del_account(request, pk):
     account = get_object_or_404(Account, username=request.session['user'].get('user_id'), pk=pk)
-    account.delete()
+    # Hidden at once, its transactions are purged in the background
+    purge.delete_account(account)
     return redirect('core:account-list')
 
 
+@query_budget(3)
+@require_login(response_type='json')
+@offload
+def del_account_status(request, pk):
+    """Progress of the purge of a deleted account; not found once it is done."""
+    json_response = {
+        'error_message': '',
+        'data': []
+    }
+    account = Account.all_objects.filter(
+        username=request.session['user'].get('user_id'),
+        pk=pk
+    ).values('id', 'deleted_at').first()
+    if account is None:
+        json_response['error_message'] = 'Account not found'
+        return JsonResponse(json_response)
+    json_response['data'].append({
+        'account_id': account['id'],
+        'deleted': account['deleted_at'] is not None,
+        'remaining': purge.remaining(account_id=pk) if account['deleted_at'] else None
+    })
+    return JsonResponse(json_response)
+
+
+@query_budget(3)
 @require_login(response_type='json')
+@offload
+@conditional(transaction_stamp)
 def get_transaction(request, pk):
     json_response = {
         'error_message': '',
         'data': []
     }
 
-    try:
-        trs = Transaction.objects.get(username=request.session['user'].get('user_id'), pk=pk)
-        json_response['data'].append(utils.model_row_as_dict(trs))
-    except Transaction.DoesNotExist:
+    user_id = request.session['user'].get('user_id')
+    json_response['data'] = usercache.get_or_set(
+        user_id,
+        f'transaction:{pk}',
+        lambda: [
+            TRANSACTION_SERIALIZER.from_tuple(row)
+            for row in archive.values_list(
+                Transaction.objects.filter(username=user_id, pk=pk),
+                ArchivedTransaction.objects.filter(username=user_id, pk=pk),
+                *TRANSACTION_SERIALIZER.attnames
+            )
+        ]
+    )
+    if not json_response['data']:
         json_response['error_message'] = 'Transaction not found'
-        json_response['data'] = []
     return JsonResponse(json_response)
 
 
+def parse_date(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date() if value else None
+
+
+def encode_cursor(row):
+    return f'{row["date"]}_{row["id"]}'
+
+
+def decode_cursor(cursor):
+    date, pk = cursor.split('_', 1)
+    return parse_date(date), int(pk)
+
+
+def summary_filters(request):
+    """account_id, date_from and date_to of the summaries and reports."""
+    return {
+        'account_id': int(request.GET.get('account_id')) if request.GET.get('account_id') else None,
+        'date_from': parse_date(request.GET.get('date_from')),
+        'date_to': parse_date(request.GET.get('date_to')),
+    }
+
+
+def summary_row(row):
+    """A rollups.summary row as JSON: amounts as numbers (as the serializers do), count as an int."""
+    return {
+        k: v.isoformat() if k == 'month' else v if k == 'count' else float(v)
+        for k, v in row.items()
+    }
+
+
+def transaction_filter(request, model=Transaction):
+    """Builds the user's transaction (or archived transaction) queryset from the journal filters in GET."""
+    qs = model.objects.filter(username=request.session['user'].get('user_id'))
+    if request.GET.get('account_id'):
+        qs = qs.filter(account_id=int(request.GET.get('account_id')))
+    if request.GET.get('date_from'):
+        qs = qs.filter(date__gte=parse_date(request.GET.get('date_from')))
+    if request.GET.get('date_to'):
+        qs = qs.filter(date__lte=parse_date(request.GET.get('date_to')))
+    if request.GET.get('checked'):
+        qs = qs.filter(checked=int(request.GET.get('checked')))
+    if request.GET.get('tag'):
+        qs = tags.filter_by_tag(qs, request.session['user'].get('user_id'), request.GET.get('tag'))
+    return qs
+
+
+def before_cursor(cursor_date, cursor_id):
+    """
+    Rows after the cursor, newest first. The date bound alone is what SQLite
+    seeks the (username|account, date, id) index on; the OR of the two cases would leave it
+    scanning every row newer than the cursor.
+    """
+    return Q(date__lte=cursor_date) & (Q(date__lt=cursor_date) | Q(date=cursor_date, id__lt=cursor_id))
+
+
+@query_budget(4)
+@require_login(response_type='json')
+@offload
+@conditional(user_stamp)
+def list_transactions(request):
+    """
+    Newest first, paged by a (date, id) cursor. Each page is an index range
+    seek on (username|account, date, id), so its cost does not depend on how
+    deep into the history the client is; the archive is read the same way
+    once the pages reach it.
+    """
+    json_response = {
+        'error_message': '',
+        'data': [],
+        'next_cursor': None
+    }
+    try:
+        limit = min(int(request.GET.get('limit', TRANSACTION_PAGE_SIZE)), TRANSACTION_PAGE_SIZE_MAX)
+        if limit < 1:
+            raise ValueError(limit)
+        qs = transaction_filter(request)
+        archived = transaction_filter(request, ArchivedTransaction)
+        if request.GET.get('cursor'):
+            cursor_date, cursor_id = decode_cursor(request.GET.get('cursor'))
+            qs = qs.filter(before_cursor(cursor_date, cursor_id))
+            archived = archived.filter(before_cursor(cursor_date, cursor_id))
+        rows = archive.values_list(qs, archived, *TRANSACTION_SERIALIZER.attnames)
+        page = [TRANSACTION_SERIALIZER.from_tuple(row) for row in rows.order_by('-date', '-id')[:limit + 1]]
+    except ValueError:
+        json_response['error_message'] = 'Invalid filter parameters'
+        return JsonResponse(json_response)
+    if len(page) > limit:
+        page = page[:limit]
+        json_response['next_cursor'] = encode_cursor(page[-1])
+    json_response['data'] = page
+    return JsonResponse(json_response)
+
+
+@query_budget(5)
+@require_login(response_type='json')
+@offload
+@conditional(user_stamp)
+def search_transactions(request):
+    json_response = {
+        'error_message': '',
+        'data': []
+    }
+    try:
+        limit = min(int(request.GET.get('limit', TRANSACTION_PAGE_SIZE)), SEARCH_RESULTS_MAX)
+        if limit < 1:
+            raise ValueError(limit)
+    except ValueError:
+        json_response['error_message'] = 'Invalid filter parameters'
+        return JsonResponse(json_response)
+    ids = search.search_ids(request.session['user'].get('user_id'), request.GET.get('q'), limit)
+    if ids:
+        rows = {
+            r['id']: r for r in TRANSACTION_SERIALIZER.serialize(Transaction.objects.filter(pk__in=ids, opening=False))
+        }
+        json_response['data'] = [rows[pk] for pk in ids if pk in rows]
+    return JsonResponse(json_response)
+
+
+@query_budget(3)
+@require_login(response_type='json')
+@offload
+@conditional(user_stamp)
+def transaction_summary(request):
+    json_response = {
+        'error_message': '',
+        'data': [],
+        'totals': {}
+    }
+    try:
+        months, totals = rollups.summary(
+            request.session['user'].get('user_id'),
+            **summary_filters(request)
+        )
+    except ValueError:
+        json_response['error_message'] = 'Invalid filter parameters'
+        return JsonResponse(json_response)
+    json_response['data'] = [summary_row(row) for row in months]
+    json_response['totals'] = summary_row(totals)
+    return JsonResponse(json_response)
+
+
+@query_budget(1)
+@require_login
+def export_transactions(request):
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in exports.WRITERS:
+        return HttpResponseBadRequest('Invalid export format')
+    try:
+        qs = transaction_filter(request)
+        archived = transaction_filter(request, ArchivedTransaction)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid filter parameters')
+    response = StreamingHttpResponse(
+        exports.WRITERS[export_format](qs, archived),
+        content_type=exports.CONTENT_TYPES[export_format]
+    )
+    response['Content-Disposition'] = f'attachment; filename="transactions.{export_format}"'
+    return response
+
+
+@query_budget(4)
 @require_login(response_type='json')
+@offload
+@conditional(user_stamp)
+def tag_summary(request):
+    json_response = {
+        'error_message': '',
+        'data': []
+    }
+    try:
+        rows = tags.summary(
+            request.session['user'].get('user_id'),
+            **summary_filters(request)
+        )
+    except ValueError:
+        json_response['error_message'] = 'Invalid filter parameters'
+        return JsonResponse(json_response)
+    json_response['data'] = [
+        {k: float(v) if k in ('income', 'expense', 'net') else v for k, v in row.items()}
+        for row in rows
+    ]
+    return JsonResponse(json_response)
+
+
+# Reports: computed on column arrays (see core.lib.reports), not model instances.
+# core.lib.reports is imported inside them, so NumPy loads with the first report
+# instead of in every process that reads the URLconf (manage.py checks do).
+@query_budget(3)
+@require_login(response_type='json')
+@offload
+@conditional(user_stamp)
+def report_totals(request):
+    json_response = {
+        'error_message': '',
+        'data': []
+    }
+    from .lib import reports
+    try:
+        frame = reports.load(request.session['user'].get('user_id'), **summary_filters(request))
+        json_response['data'] = reports.totals(
+            frame,
+            period=request.GET.get('period', 'month'),
+            by=request.GET.get('by') or None
+        )
+    except ValueError:
+        json_response['error_message'] = 'Invalid filter parameters'
+    return JsonResponse(json_response)
+
+
+@query_budget(3)
+@require_login(response_type='json')
+@offload
+@conditional(user_stamp)
+def report_trend(request):
+    json_response = {
+        'error_message': '',
+        'data': []
+    }
+    from .lib import reports
+    try:
+        window = int(request.GET.get('window', 3))
+        if window > REPORT_WINDOW_MAX:
+            raise ValueError(window)
+        frame = reports.load(request.session['user'].get('user_id'), **summary_filters(request))
+        json_response['data'] = reports.trend(frame, period=request.GET.get('period', 'month'), window=window)
+    except ValueError:
+        json_response['error_message'] = 'Invalid filter parameters'
+    return JsonResponse(json_response)
+
+
+@query_budget(4)
+@require_login(response_type='json')
+@offload
+@conditional(user_stamp)
+def report_top_expenses(request):
+    json_response = {
+        'error_message': '',
+        'data': []
+    }
+    from .lib import reports
+    try:
+        limit = min(int(request.GET.get('limit', REPORT_TOP_EXPENSES)), REPORT_TOP_EXPENSES_MAX)
+        if limit < 1:
+            raise ValueError(limit)
+        frame = reports.load(request.session['user'].get('user_id'), **summary_filters(request))
+    except ValueError:
+        json_response['error_message'] = 'Invalid filter parameters'
+        return JsonResponse(json_response)
+    ids = reports.top_expenses(frame, limit)
+    if ids:
+        rows = archive.values_list(
+            Transaction.objects.filter(pk__in=ids),
+            ArchivedTransaction.objects.filter(pk__in=ids),
+            *TRANSACTION_SERIALIZER.attnames
+        )
+        rows = {r['id']: r for r in map(TRANSACTION_SERIALIZER.from_tuple, rows)}
+        json_response['data'] = [rows[pk] for pk in ids]
+    return JsonResponse(json_response)
+
+
+@query_budget(23)
+@require_login(response_type='json')
+@offload
 def save_transaction(request, pk=None):
     if request.POST:
         json_response = {
             'error_message': '',
             'data': []
         }
+        previous = None
         if pk:
-            transaction = get_object_or_404(Transaction, username=request.session['user'].get('user_id'), pk=pk)
+            transaction = get_object_or_404(
+                Transaction, username=request.session['user'].get('user_id'), pk=pk, opening=False
+            )
+            previous = copy.copy(transaction)
         else:
             transaction = Transaction()
             transaction.username_id = request.session['user'].get('user_id')
-        transaction.date = datetime.datetime.strptime(request.POST.get('date'), '%Y-%m-%d').date()
+        transaction.date = parse_date(request.POST.get('date'))
         transaction.description = request.POST.get('description')
-        transaction.amount = float(request.POST.get('amount'))
+        try:
+            # Stored, balanced and rolled up as the same cents
+            transaction.amount = statements.parse_amount(request.POST.get('amount'))
+        except ValueError as e:
+            json_response['error_message'] = str(e)
+            return JsonResponse(json_response)
         transaction.checked = int(request.POST.get('checked'))
         transaction.account_id = int(request.POST.get('account_id')) if request.POST.get('account_id') else None
-        transaction.save()
-        json_response['data'].append(utils.model_row_as_dict(transaction))
+        if 'tags' in request.POST:
+            tags.set_tags(transaction, request.POST.get('tags'))
+            if len(tags.parse_tags(transaction.tags)) > tags.MAX_TAGS:
+                json_response['error_message'] = f'Too many tags, at most {tags.MAX_TAGS}'
+                return JsonResponse(json_response)
+        if transaction.account_id:
+            # The account balance is written too, so it must be one of the user's
+            get_object_or_404(Account, username=request.session['user'].get('user_id'), pk=transaction.account_id)
+        try:
+            archive.check_date(transaction.date, archive.cutoff(transaction.username_id))
+        except archive.ArchivedDateError as e:
+            json_response['error_message'] = str(e)
+            return JsonResponse(json_response)
+        with db_transaction.atomic():
+            if previous:
+                balances.remove(previous)
+            transaction.save()
+            balances.insert(transaction)
+            rollups.replace([previous] if previous else [], [transaction])
+            if 'tags' in request.POST:
+                tags.sync([transaction])
+        row = TRANSACTION_SERIALIZER.from_model(transaction)
+        events.publish(transaction.username_id, 'updated' if previous else 'created', row)
+        json_response['data'].append(row)
+        return JsonResponse(json_response)
+    raise Http404('Resource not found')
+
+
+# Bulk write, exempt (see query_budget): the item count does not add
+# queries, the accounts and months touched and the chunks of rows do
+@query_budget(None)
+@require_login(response_type='json')
+@offload
+def batch_transactions(request):
+    if request.method == 'POST':
+        json_response = {
+            'error_message': '',
+            'data': []
+        }
+        try:
+            items = json.loads(request.body.decode('utf-8'))
+        except ValueError:
+            items = None
+        if not isinstance(items, list):
+            json_response['error_message'] = 'Expected a JSON array of transaction changes'
+            return JsonResponse(json_response)
+        applied, json_response['data'] = batch.apply_batch(request.session['user'].get('user_id'), items)
+        if not applied:
+            json_response['error_message'] = 'Batch not applied, some items are invalid'
         return JsonResponse(json_response)
     raise Http404('Resource not found')
 
 
+# Bulk write, no budget (see query_budget)
+@query_budget(None)
+@require_login(response_type='json')
+def import_statement(request):
+    if request.method == 'POST' and 'statement' in request.FILES:
+        json_response = {
+            'error_message': '',
+            'data': []
+        }
+        statement = request.FILES['statement']
+        account_id = int(request.POST.get('account_id')) if request.POST.get('account_id') else None
+        if account_id:
+            get_object_or_404(Account, username=request.session['user'].get('user_id'), pk=account_id)
+        encoding = request.POST.get('encoding') or 'utf-8-sig'
+        stream = statements.text_stream(statement, encoding)
+        statement_format = request.POST.get('format') or statements.guess_format(statement.name)
+        if request.POST.get('background') == '1':
+            # Imported by run_worker from a copy of the file, the result is
+            # the job's (see list_jobs)
+            job = jobs.enqueue(
+                'import-statement',
+                owner_id=request.session['user'].get('user_id'),
+                user_id=request.session['user'].get('user_id'),
+                upload=jobs.save_upload(statement),
+                account_id=account_id,
+                statement_format=statement_format,
+                encoding=encoding
+            )
+            json_response['data'].append({'job_id': job.id})
+            return JsonResponse(json_response)
+        try:
+            imported, errors = statements.import_statement(
+                stream,
+                request.session['user'].get('user_id'),
+                account_id=account_id,
+                statement_format=statement_format
+            )
+            json_response['data'].append({
+                'imported': imported,
+                'errors': [{'line': line, 'error_message': message} for line, message in errors]
+            })
+        except statements.StatementError as e:
+            json_response['error_message'] = str(e)
+        return JsonResponse(json_response)
+    raise Http404('Resource not found')
+
+
+# Bulk write, no budget (see query_budget)
+@query_budget(None)
+@require_login(response_type='json')
+def reconcile_statement(request):
+    if request.method == 'POST' and 'statement' in request.FILES:
+        json_response = {
+            'error_message': '',
+            'data': []
+        }
+        statement = request.FILES['statement']
+        account_id = int(request.POST.get('account_id')) if request.POST.get('account_id') else None
+        if account_id:
+            get_object_or_404(Account, username=request.session['user'].get('user_id'), pk=account_id)
+        try:
+            result = reconcile.reconcile(
+                statements.text_stream(statement, request.POST.get('encoding') or 'utf-8-sig'),
+                request.session['user'].get('user_id'),
+                account_id=account_id,
+                statement_format=request.POST.get('format') or statements.guess_format(statement.name),
+                dry_run=request.POST.get('dry_run') == '1'
+            )
+        except statements.StatementError as e:
+            json_response['error_message'] = str(e)
+            return JsonResponse(json_response)
+        json_response['data'].append({
+            'matched': len(result['matches']),
+            'matches': [{'line': line, 'transaction_id': pk} for line, pk in result['matches']],
+            'unmatched_lines': [
+                {
+                    'line': line,
+                    'date': row['date'].isoformat(),
+                    'description': row['description'],
+                    'amount': float(row['amount']),
+                    'check_code': row['check_code'],
+                }
+                for line, row in result['unmatched_lines']
+            ],
+            'unmatched_transactions': [
+                {
+                    'id': candidate.id,
+                    'date': candidate.date.isoformat(),
+                    'description': candidate.description,
+                    'amount': float(candidate.amount),
+                }
+                for candidate in result['unmatched_transactions']
+            ],
+            'errors': [{'line': line, 'error_message': message} for line, message in result['errors']]
+        })
+        return JsonResponse(json_response)
+    raise Http404('Resource not found')
+
+
+@query_budget(2)
+@require_login(response_type='json')
+@offload
+def list_jobs(request):
+    """The user's JOBS_RECENT latest jobs, or with active=1 all those queued or running."""
+    json_response = {
+        'error_message': '',
+        'data': []
+    }
+    qs = Job.objects.filter(username=request.session['user'].get('user_id')).order_by('-created_at', '-id')
+    if request.GET.get('active') == '1':
+        qs = qs.filter(status__in=(Job.QUEUED, Job.RUNNING))
+    else:
+        qs = qs[:JOBS_RECENT]
+    json_response['data'] = JOB_SERIALIZER.serialize(qs)
+    return JsonResponse(json_response)
+
+
+@query_budget(2)
+@require_login(response_type='json')
+@offload
+def get_job(request, pk):
+    json_response = {
+        'error_message': '',
+        'data': []
+    }
+    json_response['data'] = JOB_SERIALIZER.serialize(
+        Job.objects.filter(username=request.session['user'].get('user_id'), pk=pk)
+    )
+    if not json_response['data']:
+        json_response['error_message'] = 'Job not found'
+    return JsonResponse(json_response)
+
+
+# Served by the live stream of core.asgi under ASGI; this is the catch-up
+# alone, the client connects again after EVENTS_RETRY ms
+@query_budget(1)
+@require_login(response_type='json')
+@offload
+def transaction_events(request):
+    """The user's events after the since cursor (or Last-Event-ID), as text/event-stream."""
+    user_id = request.session['user'].get('user_id')
+    cursor = request.headers.get('Last-Event-ID') or request.GET.get('since')
+    body = f'retry: {settings.EVENTS_RETRY}\n\n'
+    if cursor:
+        body += ''.join(event.encode() for event in events.catch_up(user_id, cursor))
+    response = HttpResponse(body, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+@query_budget(3)
 def logout(request):
     # Do the logout
     try:
@@ -227,3 +958,14 @@ def logout(request):
         pass
     request.session.flush()
     return redirect('core:index')
+
+
+@query_budget(0)
+def metrics(request):
+    token = settings.PROFILING_METRICS_TOKEN
+    # Never served without a token (check core.W002)
+    if not settings.PROFILING or not token:
+        raise Http404('Resource not found')
+    if request.META.get('HTTP_AUTHORIZATION') != f'Bearer {token}':
+        return HttpResponse(status=401)
+    return HttpResponse(profiling.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -2,6 +2,7 @@
 ASGI config for mireis project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+The live journal stream is served in front of Django (see core.asgi).
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
@@ -9,8 +10,17 @@ https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mireis.settings')
 
-application = get_asgi_application()
+# What get_asgi_application() does, with the handler of core.asgi
+django.setup(set_prefix=False)
+
+# Once the apps are set up
+from core.asgi import (  # noqa: E402
+    ASGIHandler,
+    route
+)
+
+application = route(ASGIHandler())
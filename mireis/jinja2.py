@@ -1,13 +1,24 @@
+import os
+
+from django.conf import settings
 from django.templatetags.static import static
 from django.urls import reverse
 
-from jinja2 import Environment
+from jinja2 import (
+    Environment,
+    FileSystemBytecodeCache
+)
 
 
 def environment(**options):
+    # Compiled templates are kept on disk, so new processes skip compiling
+    if settings.JINJA2_BYTECODE_CACHE_DIR and 'bytecode_cache' not in options:
+        os.makedirs(settings.JINJA2_BYTECODE_CACHE_DIR, exist_ok=True)
+        options['bytecode_cache'] = FileSystemBytecodeCache(settings.JINJA2_BYTECODE_CACHE_DIR)
     env = Environment(**options)
     env.globals.update({
         'static': static,
         'url': reverse,
     })
     return env
+
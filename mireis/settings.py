@@ -46,7 +46,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Outermost, so it times everything below it; does nothing unless PROFILING is on
+    'core.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # Ahead of sessions and the rest, which static files don't need
+    'core.middleware.StaticFilesMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -57,8 +61,40 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'mireis.urls'
 
+# Request profiling (core.lib.profiling): per view histograms served on
+# /metrics in the Prometheus text format, read with "Authorization: Bearer
+# <token>"; /metrics is not served without a token. Requests slower than
+# PROFILING_SLOW_REQUEST_MS are logged with their SQL, keeping the worst
+# PROFILING_SLOW_SAMPLES.
+PROFILING = env.bool('PROFILING', default=False)
+PROFILING_METRICS_TOKEN = env.str('PROFILING_METRICS_TOKEN', default='')
+PROFILING_SLOW_REQUEST_MS = env.int('PROFILING_SLOW_REQUEST_MS', default=500)
+PROFILING_SLOW_SAMPLES = env.int('PROFILING_SLOW_SAMPLES', default=10)
+
+# Per view query budgets (core.views.query_budget): "raise", "log" or "off".
+# The tests raise.
+QUERY_BUDGET = env.str('QUERY_BUDGET', default='log' if DEBUG else 'off')
+
 TEMPLATES = [
     {
+        # Jinja2 first: the views render core/jinja2/core/*.html.j2
+        'BACKEND': 'django.template.backends.jinja2.Jinja2',
+        'DIRS': [],
+        'APP_DIRS': True,
+        'OPTIONS': {
+            'environment': 'mireis.jinja2.environment',
+            # Templates are checked for changes on every render otherwise
+            'auto_reload': DEBUG,
+            'context_processors': [
+                'django.template.context_processors.debug',
+                'django.template.context_processors.request',
+                'django.contrib.messages.context_processors.messages',
+                'core.context_processors.accounts',
+            ],
+        },
+    },
+    {
+        # Django templates, kept for benchmarks.templates
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
@@ -68,21 +104,23 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'core.context_processors.accounts',
             ],
         },
     },
-    # {
-    #     'BACKEND': 'django.template.backends.jinja2.Jinja2',
-    #     'DIRS': [],
-    #     'APP_DIRS': True,
-    #     'OPTIONS': {
-    #         'environment': 'mireis.jinja2.environment'
-    #     },
-    # },
 ]
 
+# Compiled Jinja2 templates (empty: no bytecode cache)
+JINJA2_BYTECODE_CACHE_DIR = env.str('JINJA2_BYTECODE_CACHE_DIR', default=os.path.join(BASE_DIR, '.cache', 'jinja2'))
+
 WSGI_APPLICATION = 'mireis.wsgi.application'
 
+# Async JSON views (core.views.offload) run their sync body in a thread pool,
+# closing the old connections of their thread around it as Django does around
+# a request. True runs them all in one thread instead, as Django does for
+# sync views.
+ASYNC_VIEWS_THREAD_SENSITIVE = env.bool('ASYNC_VIEWS_THREAD_SENSITIVE', default=False)
+
 
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
@@ -91,9 +129,34 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'mireis.sqlite3'),
+        # Seconds a connection is kept open for the next requests (0: one per request)
+        'CONN_MAX_AGE': env.int('DATABASE_CONN_MAX_AGE', default=600),
     }
 }
 
+# PRAGMAs applied to every new SQLite connection (see core.lib.sqlite).
+# WAL lets readers work alongside the writer, busy_timeout (ms) makes a
+# writer wait for the lock instead of failing with "database is locked",
+# cache_size is in KiB when negative.
+SQLITE_PRAGMAS = {
+    'journal_mode': env.str('SQLITE_JOURNAL_MODE', default='wal'),
+    'synchronous': env.str('SQLITE_SYNCHRONOUS', default='normal'),
+    'busy_timeout': env.int('SQLITE_BUSY_TIMEOUT', default=5000),
+    'cache_size': env.int('SQLITE_CACHE_SIZE', default=-64000),
+    'mmap_size': env.int('SQLITE_MMAP_SIZE', default=256 * 1024 * 1024),
+    'temp_store': env.str('SQLITE_TEMP_STORE', default='memory'),
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+# Local memory (LRU, bounded by max_entries) unless CACHE_URL points to
+# another backend, e.g. filecache:///var/tmp/mireis or rediscache://host:6379/1
+
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://mireis?max_entries=5000&timeout=3600'),
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -133,3 +196,63 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.0/howto/static-files/
 
 STATIC_URL = '/static/'
+
+# collectstatic writes content hashed names and .gz/.br variants here (see
+# core.lib.assets); with STATIC_SERVE on core.middleware.StaticFilesMiddleware
+# serves them, hashed names with a one year immutable Cache-Control and the
+# others for STATIC_MAX_AGE seconds.
+STATIC_ROOT = env.str('STATIC_ROOT', default=os.path.join(BASE_DIR, 'staticfiles'))
+STATICFILES_STORAGE = 'core.lib.assets.CompressedManifestStaticFilesStorage'
+STATIC_SERVE = env.bool('STATIC_SERVE', default=True)
+STATIC_MAX_AGE = env.int('STATIC_MAX_AGE', default=3600)
+
+
+# Bank statement import
+# Number of transactions sent to the database in each bulk insert
+
+STATEMENT_IMPORT_BATCH_SIZE = env.int('STATEMENT_IMPORT_BATCH_SIZE', default=1000)
+
+# Account and user deletion (core.lib.purge)
+# Transactions deleted per database transaction, and whether deleting queues
+# a purge job for run_worker (otherwise run the purge_deleted command)
+
+PURGE_BATCH_SIZE = env.int('PURGE_BATCH_SIZE', default=500)
+PURGE_IN_BACKGROUND = env.bool('PURGE_IN_BACKGROUND', default=True)
+
+# Background jobs (core.lib.jobs, run by the run_worker command)
+# Attempts of a failing job, seconds before its first retry (doubled on each
+# one after), seconds between queue checks of an idle worker and seconds
+# without a heartbeat after which a running job is taken for lost and queued
+# again. Files
+# uploaded for a job (statements imported in the background) wait in
+# JOBS_UPLOAD_DIR, which run_worker must see too
+
+JOBS_MAX_ATTEMPTS = env.int('JOBS_MAX_ATTEMPTS', default=3)
+JOBS_RETRY_DELAY = env.int('JOBS_RETRY_DELAY', default=30)
+JOBS_POLL_INTERVAL = env.float('JOBS_POLL_INTERVAL', default=1.0)
+JOBS_STALE_AFTER = env.int('JOBS_STALE_AFTER', default=3600)
+JOBS_UPLOAD_DIR = env.str('JOBS_UPLOAD_DIR', default=os.path.join(BASE_DIR, '.cache', 'uploads'))
+
+# Yearly archival (core.lib.archive, archive_transactions command)
+# Years kept in the live table, the current one included
+
+ARCHIVE_KEEP_YEARS = env.int('ARCHIVE_KEEP_YEARS', default=3)
+
+# Live journal events (core.lib.events, streamed by mireis/asgi.py)
+# Events kept per user for clients catching up, for users seen in the last
+# EVENTS_IDLE_TIMEOUT seconds and EVENTS_MAX_USERS of them at most, seconds
+# between keep-alives of a stream (when changes made elsewhere are also
+# looked for) and the ms a client waits before connecting again
+
+EVENTS_BUFFER_SIZE = env.int('EVENTS_BUFFER_SIZE', default=200)
+EVENTS_IDLE_TIMEOUT = env.float('EVENTS_IDLE_TIMEOUT', default=300.0)
+EVENTS_MAX_USERS = env.int('EVENTS_MAX_USERS', default=10000)
+EVENTS_HEARTBEAT = env.float('EVENTS_HEARTBEAT', default=15.0)
+EVENTS_RETRY = env.int('EVENTS_RETRY', default=3000)
+
+# Statement reconciliation
+# Days a statement line and its transaction may be apart, and the least
+# description similarity (0 to 1, words in common) for a match
+
+RECONCILE_DATE_WINDOW = env.int('RECONCILE_DATE_WINDOW', default=3)
+RECONCILE_MIN_SIMILARITY = env.float('RECONCILE_MIN_SIMILARITY', default=0.0)